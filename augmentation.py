@@ -0,0 +1,225 @@
+import numpy as np
+
+import collections
+import time
+
+import parallel
+import profiling
+
+
+# On-the-fly augmentation of the training mini-batches
+#
+#     with augmentation.Augmentation(augmentation.Augmenter(shift=3, rotation=15), processes=2) as augment:
+#         network.train(x, y, 32, 10, augment=augment)
+#     print(augment.stats())
+#
+# Hand-drawn digits are off-center, tilted and thicker than the MNIST strokes. Augmenter applies random
+# sub-pixel shifts, small rotations and scales (one bilinear affine warp) and a 3x3 stroke dilation to a
+# whole batch of 28x28 images at once, every step is an array operation over the batch.
+# Augmentation runs the Augmenter on a spawned process pool: batches are sent as soon as the loader
+# gathers them and up to prefetch of them are augmented ahead of the training step, in order.
+# Every batch has its own random stream (seed and batch number), results do not depend on the pool size.
+
+SIDE = 28
+
+
+class Augmenter(object):
+    # shift: maximum translation in pixels, rotation: maximum angle in degrees,
+    # scale: maximum relative zoom (0.1 is 0.9x to 1.1x), thicken: probability of a stroke dilation
+
+    def __init__(self, shift=3.0, rotation=12.0, scale=0.1, thicken=0.5):
+        self.shift = shift
+        self.rotation = rotation
+        self.scale = scale
+        self.thicken = thicken
+
+        # Pixel centers relative to the image center, one column per output pixel (row, column)
+        rows, columns = np.mgrid[0:SIDE, 0:SIDE].astype(np.float64)
+        center = (SIDE - 1) / 2
+        self.grid = np.stack([rows.reshape(-1) - center, columns.reshape(-1) - center])
+
+    def __call__(self, images, random):
+        # images (m x 784) of uint8 or float pixels, returns new augmented images of the same dtype
+        m = images.shape[0]
+        output = np.asarray(images, dtype=np.float32).reshape(m, SIDE, SIDE)
+        if self.thicken > 0:
+            selected = random.random(m) < self.thicken
+            if np.any(selected):
+                output[selected] = self.dilate(output[selected])
+        output = self.warp(output, random)
+        if images.dtype == np.uint8:
+            np.clip(output, 0, 255, out=output)
+            np.rint(output, out=output)
+        return output.reshape(m, SIDE * SIDE).astype(images.dtype, copy=False)
+
+    @staticmethod
+    def dilate(images):
+        # Grayscale 3x3 maximum filter, strokes grow by one pixel on every side
+        padded = np.pad(images, ((0, 0), (1, 1), (1, 1)))
+        output = padded[:, 1:-1, 1:-1].copy()
+        for dy in range(3):
+            for dx in range(3):
+                np.maximum(output, padded[:, dy:dy + SIDE, dx:dx + SIDE], out=output)
+        return output
+
+    def warp(self, images, random):
+        # Every output pixel samples the source at A p + c - t (p relative to the center c),
+        # with A the inverse rotation and scale of the image and t its shift
+        m = images.shape[0]
+        angles = np.radians(random.uniform(-self.rotation, self.rotation, m))
+        scales = random.uniform(1 - self.scale, 1 + self.scale, m)
+        shifts = random.uniform(-self.shift, self.shift, (m, 2))
+        cos, sin = np.cos(angles) / scales, np.sin(angles) / scales
+        matrices = np.stack([np.stack([cos, -sin], axis=1), np.stack([sin, cos], axis=1)], axis=1)
+        source = np.matmul(matrices, self.grid) + ((SIDE - 1) / 2 - shifts)[:, :, np.newaxis]
+
+        # Bilinear sampling on images padded with a zero border, everything outside reads 0
+        np.clip(source, -1, SIDE, out=source)
+        corner = np.minimum(np.floor(source), SIDE - 1)
+        weight = (source - corner).astype(np.float32)
+        corner = corner.astype(np.intp) + 1
+        padded = np.pad(images, ((0, 0), (1, 1), (1, 1))).reshape(m, -1)
+        width = SIDE + 2
+        top = corner[:, 0] * width + corner[:, 1]
+
+        def gather(offset):
+            return np.take_along_axis(padded, top + offset, axis=1)
+
+        wy, wx = weight[:, 0], weight[:, 1]
+        upper = gather(0) * (1 - wx) + gather(1) * wx
+        lower = gather(width) * (1 - wx) + gather(width + 1) * wx
+        return (upper * (1 - wy) + lower * wy).reshape(m, SIDE, SIDE)
+
+
+_augmenter = None
+
+
+def _initialize(augmenter):
+    global _augmenter
+    _augmenter = augmenter
+
+
+def _augment_batch(images, seed):
+    # Pool task: augmented batch and the seconds spent on it
+    start = time.perf_counter()
+    output = _augmenter(images, np.random.default_rng(seed))
+    return output, time.perf_counter() - start
+
+
+class Augmentation(object):
+    # Augmentation stage of NeuralNetwork.train (augment=), runs an Augmenter on processes workers
+    # processes=0 augments in the training process itself, prefetch is the number of batches in flight
+    # The pool is started at the first epoch and kept until close
+
+    def __init__(self, augmenter=None, processes=1, prefetch=4, seed=None):
+        self.augmenter = augmenter or Augmenter()
+        self.processes = processes
+        self.prefetch = max(1, prefetch)
+        self.seed = seed
+        self.pool = None
+        # Seeds the batches, never reset so a new epoch does not replay the same transformations
+        self.batches_done = 0
+        # Random base of the epoch in progress (None between epochs) and number of batches delivered,
+        # saved in the checkpoints so a resumed epoch gets the same transformations
+        self.base = None
+        self.delivered = 0
+        self.resume_base = None
+        self.reset()
+
+    def reset(self):
+        # Counters of stats(), reset by NeuralNetwork.train at the start of every epoch
+        self.images = 0
+        self.worker_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def state_dict(self):
+        return {'base': self.base, 'batches_done': self.delivered}
+
+    def load_state_dict(self, state):
+        # The batches not delivered before the checkpoint are augmented again with the same seeds,
+        # a checkpoint taken mid-epoch also keeps the base of that epoch instead of drawing a new one
+        self.batches_done = self.delivered = state['batches_done']
+        self.resume_base = state['base']
+
+    def start(self):
+        if self.pool is None and self.processes > 0:
+            self.pool = parallel.process_pool(self.processes, 1, _initialize, (self.augmenter,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def batches(self, loader):
+        # Augmented (images, labels) of every batch of loader, in order
+        self.start()
+        # Without a seed the stream follows np.random, np.random.seed makes a run reproducible
+        if self.resume_base is not None:
+            base, self.resume_base = self.resume_base, None
+        else:
+            base = self.seed if self.seed is not None else int(np.random.randint(2 ** 31))
+        self.base = base
+        pending = collections.deque()
+        start = time.perf_counter()
+        try:
+            for images, labels in loader:
+                # The loader reuses its buffers, the batch is copied before it leaves
+                seed = [base, self.batches_done]
+                self.batches_done += 1
+                if self.pool is None:
+                    result = _SyncResult(self.augmenter, np.array(images), seed)
+                else:
+                    result = self.pool.apply_async(_augment_batch, (np.array(images), seed))
+                pending.append((result, np.array(labels), seed[1]))
+                if len(pending) >= self.prefetch:
+                    yield self._next(pending)
+            while pending:
+                yield self._next(pending)
+            self.base = None
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def _next(self, pending):
+        result, labels, number = pending.popleft()
+        self.delivered = number + 1
+        # Time the training step waits for the workers
+        with profiling.phase('augment'):
+            waiting = time.perf_counter()
+            images, seconds = result.get()
+            self.wait_seconds += time.perf_counter() - waiting
+        self.images += images.shape[0]
+        self.worker_seconds += seconds
+        return images, labels
+
+    def stats(self):
+        # images_per_sec: augmentation throughput of one worker, delivered_per_sec: rate at which the
+        # training loop consumed the batches, wait_seconds: time the training loop waited for the workers
+        return {
+            'images': self.images,
+            'images_per_sec': self.images / self.worker_seconds if self.worker_seconds else 0.0,
+            'delivered_per_sec': self.images / self.seconds if self.seconds else 0.0,
+            'wait_seconds': self.wait_seconds,
+        }
+
+
+class _SyncResult(object):
+    # Same get() as a pool result, computed on the spot
+
+    def __init__(self, augmenter, images, seed):
+        self.augmenter = augmenter
+        self.images = images
+        self.seed = seed
+
+    def get(self):
+        start = time.perf_counter()
+        output = self.augmenter(self.images, np.random.default_rng(self.seed))
+        return output, time.perf_counter() - start
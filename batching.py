@@ -0,0 +1,116 @@
+import numpy as np
+
+import queue
+import threading
+
+import profiling
+
+
+# Streaming mini-batch pipeline
+# Shuffled rows are gathered straight into a small ring of reusable batch buffers
+# by a background thread, so data preparation overlaps with the training step
+
+class BatchLoader(object):
+
+    def __init__(self, x, y, batch_size, indices=None, prefetch=2):
+        # x and y are indexed by rows, indices gives the order (defaults to all rows in order)
+        # The last batch is smaller when the row count is not divisible by batch_size
+        self.x = x
+        self.y = y
+        self.batch_size = batch_size
+        self.indices = np.arange(x.shape[0]) if indices is None else np.asarray(indices)
+        self.prefetch = max(1, prefetch)
+
+        # One buffer per prefetched batch plus the one used by the consumer
+        slots = self.prefetch + 1
+        self.data = np.empty((slots, batch_size) + x.shape[1:], dtype=x.dtype)
+        self.labels = np.empty((slots, batch_size) + y.shape[1:], dtype=y.dtype)
+
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return -(-self.indices.shape[0] // self.batch_size)
+
+    def _produce(self):
+        try:
+            for start in range(0, self.indices.shape[0], self.batch_size):
+                slot = self._free.get()
+                if self._stop.is_set():
+                    return
+                rows = self.indices[start:start + self.batch_size]
+                m = rows.shape[0]
+                np.take(self.x, rows, axis=0, out=self.data[slot, :m])
+                np.take(self.y, rows, axis=0, out=self.labels[slot, :m])
+                self._ready.put((slot, m))
+            self._ready.put(None)
+        except Exception as error:
+            self._ready.put(error)
+
+    def __iter__(self):
+        self.close()
+        self._stop.clear()
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        for slot in range(self.data.shape[0]):
+            self._free.put(slot)
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+        previous = None
+        try:
+            while True:
+                # Time spent waiting for the background thread
+                with profiling.phase('data'):
+                    item = self._ready.get()
+                # The consumer is done with the previous batch once it asks for the next one
+                if previous is not None:
+                    self._free.put(previous)
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                slot, m = item
+                previous = slot
+                yield self.data[slot, :m], self.labels[slot, :m]
+        finally:
+            self.close()
+
+    def close(self):
+        # Stops the background thread, e.g. when the consumer breaks out early
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._free.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Holdout(object):
+    # Training/validation split by 80% - 20%, see NeuralNetwork.train
+    # With reshuffle=False the validation rows stay the same for every epoch
+    # and only the order of the training rows changes
+
+    def __init__(self, samples, fraction=0.8, reshuffle=True):
+        self.samples = samples
+        self.training_size = int(round(samples * fraction))
+        self.reshuffle = reshuffle
+        self.training = None
+        self.validation = None
+
+    def split(self):
+        # Returns the training and validation indices for a new epoch
+        if self.reshuffle or self.training is None:
+            indices = np.random.permutation(self.samples)
+            self.training, self.validation = indices[:self.training_size], indices[self.training_size:]
+        else:
+            self.training = np.random.permutation(self.training)
+        return self.training, self.validation
@@ -0,0 +1,77 @@
+"""
+Augmentation benchmark: images/sec of the batch augmenter and its cost on a training epoch
+
+Run from the repository root:
+    python -m benchmarks.augmentation_benchmark [--batch-sizes 32 256] [--processes 0 1 2] [--synthetic]
+
+The first table times Augmenter on one batch in this process. The second trains one epoch of a
+OneHiddenLayer without augmentation, then with an Augmentation stage of each pool size (0 runs in the
+training process), and reports how long the training loop waited for augmented batches.
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+import augmentation
+import neural_network as nn
+from benchmarks.common import load_data
+
+
+def augmenter_rate(augmenter, images, min_time=1.0):
+    random = np.random.default_rng(0)
+    augmenter(images, random)
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        augmenter(images, random)
+        calls += 1
+    return calls * images.shape[0] / (time.perf_counter() - start)
+
+
+def train_epoch(train, batch_size, hidden, augment=None):
+    np.random.seed(0)
+    network = nn.OneHiddenLayer(784, hidden, 10)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        network.train(train['images'], train['labels'], batch_size, 1, augment=augment)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--training-samples', type=int, default=10000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 256])
+    parser.add_argument('--processes', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--hidden', type=int, default=512)
+    args = parser.parse_args()
+
+    train, _ = load_data(args.path, args.synthetic, args.training_samples)
+    augmenter = augmentation.Augmenter()
+
+    print("{:<12}{:>14}".format("Batch size", "Images/s"))
+    for batch_size in args.batch_sizes:
+        rate = augmenter_rate(augmenter, np.asarray(train['images'][:batch_size]))
+        print("{:<12}{:>14.0f}".format(batch_size, rate))
+
+    batch_size = args.batch_sizes[0]
+    print("\nOne epoch, batch size {}".format(batch_size))
+    print("{:<16}{:>10}{:>12}{:>14}".format("Augmentation", "Epoch s", "Waited s", "Worker img/s"))
+    print("{:<16}{:>10.2f}".format("none", train_epoch(train, batch_size, args.hidden)))
+    for processes in args.processes:
+        with augmentation.Augmentation(augmenter, processes=processes, seed=0) as augment:
+            # Pool start-up is kept out of the timing
+            augment.start()
+            seconds = train_epoch(train, batch_size, args.hidden, augment)
+            stats = augment.stats()
+        print("{:<16}{:>10.2f}{:>12.2f}{:>14.0f}".format(
+            "{} processes".format(processes), seconds, stats['wait_seconds'], stats['images_per_sec']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Checkpoint benchmark: resume parity and training-loop cost of checkpoints
+
+Run from the repository root:
+    python -m benchmarks.checkpoint_benchmark [--hidden 256] [--epochs 3] [--crash-batch 40] [--synthetic]
+
+Every run trains the same network without interruption, then again with a crash after --crash-batch
+mini-batches and a resume from the latest checkpoint. Both train paths (default and workspace=True), and
+the default one with in-process augmentation, are run with plain SGD and with Adam. The resumed weights
+and metrics have to match the uninterrupted run exactly, a difference of 0.
+"""
+
+import argparse
+import contextlib
+import io
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import augmentation
+import checkpoint
+import neural_network as nn
+import optimizers
+from benchmarks.common import load_data
+
+# Name, workspace and augmentation of the train paths
+PATHS = [
+    ('default', False, False),
+    ('workspace', True, False),
+    ('augment', False, True),
+]
+
+OPTIMIZERS = [
+    ('sgd', lambda: None),
+    ('adam', lambda: optimizers.Adam(0.001)),
+]
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingCheckpointer(checkpoint.Checkpointer):
+    # Fails the training after crash_batch mini-batches, as if the process had been killed
+
+    def __init__(self, directory, crash_batch, **kwargs):
+        super(CrashingCheckpointer, self).__init__(directory, **kwargs)
+        self.crash_batch = crash_batch
+
+    def due(self):
+        if self.batches + 1 > self.crash_batch:
+            raise Crash()
+        return super(CrashingCheckpointer, self).due()
+
+
+def train(train_set, args, workspace, augment, optimizer, checkpointer=None, resume_from=None):
+    # Returns the network and the training seconds, the output of train is silenced
+    np.random.seed(0)
+    network = nn.OneHiddenLayer(784, args.hidden, 10)
+    augment = augmentation.Augmentation(processes=0) if augment else None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        network.train(train_set['images'], train_set['labels'], args.batch_size, args.epochs, workspace=workspace,
+                      optimizer=optimizer(), checkpointer=checkpointer, resume_from=resume_from, augment=augment)
+    return network, time.perf_counter() - start
+
+
+def difference(network, reference):
+    # Largest absolute difference of the weights and of the recorded metrics
+    weights = max(float(np.max(np.abs(network.model[name] - reference.model[name]))) for name in network.model)
+    metrics = 0.0
+    for recorder, expected in ((network.metrics, reference.metrics), (network.validation, reference.validation)):
+        if recorder.view().shape != expected.view().shape:
+            return weights, float('inf')
+        metrics = max(metrics, float(np.max(np.abs(recorder.view() - expected.view()), initial=0.0)))
+    return weights, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--hidden', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--every-batches', type=int, default=7)
+    parser.add_argument('--crash-batch', type=int, default=40)
+    parser.add_argument('--training-samples', type=int, default=2000)
+    args = parser.parse_args()
+
+    train_set, _ = load_data(args.path, args.synthetic, args.training_samples)
+
+    print("{:<12}{:<8}{:>14}{:>14}{:>12}{:>14}".format(
+        "Path", "Optim", "Weights diff", "Metrics diff", "Plain s", "Checkpoint s"))
+    failed = False
+    for path, workspace, augment in PATHS:
+        for name, optimizer in OPTIMIZERS:
+            reference, plain = train(train_set, args, workspace, augment, optimizer)
+            directory = tempfile.mkdtemp(prefix="checkpoint_benchmark_")
+            try:
+                _, checkpointed = train(train_set, args, workspace, augment, optimizer,
+                                        checkpoint.Checkpointer(directory, every_batches=args.every_batches))
+                shutil.rmtree(directory)
+                try:
+                    train(train_set, args, workspace, augment, optimizer, CrashingCheckpointer(
+                        directory, args.crash_batch, every_batches=args.every_batches, epoch_end=False))
+                except Crash:
+                    pass
+                resumed, _ = train(train_set, args, workspace, augment, optimizer, resume_from=directory)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+            weights, metrics = difference(resumed, reference)
+            failed = failed or weights != 0 or metrics != 0
+            print("{:<12}{:<8}{:>14.3g}{:>14.3g}{:>12.2f}{:>14.2f}".format(
+                path, name, weights, metrics, plain, checkpointed))
+    print("Resume parity:", "FAILED" if failed else "exact")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import numpy as np
+
+import mnist_idx
+
+
+def synthetic_mnist(samples, seed=0):
+    # MNIST-shaped uint8 data with one noisy prototype per class, so networks can still learn it
+    # The prototypes are the same for every seed, so training and testing sets share their classes
+    prototypes = np.random.RandomState(0).randint(0, 256, size=(10, 784)).astype(np.float64)
+    random = np.random.RandomState(seed + 1)
+    labels = random.randint(0, 10, size=samples).astype(np.uint8)
+    images = 0.7 * prototypes[labels] + random.normal(0, 60, size=(samples, 784))
+    data_set = dict()
+    data_set['images'] = np.clip(images, 0, 255).astype(np.uint8)
+    data_set['labels'] = labels
+    return data_set
+
+
+def load_data(path="./MNIST_data_set", synthetic=False, training_samples=None):
+    # Returns the MNIST training and testing sets, falling back to synthetic data
+    # when the IDX image files are not available
+    if not synthetic:
+        try:
+            train, test = mnist_idx.load_mnist(path)
+        except (IOError, OSError, ValueError):
+            print("MNIST not found in", path, "using synthetic data")
+        else:
+            if training_samples is not None:
+                train = {'images': train['images'][:training_samples],
+                         'labels': train['labels'][:training_samples]}
+            return train, test
+
+    samples = 60000 if training_samples is None else training_samples
+    return synthetic_mnist(samples, seed=0), synthetic_mnist(10000, seed=1)
@@ -0,0 +1,70 @@
+"""
+Compression report: accuracy, latency and size of low-rank and pruned models
+
+Run from the repository root:
+    python -m benchmarks.compression_benchmark [--weights output/weights/network_two_512.nnw] [--fine-tune 1] [--synthetic]
+
+Without --weights a TwoHiddenLayer of --hidden units is trained for one epoch first.
+"""
+
+import argparse
+
+import numpy as np
+
+import compression
+import neural_network as nn
+import quantization
+from benchmarks.common import load_data
+
+
+def row(name, network, test, baseline=None):
+    _, accuracy = network.test(test['images'], test['labels'])
+    size = network.nbytes() if isinstance(network, compression.CompressedNetwork) else \
+        sum(weight.nbytes for weight in network.model.values())
+    timings = [quantization.latency(network.predict_proba, np.asarray(test['images'][:batch_size]))
+               for batch_size in (1, 256)]
+    delta = accuracy - (baseline if baseline is not None else accuracy)
+    print("{:<22}{:>10.4f}{:>+9.4f}{:>10.2f}M{:>11.3f}{:>12.3f}".format(
+        name, accuracy, delta, size / 2 ** 20, *timings))
+    return accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--weights', help="weights file to compress, trained from scratch when omitted")
+    parser.add_argument('--hidden', type=int, default=1024)
+    parser.add_argument('--training-samples', type=int, default=None)
+    parser.add_argument('--ranks', type=int, nargs='+', default=[256, 128, 64, 32, 16])
+    parser.add_argument('--sparsities', type=float, nargs='+', default=[0.5, 0.8, 0.9, 0.95, 0.98])
+    parser.add_argument('--fine-tune', type=int, default=0, metavar='EPOCHS',
+                        help="also report the accuracy after fine-tuning for this many epochs")
+    args = parser.parse_args()
+
+    train, test = load_data(args.path, args.synthetic, args.training_samples)
+    if args.weights:
+        network = nn.load_network(args.weights)
+    else:
+        np.random.seed(0)
+        network = nn.TwoHiddenLayer(784, args.hidden, args.hidden, 10)
+        network.train(train['images'], train['labels'], 32, 1, workspace=True)
+
+    print("{:<22}{:>10}{:>9}{:>11}{:>11}{:>12}".format("Model", "Accuracy", "Delta", "Size", "b1 ms", "b256 ms"))
+    baseline = row("dense", network, test)
+    for rank in args.ranks:
+        row("rank {}".format(rank), compression.compress(network, rank=rank), test, baseline)
+        if args.fine_tune:
+            tuned = compression.fine_tune(network, train['images'], train['labels'], rank=rank,
+                                          epochs=args.fine_tune, workspace=True)
+            row("rank {} tuned".format(rank), tuned, test, baseline)
+    for sparsity in args.sparsities:
+        row("sparsity {:.0%}".format(sparsity), compression.compress(network, sparsity=sparsity), test, baseline)
+        if args.fine_tune:
+            tuned = compression.fine_tune(network, train['images'], train['labels'], sparsity=sparsity,
+                                          epochs=args.fine_tune, workspace=True)
+            row("sparsity {:.0%} tuned".format(sparsity), tuned, test, baseline)
+
+
+if __name__ == "__main__":
+    main()
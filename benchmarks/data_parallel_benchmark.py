@@ -0,0 +1,47 @@
+"""
+Data-parallel training benchmark: epoch wall-time scaling from 1 to N worker processes
+
+Run from the repository root:
+    python -m benchmarks.data_parallel_benchmark [--workers 4] [--hidden 2048] [--synthetic]
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+import data_parallel
+import sweep
+from benchmarks.common import load_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--architecture', choices=sorted(sweep.ARCHITECTURES), default='two')
+    parser.add_argument('--hidden', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--training-samples', type=int, default=None)
+    args = parser.parse_args()
+
+    train, _ = load_data(args.path, args.synthetic, args.training_samples)
+
+    print("{:<10}{:>9}{:>14}{:>10}{:>12}".format("Mode", "Workers", "Epoch (s)", "Speedup", "Val. acc."))
+    for mode in data_parallel.MODES:
+        baseline = None
+        for workers in range(1, args.workers + 1):
+            np.random.seed(0)
+            network = sweep.build_network(args.architecture, 784, args.hidden, 10)
+            trainer = data_parallel.DataParallelTrainer(network, workers, mode, seed=0)
+            times = trainer.train(train['images'], train['labels'], args.batch_size, args.epochs)
+            epoch_time = float(np.mean(times))
+            baseline = baseline or epoch_time
+            print("{:<10}{:>9}{:>14.2f}{:>10.2f}{:>12.4f}".format(
+                mode, workers, epoch_time, baseline / epoch_time, network.validation.last('accuracy')))
+
+
+if __name__ == "__main__":
+    main()
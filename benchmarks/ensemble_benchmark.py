@@ -0,0 +1,44 @@
+"""
+Ensemble benchmark: accuracy of the voting modes and speedup of the shared first layer
+
+Run from the repository root:
+    python -m benchmarks.ensemble_benchmark [--names network_one_128 network_two_128] [--batch-sizes 1 32 1024]
+
+Uses every network of output/weights by default. Accuracy is measured on the MNIST testing set,
+or on synthetic data with --synthetic (only the timings are meaningful then).
+"""
+
+import argparse
+
+import ensemble
+from benchmarks.common import load_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--names', nargs='+', help="registry names, every network of output/weights by default")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32, 256, 1024])
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    _, test = load_data(args.path, args.synthetic, training_samples=1)
+    model = ensemble.Ensemble.from_registry(args.names)
+
+    print("{:<24}{:>10}".format("Model", "Accuracy"))
+    for name, network in zip(model.names, model.networks):
+        print("{:<24}{:>10.4f}".format(name, network.test(test['images'], test['labels'])[1]))
+    for voting in ensemble.VOTING:
+        accuracy = (model.predict(test['images'], voting=voting) == test['labels']).mean()
+        print("{:<24}{:>10.4f}".format("ensemble " + voting, accuracy))
+
+    print("\n{:<12}{:>16}{:>16}{:>10}".format("Batch size", "Sequential ms", "Ensemble ms", "Speedup"))
+    for batch_size in args.batch_sizes:
+        result = model.speedup(test['images'][:batch_size], args.repeats)
+        print("{:<12}{:>16.3f}{:>16.3f}{:>9.2f}x".format(
+            batch_size, result['sequential_ms'], result['ensemble_ms'], result['speedup']))
+
+
+if __name__ == "__main__":
+    main()
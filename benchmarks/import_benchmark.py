@@ -0,0 +1,62 @@
+"""
+Import-time benchmark: start-up cost of the modules used for inference
+
+Run from the repository root:
+    python -m benchmarks.import_benchmark [--repeats 5] [--weights output/weights/network_one_128.pickle]
+
+Every import runs in a fresh interpreter, the best of --repeats is kept. "matplotlib.pyplot" is the cost
+every import of neural_network and utils paid before plotting was imported lazily. The last row runs
+predict.py end to end on one image of Test_data.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+MODULES = ('numpy', 'matplotlib.pyplot', 'utils', 'neural_network', 'main', 'predict')
+
+# Prints the import seconds and whether matplotlib was loaded as a side effect
+PROBE = ("import sys, time; start = time.perf_counter(); import {}; "
+         "print(time.perf_counter() - start, 'matplotlib' in sys.modules)")
+
+
+def best(command, repeats):
+    # Best wall time of the process and the output of that run
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.check_output(command, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if result is None or elapsed < result[0]:
+            result = (elapsed, output.decode())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--weights', default="output/weights/network_one_128.pickle")
+    parser.add_argument('--image', default="Test_data/one_1.png")
+    args = parser.parse_args()
+
+    print("{:<22}{:>12}{:>14}{:>12}".format("Import", "Import ms", "Process ms", "matplotlib"))
+    for module in MODULES:
+        try:
+            wall, output = best([sys.executable, '-c', PROBE.format(module)], args.repeats)
+        except subprocess.CalledProcessError:
+            print("{:<22}{:>12}".format(module, "failed"))
+            continue
+        seconds, plotting = output.split()
+        print("{:<22}{:>12.1f}{:>14.1f}{:>12}".format(module, 1000 * float(seconds), 1000 * wall,
+                                                      "loaded" if plotting == 'True' else "-"))
+
+    wall, output = best([sys.executable, 'predict.py', args.weights, args.image], args.repeats)
+    prediction = json.loads(output)['predictions'][0]['prediction']
+    print("{:<22}{:>12}{:>14.1f}{:>12}".format("predict.py (1 image)", "", 1000 * wall, "-"))
+    print("Prediction of {}: {}".format(args.image, prediction))
+
+
+if __name__ == "__main__":
+    main()
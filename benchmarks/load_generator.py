@@ -0,0 +1,157 @@
+"""
+Load generator for the inference server: p50/p99 latency at a given request rate
+
+Run from the repository root, against a running server or one started for the run:
+    python -m benchmarks.load_generator --qps 500 [--duration 10] [--serve network_one_128 --max-batch-size 64]
+
+Requests are sent open-loop with Poisson arrivals, latency counts from the scheduled send time,
+so a slow server cannot hold back the load and hide its queueing delay.
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import load_data
+
+
+class ConnectionPool(object):
+    # Keep-alive connections, opened on demand up to a maximum
+
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.opened = 0
+        self.idle = asyncio.Queue()
+
+    async def acquire(self):
+        if self.idle.empty() and self.opened < self.size:
+            self.opened += 1
+            return await asyncio.open_connection(self.host, self.port)
+        return await self.idle.get()
+
+    def release(self, connection):
+        self.idle.put_nowait(connection)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait()[1].close()
+
+
+async def request(pool, method, path, body=b''):
+    # Returns the status and the decoded JSON body
+    reader, writer = connection = await pool.acquire()
+    try:
+        writer.write("{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/octet-stream\r\n"
+                     "Content-Length: {}\r\n\r\n".format(method, path, pool.host, len(body)).encode('latin-1') + body)
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        payload = json.loads((await reader.readexactly(length)).decode('utf-8'))
+    except Exception:
+        pool.opened -= 1
+        writer.close()
+        raise
+    pool.release(connection)
+    return status, payload
+
+
+async def send(pool, image, scheduled, results):
+    try:
+        status, _ = await request(pool, 'POST', '/predict', image.tobytes())
+    except (OSError, ValueError, asyncio.IncompleteReadError):
+        status = None
+    results.append((status, time.perf_counter() - scheduled))
+
+
+async def generate(host, port, images, qps, duration, connections, seed=0):
+    # Sends requests for duration seconds, returns (status, latency) pairs and the server stats
+    random = np.random.RandomState(seed)
+    pool = ConnectionPool(host, port, connections)
+    results = []
+    tasks = []
+    start = time.perf_counter()
+    scheduled = start
+    while scheduled - start < duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        image = images[random.randint(images.shape[0])]
+        tasks.append(asyncio.ensure_future(send(pool, image, scheduled, results)))
+        scheduled += random.exponential(1 / qps)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    _, stats = await request(pool, 'GET', '/stats')
+    pool.close()
+    return results, elapsed, stats
+
+
+def wait_for_port(host, port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start on {}:{}".format(host, port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--qps', type=float, default=200)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--connections', type=int, default=256)
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--serve', metavar='MODEL', help="start server.py with this network for the run")
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    _, test = load_data(args.path, args.synthetic)
+    images = np.asarray(test['images'][:1000])
+
+    server = None
+    if args.serve:
+        server = subprocess.Popen([sys.executable, 'server.py', '--model', args.serve, '--host', args.host,
+                                   '--port', str(args.port), '--max-batch-size', str(args.max_batch_size),
+                                   '--max-wait-ms', str(args.max_wait_ms)])
+    try:
+        wait_for_port(args.host, args.port)
+        results, elapsed, stats = asyncio.run(
+            generate(args.host, args.port, images, args.qps, args.duration, args.connections))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    statuses = [status for status, _ in results]
+    latencies = 1000 * np.array([latency for status, latency in results if status == 200])
+    print("Target {:.0f} QPS, achieved {:.0f} QPS over {:.1f} s".format(args.qps, len(latencies) / elapsed, elapsed))
+    print("Requests {}, ok {}, rejected (503) {}, failed {}".format(
+        len(results), statuses.count(200), statuses.count(503), statuses.count(None)))
+    if latencies.size:
+        print("Latency ms: p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}".format(
+            *np.percentile(latencies, [50, 90, 99, 100])))
+    print("Server: mean batch size {:.1f} (max {}), server-side p50 {:.2f} ms, p99 {:.2f} ms".format(
+        stats['mean_batch_size'], stats['max_batch_size'], stats['latency_ms']['p50'], stats['latency_ms']['p99']))
+
+
+if __name__ == "__main__":
+    main()
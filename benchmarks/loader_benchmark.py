@@ -0,0 +1,109 @@
+"""
+MNIST loader benchmark: python-mnist lists vs memory-mapped IDX files
+
+Run from the repository root:
+    python -m benchmarks.loader_benchmark [--path ./MNIST_data_set]
+
+Each loader runs in a fresh subprocess so the peak RSS is not polluted by
+the other one.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import mnist_idx
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024
+
+
+def run_python_mnist(path, batch_size):
+    # Current path in main(): lists of ints converted into a float64 array
+    from mnist import MNIST
+
+    start = time.perf_counter()
+    data = MNIST(path)
+    training_images, training_labels = data.load_training()
+    training_images = np.array(training_images) / 255
+    training_labels = np.array(training_labels)
+    ready = time.perf_counter() - start
+
+    checksum = 0.0
+    for i in range(0, training_images.shape[0], batch_size):
+        checksum += training_images[i:i + batch_size, 0].sum()
+    total = time.perf_counter() - start
+
+    return ready, total, checksum
+
+
+def run_idx(path, batch_size):
+    # Memory-mapped uint8 arrays normalized one mini-batch at a time
+    start = time.perf_counter()
+    train, _ = mnist_idx.load_mnist(path)
+    ready = time.perf_counter() - start
+
+    checksum = 0.0
+    for images, _ in mnist_idx.batches(train['images'], train['labels'], batch_size):
+        checksum += images[:, 0].sum()
+    total = time.perf_counter() - start
+
+    return ready, total, checksum
+
+
+LOADERS = {
+    'python-mnist': run_python_mnist,
+    'idx-mmap': run_idx,
+}
+
+
+def worker(name, path, batch_size):
+    try:
+        ready, total, _ = LOADERS[name](path, batch_size)
+    except ImportError as error:
+        print(json.dumps({'loader': name, 'skipped': str(error)}))
+        return
+    print(json.dumps({
+        'loader': name,
+        'startup_s': ready,
+        'full_pass_s': total,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--worker', choices=sorted(LOADERS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.path, args.batch_size)
+        return
+
+    print("{:<14}{:>12}{:>14}{:>15}".format("Loader", "Startup (s)", "Full pass (s)", "Peak RSS (MB)"))
+    for name in sorted(LOADERS, reverse=True):
+        output = subprocess.check_output([sys.executable, '-m', 'benchmarks.loader_benchmark',
+                                          '--worker', name, '--path', args.path,
+                                          '--batch-size', str(args.batch_size)])
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        if 'skipped' in result:
+            print("{:<14}skipped ({})".format(name, result['skipped']))
+            continue
+        print("{:<14}{:>12.3f}{:>14.3f}{:>15.1f}".format(
+            name, result['startup_s'], result['full_pass_s'], result['peak_rss_mb']))
+
+
+if __name__ == "__main__":
+    main()
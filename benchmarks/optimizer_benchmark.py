@@ -0,0 +1,66 @@
+"""
+Optimizer benchmark: wall-clock time to reach a target test accuracy
+
+Run from the repository root:
+    python -m benchmarks.optimizer_benchmark [--target 0.97] [--max-epochs 10] [--synthetic]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import optimizers
+import sweep
+from benchmarks.common import load_data
+
+
+def candidates(iterations):
+    # Optimizer factories, iterations is the total number of mini-batches for the schedules
+    return [
+        ('sgd', lambda: optimizers.SGD(0.0085)),
+        ('sgd step', lambda: optimizers.SGD(0.05, schedule=optimizers.StepDecay(max(1, iterations // 4)))),
+        ('sgd cosine', lambda: optimizers.SGD(0.05, schedule=optimizers.CosineDecay(iterations))),
+        ('momentum', lambda: optimizers.SGD(0.0085, momentum=0.9)),
+        ('nesterov', lambda: optimizers.SGD(0.0085, momentum=0.9, nesterov=True)),
+        ('adam', lambda: optimizers.Adam(0.001)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--architecture', choices=sorted(sweep.ARCHITECTURES), default='one')
+    parser.add_argument('--hidden', type=int, default=512)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--target', type=float, default=0.97)
+    parser.add_argument('--max-epochs', type=int, default=10)
+    parser.add_argument('--training-samples', type=int, default=None)
+    args = parser.parse_args()
+
+    train, test = load_data(args.path, args.synthetic, args.training_samples)
+    iterations = args.max_epochs * -(-int(round(train['images'].shape[0] * 0.8)) // args.batch_size)
+
+    print("{:<12}{:>8}{:>12}{:>14}".format("Optimizer", "Epochs", "Accuracy", "Time (s)"))
+    for name, factory in candidates(iterations):
+        np.random.seed(0)
+        network = sweep.build_network(args.architecture, 784, args.hidden, 10)
+        optimizer = factory()
+
+        elapsed = 0.0
+        accuracy = 0.0
+        epochs = 0
+        while epochs < args.max_epochs and accuracy < args.target:
+            start = time.perf_counter()
+            network.train(train['images'], train['labels'], args.batch_size, 1, workspace=True, optimizer=optimizer)
+            elapsed += time.perf_counter() - start
+            epochs += 1
+            _, accuracy = network.test(test['images'], test['labels'])
+
+        reached = "{:>14.1f}".format(elapsed) if accuracy >= args.target else "{:>14}".format("not reached")
+        print("{:<12}{:>8}{:>12.4f}".format(name, epochs, accuracy) + reached)
+
+
+if __name__ == "__main__":
+    main()
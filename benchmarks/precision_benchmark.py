@@ -0,0 +1,69 @@
+"""
+Precision benchmark: accuracy parity and throughput of float64 vs float32 vs float16 storage
+
+Run from the repository root:
+    python -m benchmarks.precision_benchmark [--hidden 2048] [--epochs 1] [--synthetic]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import neural_network as nn
+from benchmarks.common import load_data
+
+MODES = [
+    ('float64', np.float64, None),
+    ('float32', np.float32, None),
+    ('float16 storage', np.float32, np.float16),
+]
+
+
+def build(layers, hidden, dtype, storage_dtype):
+    if layers == 1:
+        return nn.OneHiddenLayer(784, hidden, 10, dtype=dtype, storage_dtype=storage_dtype)
+    return nn.TwoHiddenLayer(784, hidden, hidden, 10, dtype=dtype, storage_dtype=storage_dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--layers', type=int, choices=[1, 2], default=2)
+    parser.add_argument('--hidden', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--training-samples', type=int, default=None)
+    args = parser.parse_args()
+
+    train, test = load_data(args.path, args.synthetic, args.training_samples)
+    samples = train['images'].shape[0]
+
+    print("{:<16}{:>12}{:>12}{:>12}{:>16}{:>16}{:>14}".format(
+        "Mode", "Loss", "Accuracy", "vs float64", "Train (img/s)", "Test (img/s)", "Weights (MB)"))
+    reference = None
+    for name, dtype, storage_dtype in MODES:
+        # Same initial weights for every mode
+        np.random.seed(0)
+        network = build(args.layers, args.hidden, dtype, storage_dtype)
+
+        start = time.perf_counter()
+        network.train(train['images'], train['labels'], args.batch_size, args.epochs)
+        train_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loss, accuracy = network.test(test['images'], test['labels'])
+        test_time = time.perf_counter() - start
+
+        # Accuracy parity: difference with the first (float64) mode, on the same test set
+        if reference is None:
+            reference = accuracy
+        size = sum(weight.nbytes for weight in network.model.values()) / 2 ** 20
+        print("{:<16}{:>12.4f}{:>12.4f}{:>+12.4f}{:>16.0f}{:>16.0f}{:>14.1f}".format(
+            name, loss, accuracy, accuracy - reference, 0.8 * samples * args.epochs / train_time,
+            test['images'].shape[0] / test_time, size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Int8 quantization report: accuracy delta, model size and latency at batch sizes 1 and 256
+
+Run from the repository root:
+    python -m benchmarks.quantization_benchmark [--weights output/weights] [--calibration 2000] [--synthetic]
+"""
+
+import argparse
+import glob
+import os
+
+import numpy as np
+
+import neural_network as nn
+import quantization
+import weight_format
+from benchmarks.common import load_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default="./MNIST_data_set")
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--weights', default="output/weights")
+    parser.add_argument('--calibration', type=int, default=2000)
+    parser.add_argument('--kernel', choices=['auto', 'int32'], default='auto')
+    parser.add_argument('--save', action='store_true', help="write the int8 models next to the weight files")
+    args = parser.parse_args()
+
+    train, test = load_data(args.path, args.synthetic)
+    random = np.random.RandomState(0)
+    calibration = train['images'][np.sort(random.choice(train['images'].shape[0], args.calibration, False))]
+
+    print("{:<18}{:>10}{:>10}{:>8}{:>10}{:>9}{:>11}{:>11}{:>12}{:>12}".format(
+        "Network", "Acc f64", "Acc int8", "Delta", "Size f64", "Size i8",
+        "f64 b1 ms", "i8 b1 ms", "f64 b256 ms", "i8 b256 ms"))
+    filenames = glob.glob(os.path.join(args.weights, "*.pickle"))
+    filenames += glob.glob(os.path.join(args.weights, "*" + weight_format.EXTENSION))
+    for filename in sorted(filenames):
+        network = nn.load_network(filename)
+        quantized = quantization.QuantizedNetwork.calibrate(network, calibration, kernel=args.kernel)
+        if args.save:
+            quantized.save(os.path.splitext(filename)[0] + "_int8.npz")
+
+        _, accuracy = network.test(test['images'], test['labels'])
+        accuracy_int8 = np.mean(quantized.predict(test['images']) == test['labels'])
+        size = sum(weight.nbytes for weight in network.model.values())
+
+        timings = []
+        for batch_size in (1, 256):
+            batch = np.asarray(test['images'][:batch_size])
+            timings.append(quantization.latency(network.predict_proba, batch))
+            timings.append(quantization.latency(quantized.predict_proba, batch))
+
+        print("{:<18}{:>10.4f}{:>10.4f}{:>+8.4f}{:>9.2f}M{:>8.2f}M{:>11.3f}{:>11.3f}{:>12.3f}{:>12.3f}".format(
+            os.path.splitext(os.path.basename(filename))[0], accuracy, accuracy_int8, accuracy_int8 - accuracy,
+            size / 2 ** 20, quantized.nbytes() / 2 ** 20, *timings))
+
+
+if __name__ == "__main__":
+    main()
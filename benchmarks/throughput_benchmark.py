@@ -0,0 +1,220 @@
+"""
+Throughput benchmark: samples/sec of forward, dropout forward+backward and a train epoch
+
+Run from the repository root, on synthetic MNIST-shaped data:
+    python -m benchmarks.throughput_benchmark [--widths 128 512 2048] [--batch-sizes 1 32 256] [--threads 1 4]
+    python -m benchmarks.throughput_benchmark --output new.json --compare output/benchmarks/baseline.json
+    python -m benchmarks.throughput_benchmark --results new.json --compare output/benchmarks/baseline.json
+
+Each BLAS thread count runs in a fresh process, BLAS reads it once at import.
+The compare mode flags every result slower than the baseline by more than --tolerance
+and exits with status 1 when there is a regression.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import parallel
+import sweep
+from benchmarks.common import synthetic_mnist
+
+BENCHMARKS = ('forward', 'dropout_step', 'train_epoch')
+
+
+def rate(run, samples, min_time, repeats):
+    # Best samples/sec over repeats, each repeat calls run until min_time has passed
+    run()
+    best = 0.0
+    for _ in range(repeats):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, calls * samples / elapsed)
+    return best
+
+
+def measure(architecture, width, batch_size, data, args):
+    # samples/sec of every benchmark for one configuration
+    np.random.seed(0)
+    network = sweep.build_network(architecture, 784, width, 10)
+    batch = data['images'][:batch_size]
+    labels = data['labels'][:batch_size]
+
+    def dropout_step():
+        # Same calls as one mini-batch of the default train path
+        x = network.prepare_input(batch)
+        logits, d1 = network.forward_propagation_with_dropout(x, logits=True)
+        _, _, _, output_delta = network.softmax_cross_entropy(logits, labels, out=logits)
+        network.backward_propagation_with_dropout(x, labels, None, d1, 0.5, output_delta=output_delta)
+
+    def train_epoch():
+        # Epoch prints are kept out of the results on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            network.train(data['images'], data['labels'], batch_size, 1)
+
+    results = {
+        'forward': rate(lambda: network.forward(batch), batch_size, args.min_time, args.repeats),
+        'dropout_step': rate(dropout_step, batch_size, args.min_time, args.repeats),
+    }
+    if batch_size >= args.min_train_batch_size:
+        # One epoch is long enough on its own, timed once per repeat
+        results['train_epoch'] = rate(train_epoch, data['images'].shape[0], 0, args.repeats)
+    return results
+
+
+def worker(args):
+    # Runs every configuration with the BLAS thread count of this process
+    data = synthetic_mnist(args.samples, seed=0)
+    results = []
+    for architecture in args.architectures:
+        for width in args.widths:
+            for batch_size in args.batch_sizes:
+                rates = measure(architecture, width, batch_size, data, args)
+                for benchmark, value in rates.items():
+                    results.append({
+                        'benchmark': benchmark,
+                        'architecture': architecture,
+                        'width': width,
+                        'batch_size': batch_size,
+                        'threads': args.worker_threads,
+                        'samples_per_sec': value,
+                    })
+                    print(json.dumps(results[-1]), file=sys.stderr)
+    print(json.dumps(results))
+
+
+def key(result):
+    return "{benchmark}/{architecture}-{width}/b{batch_size}/t{threads}".format(**result)
+
+
+def environment():
+    # Metadata needed to tell whether two result files are comparable
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    blas = None
+    try:
+        config = np.show_config(mode='dicts')
+        blas = config.get('Build Dependencies', {}).get('blas')
+    except TypeError:
+        # NumPy before 1.25 only prints its configuration
+        pass
+    return {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'blas': blas,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(args):
+    results = []
+    for threads in args.threads:
+        command = [sys.executable, '-m', 'benchmarks.throughput_benchmark', '--worker-threads', str(threads),
+                   '--architectures'] + args.architectures + ['--widths'] + [str(w) for w in args.widths] + \
+                  ['--batch-sizes'] + [str(b) for b in args.batch_sizes] + \
+                  ['--samples', str(args.samples), '--repeats', str(args.repeats), '--min-time', str(args.min_time),
+                   '--min-train-batch-size', str(args.min_train_batch_size)]
+        with parallel.blas_threads(threads):
+            output = subprocess.check_output(command)
+        results += json.loads(output.decode().strip().splitlines()[-1])
+    return {'environment': environment(), 'settings': {'samples': args.samples, 'repeats': args.repeats,
+                                                       'min_time': args.min_time}, 'results': results}
+
+
+def compare(current, baseline, tolerance):
+    # Returns the regressions, prints every result next to its baseline
+    previous = {key(result): result['samples_per_sec'] for result in baseline['results']}
+    regressions = []
+    print("{:<40}{:>14}{:>14}{:>9}".format("Benchmark", "Baseline/s", "Current/s", "Change"))
+    for result in current['results']:
+        name = key(result)
+        if name not in previous:
+            continue
+        change = result['samples_per_sec'] / previous[name] - 1
+        flag = ""
+        if change < -tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("{:<40}{:>14.0f}{:>14.0f}{:>+8.1f}%{}".format(name, previous[name], result['samples_per_sec'],
+                                                           100 * change, flag))
+    for field in ('commit', 'numpy', 'blas', 'cpu_count'):
+        if current['environment'].get(field) != baseline['environment'].get(field):
+            print("Note: {} differs from the baseline: {} vs {}".format(
+                field, current['environment'].get(field), baseline['environment'].get(field)))
+    return regressions
+
+
+def print_results(report):
+    print("{:<40}{:>14}".format("Benchmark", "Samples/s"))
+    for result in report['results']:
+        print("{:<40}{:>14.0f}".format(key(result), result['samples_per_sec']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--architectures', nargs='+', choices=sorted(sweep.ARCHITECTURES), default=['one', 'two'])
+    parser.add_argument('--widths', type=int, nargs='+', default=[128, 256, 512, 1024, 2048])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32, 256])
+    parser.add_argument('--threads', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument('--samples', type=int, default=4096, help="synthetic rows of the train epoch")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--min-time', type=float, default=0.2, help="seconds per repeat of the batch benchmarks")
+    parser.add_argument('--min-train-batch-size', type=int, default=32,
+                        help="smaller batch sizes skip the train epoch benchmark")
+    parser.add_argument('--output', default="output/benchmarks/throughput.json")
+    parser.add_argument('--results', help="compare an existing result file instead of running")
+    parser.add_argument('--compare', metavar='BASELINE')
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed slowdown before flagging, 0.1 = 10%%")
+    parser.add_argument('--worker-threads', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker_threads is not None:
+        worker(args)
+        return
+
+    if args.results:
+        with open(args.results) as handle:
+            report = json.load(handle)
+    else:
+        report = run(args)
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print("Results written to", args.output)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        regressions = compare(report, baseline, args.tolerance)
+        print("{} regression(s) beyond {:.0f}%".format(len(regressions), 100 * args.tolerance))
+        if regressions:
+            sys.exit(1)
+    else:
+        print_results(report)
+
+
+if __name__ == "__main__":
+    main()
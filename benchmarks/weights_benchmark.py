@@ -0,0 +1,77 @@
+"""
+Weight file benchmark: load time of pickle vs the memory-mapped weight format
+
+Run from the repository root:
+    python -m benchmarks.weights_benchmark [--hidden 2048] [--drop-caches]
+
+Each load runs in a fresh subprocess. With --drop-caches (Linux, root) the page
+cache is dropped before every load for a truly cold start.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import neural_network as nn
+import weight_format
+
+
+def drop_caches():
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as handle:
+        handle.write('3\n')
+
+
+def worker(filename):
+    start = time.perf_counter()
+    network = nn.load_network(filename)
+    loaded = time.perf_counter() - start
+    network.predict_proba(np.zeros((1, 784), dtype=np.uint8))
+    print(json.dumps({'load_s': loaded, 'first_predict_s': time.perf_counter() - start}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hidden', type=int, nargs='+', default=[512, 2048])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--drop-caches', action='store_true')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker)
+        return
+
+    print("{:<20}{:>10}{:>12}{:>14}{:>20}".format("Network", "Format", "Size (MB)", "Load (ms)", "First predict (ms)"))
+    directory = tempfile.mkdtemp()
+    for hidden in args.hidden:
+        network = nn.TwoHiddenLayer(784, hidden, hidden, 10)
+        name = "network_two_{}".format(hidden)
+        for label, extension in (('pickle', '.pickle'), ('nnw', weight_format.EXTENSION)):
+            filename = os.path.join(directory, name + extension)
+            network.save(filename)
+
+            results = []
+            for _ in range(args.repeats):
+                if args.drop_caches:
+                    drop_caches()
+                output = subprocess.check_output([sys.executable, '-m', 'benchmarks.weights_benchmark',
+                                                  '--worker', filename])
+                results.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+            print("{:<20}{:>10}{:>12.1f}{:>14.2f}{:>20.2f}".format(
+                name, label, os.path.getsize(filename) / 2 ** 20,
+                1000 * np.median([result['load_s'] for result in results]),
+                1000 * np.median([result['first_predict_s'] for result in results])))
+            os.remove(filename)
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
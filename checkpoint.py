@@ -0,0 +1,239 @@
+import numpy as np
+
+import glob
+import json
+import os
+import threading
+import time
+
+
+# Periodic training checkpoints, written by a background thread
+#
+#     checkpointer = Checkpointer("output/checkpoints/two_2048", every_batches=500, every_seconds=300)
+#     network.train(x, y, 32, 10, checkpointer=checkpointer)
+#     network.train(x, y, 32, 10, resume_from="output/checkpoints/two_2048")   # after a crash
+#
+# A checkpoint holds the weights, the optimizer and early stopping state, the NumPy random states and
+# the augmentation seeds, the epoch/batch position with the holdout split of the epoch and the recorded metrics.
+# The training loop only copies the arrays. Files are written as .npz next to the target and renamed,
+# so a crash never leaves a partial checkpoint, and only the latest keep files are kept
+
+VERSION = 1
+PREFIX = "checkpoint_"
+EXTENSION = ".npz"
+
+
+def split_state(state, prefix=""):
+    # Nested dictionaries to a JSON tree and a flat dictionary of arrays, referenced from the tree by key
+    # Lists and tuples are walked as well, NumPy scalars become Python numbers
+    arrays = dict()
+    tree = {key: _split(value, prefix + key, arrays) for key, value in state.items()}
+    return tree, arrays
+
+
+def _split(value, path, arrays):
+    if isinstance(value, dict):
+        return {key: _split(item, path + "/" + key, arrays) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_split(item, "{}/{}".format(path, i), arrays) for i, item in enumerate(value)]
+    if isinstance(value, np.ndarray):
+        arrays[path] = value
+        return {'__array__': path}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def join_state(tree, arrays):
+    return {key: _join(value, arrays) for key, value in tree.items()}
+
+
+def _join(value, arrays):
+    if isinstance(value, dict):
+        if '__array__' in value:
+            return arrays[value['__array__']]
+        return join_state(value, arrays)
+    if isinstance(value, list):
+        return [_join(item, arrays) for item in value]
+    return value
+
+
+def snapshot(network, epoch, batch, batch_size, training_idx, validation_idx, early_stopping=None, augment=None):
+    # Copies everything needed to continue training after batch (already trained) of epoch
+    state = {
+        'version': VERSION,
+        'class': type(network).__name__,
+        'dtype': network.dtype.name,
+        'storage_dtype': network.storage_dtype.name,
+        'epoch': epoch,
+        'batch': batch,
+        'batch_size': batch_size,
+        'time': time.time(),
+        'model': {name: weight.copy() for name, weight in network.model.items()},
+        'training_idx': np.array(training_idx),
+        'validation_idx': np.array(validation_idx),
+        'random': np.random.get_state(legacy=False),
+        'metrics': network.metrics.state_dict(),
+        'validation': network.validation.state_dict(),
+    }
+    workspace = getattr(network, '_workspace', None)
+    if workspace is not None:
+        state['workspace_random'] = workspace.random.bit_generator.state
+    if network.optimizer is not None:
+        state['optimizer'] = network.optimizer.state_dict()
+    if early_stopping is not None:
+        state['early_stopping'] = early_stopping.state_dict()
+    if augment is not None:
+        state['augment'] = augment.state_dict()
+    return state
+
+
+def write(filename, state):
+    # Atomic write: readers only ever see complete checkpoints
+    tree, arrays = split_state(state)
+    temporary = filename + ".tmp"
+    with open(temporary, 'wb') as handle:
+        np.savez(handle, __state__=np.frombuffer(json.dumps(tree).encode('utf-8'), dtype=np.uint8), **arrays)
+    os.replace(temporary, filename)
+
+
+def checkpoints(directory):
+    # Checkpoint files of a directory, oldest first
+    return sorted(glob.glob(os.path.join(directory, PREFIX + "*" + EXTENSION)))
+
+
+def read(path):
+    # Reads a checkpoint file, or the latest checkpoint of a directory
+    if os.path.isdir(path):
+        files = checkpoints(path)
+        if not files:
+            raise IOError("No checkpoint in " + path)
+        path = files[-1]
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files}
+    tree = json.loads(arrays.pop('__state__').tobytes().decode('utf-8'))
+    if tree['version'] > VERSION:
+        raise ValueError("Unsupported checkpoint version {} in {}".format(tree['version'], path))
+    return join_state(tree, arrays)
+
+
+def restore(network, state, early_stopping=None, augment=None):
+    # Puts a checkpoint back into a network of the same architecture
+    # Returns the state, the caller continues from state['epoch'] and state['batch']
+    if state['class'] != type(network).__name__:
+        raise ValueError("Checkpoint of a {} cannot resume a {}".format(state['class'], type(network).__name__))
+    for name, weight in state['model'].items():
+        if network.model[name].shape != weight.shape:
+            raise ValueError("Checkpoint weight {} has shape {}, the network {}".format(
+                name, weight.shape, network.model[name].shape))
+        network.model[name] = weight.astype(network.storage_dtype)
+
+    if 'optimizer' in state:
+        if network.optimizer is None:
+            raise ValueError("The checkpoint has optimizer state, pass the same optimizer to train")
+        network.optimizer.load_state_dict(state['optimizer'])
+    if early_stopping is not None and 'early_stopping' in state:
+        early_stopping.load_state_dict(state['early_stopping'])
+    if 'augment' in state:
+        if augment is None:
+            raise ValueError("The checkpoint has augmentation state, pass the same augmentation to train")
+        augment.load_state_dict(state['augment'])
+
+    network.metrics.load_state_dict(state['metrics'])
+    network.validation.load_state_dict(state['validation'])
+    # Building a workspace draws its seed from np.random, so the global state is restored last
+    if 'workspace_random' in state:
+        network.workspace(state['batch_size']).random.bit_generator.state = state['workspace_random']
+    np.random.set_state(state['random'])
+    return state
+
+
+class Checkpointer(object):
+    # Saves a checkpoint every every_batches mini-batches and/or every every_seconds seconds,
+    # and at the end of every epoch with epoch_end=True
+    # Writes happen on a background thread. When a write is still running at the next checkpoint,
+    # the newer snapshot replaces the one waiting, training never waits for the disk
+
+    def __init__(self, directory, every_batches=None, every_seconds=None, keep=3, epoch_end=True):
+        self.directory = directory
+        self.every_batches = every_batches
+        self.every_seconds = every_seconds
+        self.keep = keep
+        self.epoch_end = epoch_end
+
+        self.batches = 0
+        self.last = time.perf_counter()
+        self.saved = 0
+        self.replaced = 0
+        self.error = None
+
+        self.condition = threading.Condition()
+        self.pending = None
+        self.writing = False
+        self.closed = False
+        self.thread = None
+
+    def due(self):
+        # Counts one mini-batch, True when a checkpoint is to be taken
+        self.batches += 1
+        if self.every_batches is not None and self.batches % self.every_batches == 0:
+            return True
+        return self.every_seconds is not None and time.perf_counter() - self.last >= self.every_seconds
+
+    def save(self, state):
+        # Queues a snapshot for the writer thread
+        if self.error is not None:
+            raise self.error
+        self.last = time.perf_counter()
+        with self.condition:
+            if self.thread is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self.closed = False
+                self.thread = threading.Thread(target=self._write, daemon=True)
+                self.thread.start()
+            if self.pending is not None:
+                self.replaced += 1
+            self.pending = state
+            self.condition.notify()
+
+    def _write(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                state, self.pending = self.pending, None
+                self.writing = True
+            try:
+                filename = os.path.join(self.directory, "{}{:06d}_{:08d}{}".format(
+                    PREFIX, state['epoch'], state['batch'], EXTENSION))
+                write(filename, state)
+                self.saved += 1
+                for old in checkpoints(self.directory)[:-self.keep]:
+                    os.remove(old)
+            except Exception as error:
+                self.error = error
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def wait(self):
+        # Blocks until every queued checkpoint is on disk
+        with self.condition:
+            while self.pending is not None or self.writing:
+                self.condition.wait()
+        if self.error is not None:
+            raise self.error
+
+    def close(self, raise_error=True):
+        # Writes what is left and stops the thread, then raises the error of a failed write unless raise_error is False
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None and raise_error:
+            raise self.error
@@ -0,0 +1,252 @@
+import numpy as np
+
+import evaluation
+import mnist_idx
+import neural_network as nn
+import optimizers
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+# Compressed inference for OneHiddenLayer/TwoHiddenLayer weights
+# Large layers are either factored with a truncated SVD into W ~ U V (rank r: r (in + out) values
+# instead of in out) or magnitude-pruned into a CSR sparse matrix. CompressedNetwork runs the same
+# forward pass as NeuralNetwork.forward_with with these kernels, fine_tune recovers accuracy with
+# the regular train loop
+
+# Rows of the input multiplied at once by the NumPy sparse kernel, bounds its gather buffer
+SPARSE_CHUNK = 2 ** 22
+
+
+class LowRank(object):
+    # W (in x out) ~ u (in x rank) v (rank x out), x W is computed as (x u) v
+
+    def __init__(self, u, v):
+        self.u = u
+        self.v = v
+        self.shape = (u.shape[0], v.shape[1])
+        self.dtype = u.dtype
+
+    @classmethod
+    def from_dense(cls, weight, rank):
+        u, s, vt = np.linalg.svd(np.asarray(weight, dtype=np.float64), full_matrices=False)
+        # Singular values go into u, both factors keep a similar scale
+        return cls((u[:, :rank] * s[:rank]).astype(weight.dtype), vt[:rank].astype(weight.dtype))
+
+    def dense(self):
+        return np.dot(self.u, self.v)
+
+    def matmul(self, x):
+        return np.dot(np.dot(x, self.u), self.v)
+
+    def nbytes(self):
+        return self.u.nbytes + self.v.nbytes
+
+    def arrays(self, name):
+        return {name + "_u": self.u, name + "_v": self.v}
+
+
+class SparseMatrix(object):
+    # W (in x out) stored as the CSR matrix of its transpose: one row per output unit, holding the
+    # kept weights and the input indices they multiply. With SciPy installed its CSR kernel is used
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = tuple(shape)
+        self.dtype = data.dtype
+        counts = np.diff(indptr)
+        self.nonempty = np.flatnonzero(counts)
+        self.starts = indptr[:-1][self.nonempty]
+        self.matrix = None
+        if scipy is not None:
+            self.matrix = scipy.sparse.csr_matrix((data, indices, indptr), shape=(self.shape[1], self.shape[0]))
+
+    @classmethod
+    def from_dense(cls, weight, mask=None):
+        # Keeps the weights where mask is True, by default the non-zero ones
+        transposed = np.ascontiguousarray(weight.T)
+        keep = transposed != 0 if mask is None else np.ascontiguousarray(mask.T)
+        rows, indices = np.nonzero(keep)
+        indptr = np.zeros(transposed.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=transposed.shape[0]), out=indptr[1:])
+        return cls(transposed[keep], indices.astype(np.int32), indptr, weight.shape)
+
+    def dense(self):
+        weight = np.zeros(self.shape, dtype=self.data.dtype)
+        rows = np.repeat(np.arange(self.shape[1]), np.diff(self.indptr))
+        weight[self.indices, rows] = self.data
+        return weight
+
+    def density(self):
+        return self.data.size / (self.shape[0] * self.shape[1])
+
+    def matmul(self, x):
+        if self.matrix is not None:
+            return np.ascontiguousarray(self.matrix.dot(x.T).T)
+        # Gather the inputs of every kept weight, multiply and sum the segments of each output unit
+        output = np.zeros((x.shape[0], self.shape[1]), dtype=np.result_type(x, self.data))
+        if self.data.size == 0:
+            return output
+        step = max(1, SPARSE_CHUNK // self.data.size)
+        for start in range(0, x.shape[0], step):
+            products = np.take(x[start:start + step], self.indices, axis=1)
+            products *= self.data
+            output[start:start + step, self.nonempty] = np.add.reduceat(products, self.starts, axis=1)
+        return output
+
+    def nbytes(self):
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes
+
+    def arrays(self, name):
+        return {name + "_data": self.data, name + "_indices": self.indices, name + "_indptr": self.indptr,
+                name + "_shape": np.array(self.shape)}
+
+
+class CompressedNetwork(object):
+    # Forward pass of NeuralNetwork.forward_with over dense, LowRank or SparseMatrix layers
+
+    def __init__(self, layers, dtype=np.float64):
+        self.layers = layers
+        self.dtype = np.dtype(dtype)
+
+    def logits(self, x):
+        x = mnist_idx.prepare_input(x, self.dtype)
+        for l, layer in enumerate(self.layers):
+            x = np.dot(x, layer) if isinstance(layer, np.ndarray) else layer.matmul(x)
+            if l < len(self.layers) - 1:
+                np.maximum(x, 0, out=x)
+        return x
+
+    def predict_proba(self, x):
+        logits = self.logits(x)
+        return nn.NeuralNetwork.softmax_cross_entropy(logits, out=logits)[3]
+
+    def predict(self, x):
+        return np.argmax(self.logits(x), axis=1)
+
+    def test(self, x, y, chunk_size=1024):
+        # Loss and accuracy like NeuralNetwork.test
+        result = self.evaluate(x, y, chunk_size, top_k=(1,))
+        return result.loss(), result.accuracy()
+
+    def evaluate(self, x, y=None, chunk_size=1024, top_k=evaluation.DEFAULT_TOP_K, workers=None):
+        # Streaming evaluation like NeuralNetwork.evaluate
+        return evaluation.evaluate(self.logits, self.layers[-1].shape[1], x, y, chunk_size, top_k, workers,
+                                   softmax_cross_entropy=nn.NeuralNetwork.softmax_cross_entropy)
+
+    def dense_weights(self):
+        # Weights dictionary (W1, W2, ...) with the compressed layers expanded
+        return {"W{}".format(l + 1): np.array(layer) if isinstance(layer, np.ndarray) else layer.dense()
+                for l, layer in enumerate(self.layers)}
+
+    def nbytes(self):
+        return sum(layer.nbytes if isinstance(layer, np.ndarray) else layer.nbytes() for layer in self.layers)
+
+    def save(self, filename):
+        arrays = dict()
+        for l, layer in enumerate(self.layers):
+            name = "W{}".format(l + 1)
+            if isinstance(layer, np.ndarray):
+                arrays[name] = layer
+            else:
+                arrays.update(layer.arrays(name))
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as arrays:
+            names = sorted({key.split('_')[0] for key in arrays.files}, key=lambda name: int(name[1:]))
+            layers = []
+            for name in names:
+                if name in arrays.files:
+                    layers.append(arrays[name])
+                elif name + "_u" in arrays.files:
+                    layers.append(LowRank(arrays[name + "_u"], arrays[name + "_v"]))
+                else:
+                    layers.append(SparseMatrix(arrays[name + "_data"], arrays[name + "_indices"],
+                                               arrays[name + "_indptr"], arrays[name + "_shape"]))
+        return cls(layers, layers[0].dtype)
+
+
+def _names(network, layers):
+    # The output layer is small, by default every other layer is compressed
+    return list(network.layer_names()[:-1]) if layers is None else list(layers)
+
+
+def prune_mask(weight, sparsity):
+    # True for the weights kept: the largest magnitudes, sparsity is the fraction removed
+    keep = int(round(weight.size * (1 - sparsity)))
+    if keep <= 0:
+        return np.zeros(weight.shape, dtype=bool)
+    threshold = np.partition(np.abs(weight).reshape(-1), weight.size - keep)[weight.size - keep]
+    return np.abs(weight) >= threshold
+
+
+def compress(network, rank=None, sparsity=None, layers=None):
+    # Low-rank factors of the given rank, or pruned to the given sparsity, of the layers (names)
+    if (rank is None) == (sparsity is None):
+        raise ValueError("Give either a rank or a sparsity")
+    names = _names(network, layers)
+    compressed = []
+    for name, weight in zip(network.layer_names(), network.inference_weights()):
+        if name not in names:
+            compressed.append(np.array(weight))
+        elif rank is not None:
+            compressed.append(LowRank.from_dense(weight, rank))
+        else:
+            compressed.append(SparseMatrix.from_dense(weight, prune_mask(weight, sparsity)))
+    return CompressedNetwork(compressed, network.dtype)
+
+
+class Masked(optimizers.Optimizer):
+    # Wraps an optimizer and zeroes the pruned weights after every update, the sparsity pattern stays fixed
+
+    def __init__(self, optimizer, masks):
+        super().__init__(optimizer.learning_rate, optimizer.schedule)
+        self.optimizer = optimizer
+        self.masks = masks
+
+    def update(self, model, names, gradients):
+        self.optimizer.update(model, names, gradients)
+        self.iterations = self.optimizer.iterations
+        for name, mask in self.masks.items():
+            model[name] *= mask
+
+    def state_dict(self):
+        return self.optimizer.state_dict()
+
+    def load_state_dict(self, state):
+        self.optimizer.load_state_dict(state)
+        self.iterations = self.optimizer.iterations
+
+
+def fine_tune(network, x, y, rank=None, sparsity=None, layers=None, epochs=1, batch_size=32, optimizer=None,
+              **train_options):
+    # Compresses the network, then trains a dense copy of the compressed weights with NeuralNetwork.train
+    # Pruned weights stay zero through the Masked optimizer, low-rank layers are factored again after every
+    # epoch (projected back to the rank). The original network is left untouched
+    compressed = compress(network, rank, sparsity, layers)
+    names = _names(network, layers)
+    dense = nn.network_from_weights(compressed.dense_weights(), network.dtype, network.dtype, type(network).__name__)
+
+    optimizer = optimizer or optimizers.SGD()
+    if sparsity is not None:
+        optimizer = Masked(optimizer, {name: dense.model[name] != 0 for name in names})
+
+    for _ in range(epochs):
+        dense.train(x, y, batch_size, 1, optimizer=optimizer, **train_options)
+        if rank is not None:
+            for name in names:
+                dense.model[name][...] = LowRank.from_dense(dense.model[name], rank).dense()
+
+    if sparsity is not None:
+        return CompressedNetwork([SparseMatrix.from_dense(weight, optimizer.masks[name])
+                                  if name in names else np.array(weight)
+                                  for name, weight in zip(dense.layer_names(), dense.inference_weights())],
+                                 network.dtype)
+    return compress(dense, rank=rank, layers=names)
@@ -0,0 +1,253 @@
+import multiprocessing as mp
+import numpy as np
+
+import copy
+import queue
+import time
+
+from metrics import MetricsRecorder
+import optimizers
+import parallel
+
+
+# Data-parallel training of a single network on several processes
+# The weights in network.model live in shared memory for the duration of the training
+#
+# sync:    every global batch is split across the workers, each one computes the gradients
+#          of its shard, then they are averaged and every worker updates its own block of rows
+#          with network.optimizer, which keeps the optimizer state of its rows. The blocks of state
+#          are gathered back into network.optimizer after every epoch. The optimizer has to update
+#          every element on its own, like SGD and Adam
+# hogwild: every worker trains on its own part of the epoch and updates the shared
+#          weights without any locking (https://arxiv.org/abs/1106.5730)
+#          Each worker would keep a diverging copy of an optimizer state, so only plain SGD is supported
+
+MODES = ('sync', 'hogwild')
+
+# Metrics per step and worker: summed loss, correct predictions and samples
+LOSS, CORRECT, COUNT = range(3)
+
+
+def _bounds(total, parts, index):
+    # Contiguous [start, stop) slice of total items for part index
+    return total * index // parts, total * (index + 1) // parts
+
+
+def _record(metrics, step, rank, losses, predictions, labels):
+    # Summed cross-entropy and correct predictions of a shard
+    metrics[step, rank, LOSS] = np.sum(losses)
+    metrics[step, rank, CORRECT] = np.count_nonzero(predictions == labels)
+    metrics[step, rank, COUNT] = labels.shape[0]
+
+
+def _sync_epoch(network, rank, workers, shared, gradients, barrier, total, batch_size, keep_prob, learning_rate,
+                random):
+    names = network.layer_names()
+    own = gradients[rank]
+    workspace = network.workspace(batch_size, seed=random)
+
+    for step in range(-(-total // batch_size)):
+        rows = shared['indices'][step * batch_size:min((step + 1) * batch_size, total)]
+        start, stop = _bounds(rows.shape[0], workers, rank)
+        if stop > start:
+            shard = rows[start:stop]
+            labels = shared['labels'][shard]
+            losses, predictions, shard_gradients = network.compute_gradients(shared['images'][shard], labels,
+                                                                             workspace, keep_prob)
+            # Weighted by the shard size so the sum over workers is the global batch mean
+            for gradient, shard_gradient in zip(own, shard_gradients):
+                np.multiply(shard_gradient, (stop - start) / rows.shape[0], out=gradient)
+            _record(shared['metrics'], step, rank, losses, predictions, labels)
+        else:
+            for gradient in own:
+                gradient.fill(0)
+            shared['metrics'][step, rank] = 0
+        barrier.wait()
+
+        # Partitioned reduction: each worker sums and applies its own block of rows
+        blocks = []
+        rows_of_weights = dict()
+        for l, name in enumerate(names):
+            first, last = _bounds(own[l].shape[0], workers, rank)
+            block = own[l][first:last]
+            for other in range(workers):
+                if other != rank:
+                    block += gradients[other][l][first:last]
+            blocks.append(block)
+            rows_of_weights[name] = network.model[name][first:last]
+        # Views of the shared weights, updated in place by network.optimizer or plain SGD
+        network.apply_gradients(blocks, learning_rate, model=rows_of_weights)
+        barrier.wait()
+
+
+def _hogwild_epoch(network, rank, workers, shared, total, batch_size, keep_prob, learning_rate, random):
+    first, last = _bounds(total, workers, rank)
+    rows = shared['indices'][first:last]
+    workspace = network.workspace(batch_size, seed=random)
+
+    for step, start in enumerate(range(0, rows.shape[0], batch_size)):
+        batch = rows[start:start + batch_size]
+        labels = shared['labels'][batch]
+        losses, predictions, batch_gradients = network.compute_gradients(shared['images'][batch], labels,
+                                                                         workspace, keep_prob)
+        # Lock-free update of the shared weights
+        network.apply_gradients(batch_gradients, learning_rate)
+        _record(shared['metrics'], step, rank, losses, predictions, labels)
+
+
+def _worker(rank, workers, mode, network, weights, data, gradients, barrier, control, done,
+            keep_prob, learning_rate, seed):
+    # Runs in a spawned process until it receives None
+    network.model = parallel.attach_dict(weights)
+    shared = parallel.attach_dict(data)
+    gradients = [[parallel.attach(gradient) for gradient in worker] for worker in gradients]
+    random = np.random.default_rng(None if seed is None else seed + rank)
+    optimizer = network.optimizer if mode == 'sync' else None
+    if optimizer is not None:
+        # The worker only keeps the state of its own block of rows
+        for name, slots in optimizer.state.items():
+            first, last = _bounds(network.model[name].shape[0], workers, rank)
+            for key in slots:
+                slots[key] = np.array(slots[key][first:last])
+
+    while True:
+        task = control.get()
+        if task is None:
+            break
+        total, batch_size = task
+        if mode == 'sync':
+            _sync_epoch(network, rank, workers, shared, gradients, barrier, total, batch_size,
+                        keep_prob, learning_rate, random)
+        else:
+            _hogwild_epoch(network, rank, workers, shared, total, batch_size, keep_prob, learning_rate, random)
+        done.put((rank, None if optimizer is None else optimizer.state_dict()))
+
+
+def _stateless(optimizer):
+    # True when the update only depends on the current gradient
+    return optimizer is None or (type(optimizer) is optimizers.SGD and optimizer.momentum == 0 and
+                                 optimizer.schedule is None)
+
+
+def _merge_optimizer(optimizer, states):
+    # Puts the blocks of optimizer state of the workers (in rank order) back together
+    slots = states[0]['slots']
+    optimizer.load_state_dict({
+        'iterations': states[0]['iterations'],
+        'slots': {name: {key: np.concatenate([state['slots'][name][key] for state in states])
+                         for key in slots[name]} for name in slots},
+    })
+
+
+class DataParallelTrainer(object):
+    # Trains a OneHiddenLayer/TwoHiddenLayer with the same holdout loop as NeuralNetwork.train
+    # Works with any network implementing compute_gradients/apply_gradients
+
+    def __init__(self, network, workers=2, mode='sync', threads=1, keep_prob=0.5, learning_rate=0.0085, seed=None):
+        if mode not in MODES:
+            raise ValueError("Unknown mode: " + str(mode))
+        self.network = network
+        self.workers = workers
+        self.mode = mode
+        self.threads = threads
+        self.keep_prob = keep_prob
+        self.learning_rate = learning_rate
+        self.seed = seed
+        self.epoch_times = []
+
+    def train(self, x, y, batch_size, epoch):
+        network = self.network
+        if self.mode == 'hogwild' and not _stateless(network.optimizer):
+            raise ValueError("hogwild mode only supports plain SGD, use sync mode with {}".format(
+                type(network.optimizer).__name__))
+        labels = np.asarray(y)
+        eighty = int(round(x.shape[0] * 0.8))
+        steps = -(-eighty // batch_size)
+
+        # Weights, data and gradients in shared memory
+        weights = parallel.share_dict(network.model)
+        network.model = parallel.attach_dict(weights)
+        data = parallel.share_dict({
+            'images': x,
+            'labels': labels,
+            'indices': np.arange(x.shape[0]),
+            'metrics': np.zeros((steps, self.workers, 3)),
+        })
+        shared = parallel.attach_dict(data)
+        gradients = []
+        if self.mode == 'sync':
+            gradients = [[parallel.share(np.zeros_like(network.model[name], dtype=network.dtype))
+                          for name in network.layer_names()] for _ in range(self.workers)]
+
+        # Workers only need the class and dtypes, the weights are attached from shared memory
+        skeleton = copy.copy(network)
+        skeleton.model = dict()
+        skeleton.metrics = MetricsRecorder()
+        skeleton.validation = MetricsRecorder()
+        skeleton.replay = None
+        skeleton.__dict__.pop('_workspace', None)
+        skeleton.__dict__.pop('_update_lock', None)
+
+        context = mp.get_context('spawn')
+        barrier = context.Barrier(self.workers)
+        done = context.Queue()
+        controls = [context.Queue() for _ in range(self.workers)]
+        processes = [context.Process(target=_worker, args=(
+            rank, self.workers, self.mode, skeleton, weights, data, gradients, barrier, controls[rank], done,
+            self.keep_prob, self.learning_rate, self.seed)) for rank in range(self.workers)]
+        with parallel.blas_threads(self.threads):
+            for process in processes:
+                process.start()
+
+        try:
+            for i in range(epoch):
+                print("Epoch #", i)
+                shared['indices'][:] = np.random.permutation(x.shape[0])
+                shared['metrics'].fill(0)
+
+                start = time.perf_counter()
+                for control in controls:
+                    control.put((eighty, batch_size))
+                states = self._wait(processes, done)
+                if network.optimizer is not None and self.mode == 'sync':
+                    _merge_optimizer(network.optimizer, states)
+                self.epoch_times.append(time.perf_counter() - start)
+
+                # Same bookkeeping as NeuralNetwork.train
+                metrics = shared['metrics'].sum(axis=1)
+                for step in range(steps):
+                    if metrics[step, COUNT] == 0 or not network.metrics.sample():
+                        continue
+                    network.metrics.record(i + step / steps, metrics[step, LOSS] / metrics[step, COUNT],
+                                           metrics[step, CORRECT] / metrics[step, COUNT])
+
+                validation_idx = shared['indices'][eighty:]
+                loss, accuracy = network.test(x, labels, rows=validation_idx)
+                network.validation.record(i + 1, loss, accuracy)
+        finally:
+            for control in controls:
+                control.put(None)
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+            # Back to private arrays
+            network.model = {name: weight.copy() for name, weight in network.model.items()}
+
+        return self.epoch_times
+
+    @staticmethod
+    def _wait(processes, done):
+        # Waits for every worker to finish the epoch, failing if one of them died
+        # Returns the optimizer states sent by the workers, in rank order
+        states = [None] * len(processes)
+        finished = 0
+        while finished < len(processes):
+            try:
+                rank, state = done.get(timeout=1)
+                states[rank] = state
+                finished += 1
+            except queue.Empty:
+                if not all(process.is_alive() for process in processes):
+                    raise RuntimeError("A training worker exited unexpectedly")
+        return states
@@ -0,0 +1,150 @@
+import numpy as np
+
+import time
+
+import evaluation
+import mnist_idx
+import neural_network as nn
+import profiling
+from registry import ModelRegistry
+
+
+# Ensemble of OneHiddenLayer/TwoHiddenLayer networks run as one model
+#
+#     ensemble = Ensemble.from_registry(["network_one_128", "network_one_256", "network_two_128"])
+#     ensemble.predict(x)                   # soft voting: weighted mean of the softmax outputs
+#     ensemble.predict(x, voting='hard')    # weighted majority of the predicted classes
+#     print(ensemble.speedup(x))
+#
+# Every network starts with x W1 on the same input. The first-layer weights of all networks are
+# concatenated column-wise, so the input is normalized once and read by a single large matmul
+# instead of one per network. The hidden columns of each network are then views of the shared output,
+# its remaining layers run on them as usual.
+
+VOTING = ('soft', 'hard')
+
+
+class Ensemble(object):
+
+    def __init__(self, networks, weights=None, names=None, voting='soft', dtype=None):
+        # weights: voting weight of each network, equal by default
+        if voting not in VOTING:
+            raise ValueError("voting is one of {}, not {}".format(VOTING, voting))
+        self.networks = list(networks)
+        self.names = list(names) if names is not None else [type(network).__name__ for network in self.networks]
+        self.voting = voting
+        weights = np.ones(len(self.networks)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.voting_weights = weights / weights.sum()
+        self.dtype = np.dtype(dtype) if dtype is not None else np.result_type(*[n.dtype for n in self.networks])
+
+        layers = [[np.asarray(weight, dtype=self.dtype) for weight in network.inference_weights()]
+                  for network in self.networks]
+        inputs = {network_weights[0].shape[0] for network_weights in layers}
+        classes = {network_weights[-1].shape[1] for network_weights in layers}
+        if len(inputs) != 1 or len(classes) != 1:
+            raise ValueError("Every network needs the same inputs and classes, got {} and {}".format(
+                sorted(inputs), sorted(classes)))
+        self.classes = classes.pop()
+
+        # Shared first layer, and the hidden columns of every network in it
+        self.first = np.concatenate([network_weights[0] for network_weights in layers], axis=1)
+        bounds = np.cumsum([0] + [network_weights[0].shape[1] for network_weights in layers])
+        self.columns = [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+        self.rest = [network_weights[1:] for network_weights in layers]
+
+    @classmethod
+    def from_files(cls, filenames, weights=None, voting='soft', dtype=None):
+        return cls([nn.load_network(filename) for filename in filenames], weights, filenames, voting, dtype)
+
+    @classmethod
+    def from_registry(cls, names=None, weights=None, voting='soft', dtype=None, registry=None):
+        # Networks of a ModelRegistry by name, by default every network of output/weights
+        registry = registry or ModelRegistry()
+        names = registry.names() if names is None else list(names)
+        return cls([registry.get(name) for name in names], weights, names, voting, dtype)
+
+    def prepare_input(self, x):
+        return mnist_idx.prepare_input(x, self.dtype)
+
+    def logits(self, x):
+        # Logits of every network, (networks x rows x classes)
+        with profiling.phase('forward'):
+            hidden = nn.NeuralNetwork.relu(profiling.dot(self.prepare_input(x), self.first))
+            output = np.empty((len(self.networks), x.shape[0], self.classes), dtype=self.dtype)
+            for n, (columns, weights) in enumerate(zip(self.columns, self.rest)):
+                activation = hidden[:, columns]
+                for weight in weights[:-1]:
+                    activation = nn.NeuralNetwork.relu(profiling.dot(activation, weight))
+                profiling.dot(activation, weights[-1], out=output[n])
+            return output
+
+    def probabilities(self, x):
+        # Softmax output of every network, (networks x rows x classes)
+        output = self.logits(x)
+        with profiling.phase('softmax'):
+            for n in range(output.shape[0]):
+                nn.NeuralNetwork.softmax_cross_entropy(output[n], out=output[n])
+        return output
+
+    def votes(self, probabilities, voting=None):
+        # Soft: weighted mean of the probabilities, hard: weighted share of the networks predicting each class
+        if (voting or self.voting) == 'soft':
+            return np.tensordot(self.voting_weights, probabilities, axes=1)
+        predictions = np.argmax(probabilities, axis=2)
+        votes = np.zeros(probabilities.shape[1:], dtype=self.dtype)
+        rows = np.arange(probabilities.shape[1])
+        for weight, predicted in zip(self.voting_weights, predictions):
+            votes[rows, predicted] += weight
+        return votes
+
+    def predict_proba(self, x, chunk_size=1024, voting=None):
+        # Ensemble scores by chunks of rows, soft voting gives probabilities
+        output = np.empty((x.shape[0], self.classes), dtype=self.dtype)
+        for start in range(0, x.shape[0], chunk_size):
+            output[start:start + chunk_size] = self.votes(self.probabilities(x[start:start + chunk_size]), voting)
+        return output
+
+    def predict(self, x, chunk_size=1024, voting=None):
+        # Hard voting ties go to the class with the highest soft vote
+        predictions = np.empty(x.shape[0], dtype=np.intp)
+        for start in range(0, x.shape[0], chunk_size):
+            probabilities = self.probabilities(x[start:start + chunk_size])
+            votes = self.votes(probabilities, voting)
+            if (voting or self.voting) == 'hard':
+                soft = self.votes(probabilities, 'soft')
+                votes = np.where(votes == votes.max(axis=1, keepdims=True), soft, -1)
+            predictions[start:start + chunk_size] = np.argmax(votes, axis=1)
+        return predictions
+
+    def evaluate(self, x, y=None, chunk_size=1024, top_k=evaluation.DEFAULT_TOP_K, workers=None):
+        # Streaming evaluation of the soft vote, its log is used as logits (softmax gives it back)
+        def logits(chunk):
+            return np.log(np.maximum(self.votes(self.probabilities(chunk), 'soft'), np.finfo(self.dtype).tiny))
+        return evaluation.evaluate(logits, self.classes, x, y, chunk_size, top_k, workers,
+                                   softmax_cross_entropy=nn.NeuralNetwork.softmax_cross_entropy)
+
+    def test(self, x, y, chunk_size=1024):
+        # Loss and accuracy of the soft vote, like NeuralNetwork.test
+        result = self.evaluate(x, y, chunk_size, top_k=(1,))
+        return result.loss(), result.accuracy()
+
+    def sequential_proba(self, x):
+        # Reference: every network's predict_proba on its own, then the same soft vote
+        probabilities = np.stack([network.predict_proba(x) for network in self.networks])
+        return np.tensordot(self.voting_weights, probabilities, axes=1)
+
+    def speedup(self, x, repeats=5):
+        # Best time of the shared first layer against the sequential calls, same inputs
+        def best(run):
+            run()
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        sequential = best(lambda: self.sequential_proba(x))
+        fused = best(lambda: self.predict_proba(x, chunk_size=max(1, x.shape[0]), voting='soft'))
+        return {'rows': x.shape[0], 'networks': len(self.networks), 'sequential_ms': 1000 * sequential,
+                'ensemble_ms': 1000 * fused, 'speedup': sequential / fused}
@@ -0,0 +1,161 @@
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import threading
+
+import profiling
+
+
+# Streaming evaluation: loss, accuracy, top-k accuracy, confusion matrix and per-class precision/recall
+#
+#     evaluation = network.evaluate(test['images'], test['labels'], chunk_size=1024, top_k=(1, 3))
+#     evaluation.loss(), evaluation.accuracy(), evaluation.top_k_accuracy(3)
+#     evaluation.precision(), evaluation.recall()
+#     evaluation.print_report()
+#
+# The input is read by chunks of rows: arrays and memory-mapped IDX files are sliced, so only one chunk is
+# normalized and run through the network at a time, and iterables yield (x, y) chunks of any size.
+# Every chunk is reduced to a few counts before it is merged, memory stays bounded by the chunk size
+# whatever the size of the data set. With a thread pool, at most two chunks per worker are in flight.
+
+DEFAULT_TOP_K = (1, 5)
+
+
+class Evaluation(object):
+    # Running totals of an evaluation, chunks are merged in any order
+
+    def __init__(self, classes, top_k=DEFAULT_TOP_K):
+        self.classes = classes
+        self.top_k = tuple(sorted(set(top_k)))
+        self.count = 0
+        self.loss_sum = 0.0
+        self.hits = np.zeros(len(self.top_k), dtype=np.int64)
+        # Rows are the true classes, columns the predicted ones
+        self.confusion = np.zeros((classes, classes), dtype=np.int64)
+        self.lock = threading.Lock()
+
+    def update(self, logits, labels, softmax_cross_entropy):
+        # Reduces one chunk of logits (overwritten) with its integer labels and merges it
+        labels = np.asarray(labels)
+        if labels.ndim > 1:
+            labels = np.argmax(labels, axis=1)
+        labels = labels.astype(np.intp, copy=False)
+
+        # Rank of the true class: number of classes with a strictly larger logit, a hit of top-k when below k
+        rows = np.arange(labels.shape[0])
+        ranks = np.count_nonzero(logits > logits[rows, labels][:, np.newaxis], axis=1)
+        hits = [np.count_nonzero(ranks < k) for k in self.top_k]
+
+        losses, _, predictions, _ = softmax_cross_entropy(logits, labels, out=logits)
+        confusion = np.bincount(labels * self.classes + predictions,
+                                minlength=self.classes * self.classes).reshape(self.classes, self.classes)
+        self.merge(labels.shape[0], float(np.sum(losses)), hits, confusion)
+
+    def merge(self, count, loss_sum, hits, confusion):
+        with self.lock:
+            self.count += count
+            self.loss_sum += loss_sum
+            self.hits += hits
+            self.confusion += confusion
+
+    def loss(self):
+        # Mean cross-entropy over every row
+        return self.loss_sum / self.count if self.count else 0.0
+
+    def accuracy(self):
+        return int(np.trace(self.confusion)) / self.count if self.count else 0.0
+
+    def top_k_accuracy(self, k):
+        if k not in self.top_k:
+            raise ValueError("Top-{} accuracy was not computed, top_k is {}".format(k, self.top_k))
+        return int(self.hits[self.top_k.index(k)]) / self.count if self.count else 0.0
+
+    def precision(self):
+        # Per class: correct predictions of the class over all predictions of it, 0 when never predicted
+        return self._ratio(np.diag(self.confusion), np.sum(self.confusion, axis=0))
+
+    def recall(self):
+        # Per class: correct predictions of the class over all rows of it, 0 when absent
+        return self._ratio(np.diag(self.confusion), np.sum(self.confusion, axis=1))
+
+    @staticmethod
+    def _ratio(numerator, denominator):
+        return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator > 0)
+
+    def report(self):
+        # Plain Python values, ready for JSON
+        return {
+            'count': self.count,
+            'loss': self.loss(),
+            'accuracy': self.accuracy(),
+            'top_k': {str(k): self.top_k_accuracy(k) for k in self.top_k},
+            'precision': self.precision().tolist(),
+            'recall': self.recall().tolist(),
+            'confusion': self.confusion.tolist(),
+        }
+
+    def print_report(self):
+        print("Rows: {}  Loss: {:.4f}  Accuracy: {:.4f}  {}".format(
+            self.count, self.loss(), self.accuracy(),
+            "  ".join("Top-{}: {:.4f}".format(k, self.top_k_accuracy(k)) for k in self.top_k)))
+        print("{:>6}{:>11}{:>9}  Confusion (rows: true, columns: predicted)".format("Class", "Precision", "Recall"))
+        for c, (precision, recall) in enumerate(zip(self.precision(), self.recall())):
+            print("{:>6}{:>11.4f}{:>9.4f}  {}".format(c, precision, recall,
+                                                      " ".join("{:>5}".format(n) for n in self.confusion[c])))
+
+
+def chunks(x, y=None, chunk_size=1024, rows=None):
+    # (x, y) chunks of rows: arrays and memmaps are sliced, anything else is iterated as (x, y) pairs
+    # rows restricts arrays to these row indices, gathered one chunk at a time in increasing order
+    if y is None:
+        for pair in x:
+            yield pair
+        return
+    if rows is not None:
+        rows = np.sort(rows)
+        for start in range(0, rows.shape[0], chunk_size):
+            idx = rows[start:start + chunk_size]
+            yield np.take(x, idx, axis=0), np.take(y, idx, axis=0)
+        return
+    for start in range(0, x.shape[0], chunk_size):
+        yield x[start:start + chunk_size], y[start:start + chunk_size]
+
+
+def evaluate(logits, classes, x, y=None, chunk_size=1024, top_k=DEFAULT_TOP_K, workers=None, executor=None,
+             softmax_cross_entropy=None, rows=None):
+    # logits is a function from a chunk of inputs to its logits (e.g. NeuralNetwork.logits_with
+    # with fixed weights), classes the width of the last layer, rows optional row indices (see chunks)
+    # Chunks run on executor, or on a pool of workers threads, NumPy releases the GIL inside BLAS
+    if softmax_cross_entropy is None:
+        from neural_network import NeuralNetwork
+        softmax_cross_entropy = NeuralNetwork.softmax_cross_entropy
+    evaluation = Evaluation(classes, top_k)
+
+    def run(chunk):
+        inputs, labels = chunk
+        output = logits(inputs)
+        with profiling.phase('loss'):
+            evaluation.update(output, labels, softmax_cross_entropy)
+
+    pool = executor
+    if pool is None and workers is not None and workers > 1:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        if pool is None:
+            for chunk in chunks(x, y, chunk_size, rows):
+                run(chunk)
+        else:
+            # Bounded number of chunks in flight, a generator is never read far ahead
+            limit = 2 * (workers or getattr(pool, '_max_workers', 1))
+            pending = collections.deque()
+            for chunk in chunks(x, y, chunk_size, rows):
+                if len(pending) >= limit:
+                    pending.popleft().result()
+                pending.append(pool.submit(run, chunk))
+            while pending:
+                pending.popleft().result()
+    finally:
+        if pool is not executor:
+            pool.shutdown()
+    return evaluation
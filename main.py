@@ -4,101 +4,43 @@ Created on Apr 27, 2018
 @author: J&J
 """
 
-from mnist import MNIST
 import numpy as np
-import neural_network as nn
+import checkpoint
+import mnist_idx
+from registry import ModelRegistry
+import sweep
 import utils as utl
+import weight_format
+
+
+# Trained networks, loaded on first use and shared by the tests below
+models = ModelRegistry()
 
 
 def main():
     # Loading MNIST data set
+    # Images are memory-mapped as uint8 and normalized one mini-batch at a time
     print("Loading MNIST data set...")
-    data = MNIST("./MNIST_data_set")
-    training_images, training_labels = data.load_training()
-    test_images, test_labels = data.load_testing()
-
-    # Converting to numpy arrays and normalizing images
-    print("Preparing data...")
-    training_images = np.array(training_images) / 255
-    training_labels = np.array(training_labels)
-    test_images = np.array(test_images) / 255
-    test_labels = np.array(test_labels)
-
-    train = dict()
-    train['images'] = training_images
-    train['labels'] = training_labels
-
-    test = dict()
-    test['images'] = test_images
-    test['labels'] = test_labels
-
-    # Getting dimensions
-    first_layer = training_images.shape[1]
-    last_layer = training_labels.max() + 1
-
-    # Creating neural network
-    print("ONE HIDDEN LAYER")
-    print("128")
-    neural_network = nn.OneHiddenLayer(first_layer, 128, last_layer)
-    train_network(neural_network, train, "one_128")
-    test_data(neural_network, test)
-
-    print("256")
-    neural_network = nn.OneHiddenLayer(first_layer, 256, last_layer)
-    train_network(neural_network, train, "one_256")
-    test_data(neural_network, test)
-
-    print("512")
-    neural_network = nn.OneHiddenLayer(first_layer, 512, last_layer)
-    train_network(neural_network, train, "one_512")
-    test_data(neural_network, test)
-
-    print("1024")
-    neural_network = nn.OneHiddenLayer(first_layer, 1024, last_layer)
-    train_network(neural_network, train, "one_1024")
-    test_data(neural_network, test)
-
-    print("2048")
-    neural_network = nn.OneHiddenLayer(first_layer, 2048, last_layer)
-    train_network(neural_network, train, "one_2048")
-    test_data(neural_network, test)
-
-    print("TWO HIDDEN LAYERS")
-    print("128")
-    neural_network = nn.TwoHiddenLayer(first_layer, 128, 128, last_layer)
-    train_network(neural_network, train, "two_128")
-    test_data(neural_network, test)
-
-    print("256")
-    neural_network = nn.TwoHiddenLayer(first_layer, 256, 256, last_layer)
-    train_network(neural_network, train, "two_256")
-    test_data(neural_network, test)
-
-    print("512")
-    neural_network = nn.TwoHiddenLayer(first_layer, 512, 512, last_layer)
-    train_network(neural_network, train, "two_512")
-    test_data(neural_network, test)
-
-    print("1024")
-    neural_network = nn.TwoHiddenLayer(first_layer, 1024, 1024, last_layer)
-    train_network(neural_network, train, "two_1024")
-    test_data(neural_network, test)
-
-    print("2048")
-    neural_network = nn.TwoHiddenLayer(first_layer, 2048, 2048, last_layer)
-    train_network(neural_network, train, "two_2048")
-    test_data(neural_network, test)
+    train, test = mnist_idx.load_mnist("./MNIST_data_set")
+
+    # Training every architecture of the grid in parallel
+    # Weights and plots are written into output/ as network_one_128, network_two_2048, ...
+    print("Training the architecture grid...")
+    results = sweep.run_sweep(sweep.grid(), train, test)
+    sweep.print_summary(results)
 
 
 def train_network(network, data, weights_file):
     # Training neural network
     print("Training...")
-    network.train(data['images'], data['labels'], 32, 4)
+    # Checkpoints every 5 minutes, a crashed run is continued with resume_from="output/checkpoints/..."
+    checkpointer = checkpoint.Checkpointer("output/checkpoints/network_" + weights_file, every_seconds=300)
+    network.train(data['images'], data['labels'], 32, 4, checkpointer=checkpointer)
     network.plot("network_"+weights_file)
 
     # Saving weights into file
     print("Saving weights")
-    network.save("output/weights/network_"+weights_file+".pickle")
+    network.save("output/weights/network_"+weights_file+weight_format.EXTENSION)
 
 
 def test_data(network, data):
@@ -110,75 +52,26 @@ def test_data(network, data):
 
 
 def test_custom_numbers():
-    network = nn.OneHiddenLayer(784, 128, 10)
-    network.load("output/weights/network_one_128.pickle")
-
-    print("Testing with a local image")
-    image = utl.load_image("Test_data/zero_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/one_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    # utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/two_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    # utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/three_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    # utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/four_2.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    # utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/five_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    # utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/six_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    # utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/seven_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    # utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/eight_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    # utl.plot_probability(probability[0])
-
-    image = utl.load_image("Test_data/nine_1.png")
-    utl.visualize_image(image, "TEST")
-    probability = network.forward(image)
-    print(np.argmax(probability))
-    utl.plot_probability(probability[0])
+    network = models.get("network_one_128")
+
+    print("Testing with local images")
+    files = ["Test_data/zero_1.png", "Test_data/one_1.png", "Test_data/two_1.png", "Test_data/three_1.png",
+             "Test_data/four_2.png", "Test_data/five_1.png", "Test_data/six_1.png", "Test_data/seven_1.png",
+             "Test_data/eight_1.png", "Test_data/nine_1.png"]
+    # Every image is preprocessed in one call and classified in a single forward
+    files, images = utl.load_images(files)
+    probability = network.forward(images)
+
+    for i, file in enumerate(files):
+        utl.visualize_image(images[i], "TEST")
+        print(file, np.argmax(probability[i]))
+        if i in (0, len(files) - 1):
+            utl.plot_probability(probability[i])
 
 
 def test_feed_backward():
     # Setting up neural network
-    network = nn.OneHiddenLayer(784, 128, 10)
-    network.load("output/weights/network_one_128.pickle")
+    network = models.get("network_one_128")
 
     labels = np.array([[1.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00],
                        [0.00, 1.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00],
@@ -0,0 +1,184 @@
+import numpy as np
+
+import os
+
+
+# Training metrics kept in preallocated NumPy buffers instead of Python lists
+# Every interval-th step is sampled, bucket samples are reduced into one row (min/mean/max per metric).
+# The buffer doubles up to max_rows, then either merges adjacent rows (overflow='downsample', the whole
+# run is kept at a coarser resolution) or overwrites the oldest rows (overflow='ring').
+# With stream, every row is also appended to a CSV file as soon as it is complete
+
+STATS = ('min', 'mean', 'max')
+
+
+class MetricsRecorder(object):
+
+    def __init__(self, names=('loss', 'accuracy'), interval=1, bucket=1, capacity=1024, max_rows=65536,
+                 overflow='downsample', stream=None):
+        if overflow not in ('downsample', 'ring'):
+            raise ValueError("Unknown overflow policy: " + overflow)
+        self.names = tuple(names)
+        self.interval = interval
+        self.bucket = bucket
+        self.max_rows = max_rows
+        self.overflow = overflow
+
+        # Columns: x, sample count, then min/mean/max of every metric
+        self.columns = ['x', 'count'] + ["{}_{}".format(name, stat) for name in self.names for stat in STATS]
+        self.rows = np.empty((min(capacity, max_rows), len(self.columns)))
+        self.size = 0
+        self.start = 0
+        self.steps = 0
+
+        # Bucket being filled, plain floats: with a few metrics they are faster than small arrays
+        self.pending = 0
+        self.pending_x = 0.0
+        self.pending_values = []
+
+        self.stream = None
+        if stream is not None:
+            directory = os.path.dirname(stream)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            new = not os.path.exists(stream) or os.path.getsize(stream) == 0
+            self.stream = open(stream, 'a')
+            if new:
+                self.stream.write(",".join(self.columns) + "\n")
+                self.stream.flush()
+
+    def sample(self):
+        # Counts one step, True when it is to be recorded: metrics only need computing then
+        self.steps += 1
+        return (self.steps - 1) % self.interval == 0
+
+    def record(self, x, *values):
+        # One sample, values in the order of names
+        # Kept as Python floats, NumPy scalars of the loss would leak into the checkpoints
+        values = [float(value) for value in values]
+        if self.pending == 0:
+            self.pending_values = [[value, value, value] for value in values]
+        else:
+            for stats, value in zip(self.pending_values, values):
+                stats[0] = min(stats[0], value)
+                stats[1] += value
+                stats[2] = max(stats[2], value)
+        self.pending += 1
+        self.pending_x += float(x)
+        if self.pending >= self.bucket:
+            self.emit()
+
+    def emit(self):
+        # Closes the pending bucket into a row
+        if self.pending == 0:
+            return
+        row = [self.pending_x / self.pending, self.pending]
+        for minimum, total, maximum in self.pending_values:
+            row += (minimum, total / self.pending, maximum)
+        self.append(row)
+        self.pending = 0
+        self.pending_x = 0.0
+
+        if self.stream is not None:
+            self.stream.write(",".join(repr(float(value)) for value in row) + "\n")
+            self.stream.flush()
+
+    def append(self, row):
+        capacity = self.rows.shape[0]
+        if self.size == capacity:
+            if capacity < self.max_rows:
+                rows = np.empty((min(2 * capacity, self.max_rows), len(self.columns)))
+                rows[:self.size] = self.view()
+                self.rows = rows
+                self.start = 0
+            elif self.overflow == 'downsample':
+                self.downsample()
+            else:
+                # The oldest row is overwritten
+                self.rows[self.start] = row
+                self.start = (self.start + 1) % capacity
+                return
+        self.rows[(self.start + self.size) % self.rows.shape[0]] = row
+        self.size += 1
+
+    def downsample(self):
+        # Merges pairs of adjacent rows, halving the resolution of the whole history
+        pairs = self.size // 2
+        first, second = self.rows[0:2 * pairs:2], self.rows[1:2 * pairs:2]
+        count = first[:, 1] + second[:, 1]
+        merged = np.empty((pairs, len(self.columns)))
+        merged[:, 0] = (first[:, 0] * first[:, 1] + second[:, 0] * second[:, 1]) / count
+        merged[:, 1] = count
+        merged[:, 2::3] = np.minimum(first[:, 2::3], second[:, 2::3])
+        merged[:, 3::3] = (first[:, 3::3] * first[:, 1:2] + second[:, 3::3] * second[:, 1:2]) / count[:, None]
+        merged[:, 4::3] = np.maximum(first[:, 4::3], second[:, 4::3])
+        if self.size % 2:
+            merged = np.vstack([merged, self.rows[self.size - 1:self.size]])
+        self.rows[:merged.shape[0]] = merged
+        self.size = merged.shape[0]
+        # Later samples are bucketed at the new resolution
+        self.bucket *= 2
+
+    def view(self):
+        # Rows in chronological order, a view when the buffer has not wrapped
+        if self.start == 0:
+            return self.rows[:self.size]
+        return np.roll(self.rows, -self.start, axis=0)[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def x(self):
+        return self.view()[:, 0]
+
+    def counts(self):
+        # Number of samples reduced into each row
+        return self.view()[:, 1]
+
+    def column(self, name, stat='mean'):
+        return self.view()[:, self.columns.index("{}_{}".format(name, stat))]
+
+    def last(self, name, stat='mean'):
+        return float(self.column(name, stat)[-1])
+
+    def state_dict(self):
+        # Recorded rows and sampling position, see checkpoint.py
+        return {
+            'rows': self.view().copy(),
+            'bucket': self.bucket,
+            'steps': self.steps,
+            'pending': self.pending,
+            'pending_x': self.pending_x,
+            'pending_values': [list(stats) for stats in self.pending_values],
+        }
+
+    def load_state_dict(self, state):
+        rows = np.asarray(state['rows'], dtype=np.float64).reshape(-1, len(self.columns))
+        self.rows = np.empty((max(self.rows.shape[0], rows.shape[0]), len(self.columns)))
+        self.rows[:rows.shape[0]] = rows
+        self.size = rows.shape[0]
+        self.start = 0
+        self.bucket = state['bucket']
+        self.steps = state['steps']
+        self.pending = state['pending']
+        self.pending_x = state['pending_x']
+        self.pending_values = [list(stats) for stats in state['pending_values']]
+
+    def close(self):
+        self.emit()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    @classmethod
+    def load(cls, filename, capacity=1024):
+        # Reads a streamed file back, e.g. to plot a run that is still going
+        with open(filename) as handle:
+            columns = handle.readline().strip().split(",")
+        names = [column[:-len('_min')] for column in columns[2::3]]
+        recorder = cls(names, capacity=capacity)
+        rows = np.loadtxt(filename, delimiter=",", skiprows=1, ndmin=2)
+        recorder.max_rows = max(recorder.max_rows, rows.shape[0])
+        for row in rows:
+            recorder.append(row)
+        return recorder
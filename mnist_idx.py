@@ -0,0 +1,97 @@
+import numpy as np
+import struct
+
+import os
+
+
+# IDX file format from: http://yann.lecun.com/exdb/mnist/
+# The header is two zero bytes, a type code, the number of dimensions and
+# then one big-endian uint32 per dimension. The raw data follows right after.
+
+IDX_TYPES = {
+    0x08: np.dtype(np.uint8),
+    0x09: np.dtype(np.int8),
+    0x0B: np.dtype('>i2'),
+    0x0C: np.dtype('>i4'),
+    0x0D: np.dtype('>f4'),
+    0x0E: np.dtype('>f8'),
+}
+
+# Same file names used by python-mnist
+TRAINING_FILES = ('train-images-idx3-ubyte', 'train-labels-idx1-ubyte')
+TESTING_FILES = ('t10k-images-idx3-ubyte', 't10k-labels-idx1-ubyte')
+
+
+def read_idx_header(filename):
+    # Returns the dtype, shape and data offset of an IDX file
+    with open(filename, 'rb') as handle:
+        magic = handle.read(4)
+        if len(magic) != 4:
+            raise ValueError("Invalid IDX file: " + filename)
+        zero, data_type, dimensions = struct.unpack('>HBB', magic)
+        if zero != 0 or data_type not in IDX_TYPES:
+            raise ValueError("Invalid IDX header in file: " + filename)
+        shape = struct.unpack('>' + 'I' * dimensions, handle.read(4 * dimensions))
+
+    return IDX_TYPES[data_type], shape, 4 + 4 * dimensions
+
+
+def read_idx(filename):
+    # Memory-maps an IDX file, no data is read or copied until it is used
+    dtype, shape, offset = read_idx_header(filename)
+
+    expected = offset + dtype.itemsize * int(np.prod(shape))
+    if os.path.getsize(filename) < expected:
+        raise ValueError("Truncated IDX file: " + filename)
+
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def load_images(filename):
+    # Images are returned flattened as (samples x pixels) uint8 rows
+    images = read_idx(filename)
+    return images.reshape(images.shape[0], -1)
+
+
+def load_labels(filename):
+    # Labels are returned as a (samples,) uint8 vector
+    return read_idx(filename)
+
+
+def load_mnist(path="./MNIST_data_set"):
+    # Returns the training and testing sets as dictionaries of raw uint8 arrays
+    # Normalization is left to the consumer, see normalize()
+    data = []
+    for images_file, labels_file in (TRAINING_FILES, TESTING_FILES):
+        data_set = dict()
+        data_set['images'] = load_images(os.path.join(path, images_file))
+        data_set['labels'] = load_labels(os.path.join(path, labels_file))
+        if data_set['images'].shape[0] != data_set['labels'].shape[0]:
+            raise ValueError("Images and labels count mismatch in " + path)
+        data.append(data_set)
+
+    return data[0], data[1]
+
+
+def normalize(images, dtype=np.float64, out=None):
+    # Scales uint8 pixels into [0, 1], meant to be used on one mini-batch at a time
+    if out is None:
+        out = np.empty(images.shape, dtype=dtype)
+    np.multiply(images, 1 / 255, out=out, casting='unsafe')
+    return out
+
+
+def prepare_input(x, dtype=np.float64):
+    # Network input in dtype: uint8 pixels are normalized, anything else is only converted
+    if x.dtype == np.uint8:
+        return normalize(x, dtype)
+    return np.asarray(x, dtype=dtype)
+
+
+def batches(images, labels, batch_size, dtype=np.float64):
+    # Yields normalized mini-batches in file order, the last one may be smaller
+    buffer = np.empty((batch_size, images.shape[1]), dtype=dtype)
+    for start in range(0, images.shape[0], batch_size):
+        stop = min(start + batch_size, images.shape[0])
+        out = buffer[:stop - start]
+        yield normalize(images[start:stop], out=out), np.asarray(labels[start:stop])
@@ -1,37 +1,218 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import pickle
 
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import os
+import threading
+
+from batching import BatchLoader, Holdout
+from metrics import MetricsRecorder
+import checkpoint
+import evaluation
+import mnist_idx
+import profiling
+import weight_format
+
+
+class Workspace(object):
+    # Preallocated buffers for an allocation-free training step
+    # Buffers are sized once per (batch size, layer widths, dtype) and reused for every mini-batch
+
+    def __init__(self, batch_size, widths, dtype=np.float64, seed=None):
+        self.batch_size = batch_size
+        self.widths = tuple(widths)
+        self.dtype = np.dtype(dtype)
+        # Generator.random only fills float32 or float64 buffers
+        random_dtype = np.float32 if self.dtype == np.float32 else np.float64
+        # Without a seed the dropout stream is drawn from np.random, so np.random.seed makes a run reproducible
+        self.random = np.random.default_rng(np.random.randint(2 ** 31) if seed is None else seed)
+
+        layers = len(self.widths) - 1
+        self.input = np.empty((batch_size, self.widths[0]), dtype=self.dtype)
+        # activations[l] is the output of layer l + 1, the last one holds the softmax
+        self.activations = [np.empty((batch_size, width), dtype=self.dtype) for width in self.widths[1:]]
+        self.deltas = [np.empty((batch_size, width), dtype=self.dtype) for width in self.widths[1:]]
+        self.positive = [np.empty((batch_size, width), dtype=bool) for width in self.widths[1:-1]]
+        self.gradients = [np.empty((self.widths[l], self.widths[l + 1]), dtype=self.dtype)
+                          for l in range(layers)]
+        # Compute copies of the weights, only used when the storage dtype differs
+        self.weights = [np.empty((self.widths[l], self.widths[l + 1]), dtype=self.dtype)
+                        for l in range(layers)]
+        self.uniform = np.empty((batch_size, self.widths[1]), dtype=random_dtype)
+        self.mask = np.empty((batch_size, self.widths[1]), dtype=bool)
+
+    def fits(self, batch_size, widths, dtype):
+        return self.batch_size == batch_size and self.widths == tuple(widths) and self.dtype == dtype
+
+    def rows(self, m):
+        # Workspace of a smaller (ragged) batch: views of the first m rows of the batch buffers,
+        # the gradients, weight copies and random generator are shared
+        view = copy.copy(self)
+        view.batch_size = m
+        view.input = self.input[:m]
+        view.activations = [activation[:m] for activation in self.activations]
+        view.deltas = [delta[:m] for delta in self.deltas]
+        view.positive = [positive[:m] for positive in self.positive]
+        view.uniform = self.uniform[:m]
+        view.mask = self.mask[:m]
+        return view
 
 
 class NeuralNetwork(object):
     # This class was initially based on:
     # https://dev.to/shamdasani/build-a-flexible-neural-network-with-backpropagation-in-python
 
-    def __init__(self):
+    def __init__(self, dtype=np.float64, storage_dtype=None):
         # Class initializations
+        # dtype is used for every computation, storage_dtype for the weights kept in self.model
+        # e.g. float16 storage with float32 compute halves the weights memory again
+        # Note: float16 storage is meant for inference, small training updates are lost when rounding
+        self.dtype = np.dtype(dtype)
+        self.storage_dtype = self.dtype if storage_dtype is None else np.dtype(storage_dtype)
         self.model = dict()
-        self.graph = dict()
-        self.graph['loss'] = []
-        self.graph['accuracy'] = []
-        self.graph['epoch'] = []
+        # Optional optimizer from optimizers.py, plain SGD when None
+        self.optimizer = None
+        # Loss and accuracy of the training mini-batches and of every validation, see metrics.py
+        self.metrics = MetricsRecorder()
+        self.validation = MetricsRecorder()
+        # Replay memory of partial_fit, see online.py
+        self.replay = None
 
     def forward(self, x):
         return np.array([])
 
-    def forward_propagation_with_dropout(self, x, keep_prob=0.5):
+    def forward_propagation_with_dropout(self, x, keep_prob=0.5, logits=False):
         return np.array([]), int
 
-    def backward(self, x, y, output, learning_rate=0.0085):
+    def backward(self, x, y, output, learning_rate=0.0085, output_delta=None):
         pass
 
-    def backward_propagation_with_dropout(self, x, y, output, d1, keep_prob, learning_rate=0.0085):
+    def backward_propagation_with_dropout(self, x, y, output, d1, keep_prob, learning_rate=0.0085,
+                                          output_delta=None):
         pass
 
     def feed_backward(self, y):
         return np.array([])
 
+    def init_weight(self, rows, columns, gain=1):
+        # Random initialization scaled by the number of inputs, see the subclasses for the gain
+        weight = gain * np.random.randn(rows, columns) / np.sqrt(rows)
+        return weight.astype(self.storage_dtype)
+
+    def weight(self, name):
+        # Returns a weight matrix in the compute dtype
+        return self.model[name].astype(self.dtype, copy=False)
+
+    def layer_names(self):
+        # Weight names in layer order: W1, W2, ...
+        return sorted(self.model, key=lambda name: int(name[1:]))
+
+    def widths(self):
+        # Layer widths from the input to the output layer
+        names = self.layer_names()
+        return [self.model[names[0]].shape[0]] + [self.model[name].shape[1] for name in names]
+
+    def workspace(self, batch_size, seed=None):
+        # Returns the cached workspace, reallocating it only when the shapes change
+        # seed is anything np.random.default_rng accepts, including a Generator
+        workspace = getattr(self, '_workspace', None)
+        if workspace is None or not workspace.fits(batch_size, self.widths(), self.dtype):
+            if seed is None and workspace is not None:
+                # Keeps the random stream going when the shapes change
+                seed = workspace.random
+            workspace = Workspace(batch_size, self.widths(), self.dtype, seed)
+            self._workspace = workspace
+        return workspace
+
+    def compute_gradients(self, x, y, workspace, keep_prob=0.5, model=None):
+        # Forward with dropout and backward using only the workspace buffers
+        # Same math as forward_propagation_with_dropout + backward_propagation_with_dropout:
+        # ReLU hidden layers, dropout after the first one and softmax with cross-entropy
+        # Returns the loss per row, the predictions and the weight gradients (in layer order),
+        # the gradients stay valid until the next call
+        # model replaces self.model, e.g. the private copy of the weights updated by partial_fit
+        model = self.model if model is None else model
+        names = self.layer_names()
+        m = x.shape[0]
+        if m < workspace.batch_size:
+            # Ragged batch, runs on row views so the batch-sized buffers stay cached for the next epoch
+            workspace = workspace.rows(m)
+        elif m > workspace.batch_size:
+            # Larger batch, the random generator carries over to the new buffers
+            workspace = self.workspace(m, seed=workspace.random)
+
+        with profiling.phase('forward'):
+            if x.dtype == np.uint8:
+                mnist_idx.normalize(x, out=workspace.input)
+            else:
+                np.copyto(workspace.input, x, casting='unsafe')
+
+            weights = []
+            for name, buffer in zip(names, workspace.weights):
+                if model[name].dtype == self.dtype:
+                    weights.append(model[name])
+                else:
+                    np.copyto(buffer, model[name], casting='unsafe')
+                    weights.append(buffer)
+
+            # Forward propagation
+            inputs = workspace.input
+            for l, (weight, activation) in enumerate(zip(weights, workspace.activations)):
+                profiling.dot(inputs, weight, out=activation)
+                if l == len(weights) - 1:
+                    break
+                np.maximum(activation, 0, out=activation)
+                if l == 0:
+                    # Dropout
+                    workspace.random.random(dtype=workspace.uniform.dtype, out=workspace.uniform)
+                    np.less(workspace.uniform, keep_prob, out=workspace.mask)
+                    np.multiply(activation, workspace.mask, out=activation)
+                    activation *= 1 / keep_prob
+                np.greater(activation, 0, out=workspace.positive[l])
+                inputs = activation
+
+        # Fused softmax with cross-entropy, the output gradient goes straight into the delta buffer
+        with profiling.phase('loss'):
+            losses, _, predictions, delta = self.softmax_cross_entropy(workspace.activations[-1], y,
+                                                                       out=workspace.deltas[-1])
+
+        # Backward propagation
+        with profiling.phase('backward'):
+            for l in range(len(weights) - 1, -1, -1):
+                previous = workspace.activations[l - 1] if l > 0 else workspace.input
+                profiling.dot(previous.T, delta, out=workspace.gradients[l])
+                if l > 0:
+                    previous_delta = workspace.deltas[l - 1]
+                    profiling.dot(delta, weights[l].T, out=previous_delta)
+                    np.multiply(previous_delta, workspace.positive[l - 1], out=previous_delta)
+                    if l == 1:
+                        previous_delta *= 1 / keep_prob
+                    delta = previous_delta
+
+        return losses, predictions, workspace.gradients
+
+    def apply_gradients(self, gradients, learning_rate=0.0085, model=None):
+        # Updates the weights (of model, self.model by default) with the gradients given in layer order
+        # The gradients are used as scratch buffers and overwritten
+        model = self.model if model is None else model
+        with profiling.phase('update'):
+            if self.optimizer is not None:
+                self.optimizer.update(model, self.layer_names(), gradients)
+                return
+
+            # Plain SGD
+            for name, gradient in zip(self.layer_names(), gradients):
+                gradient *= learning_rate
+                np.subtract(model[name], gradient, out=model[name], casting='same_kind')
+
+    def train_step(self, x, y, workspace, keep_prob=0.5, learning_rate=0.0085):
+        # Allocation-free forward, backward and update of one mini-batch
+        # Returns the loss per row and the predictions
+        losses, predictions, gradients = self.compute_gradients(x, y, workspace, keep_prob)
+        self.apply_gradients(gradients, learning_rate)
+        return losses, predictions
+
     # ReLU functions from https://stackoverflow.com/questions/32109319/how-to-implement-the-relu-function-in-numpy
 
     @staticmethod
@@ -41,13 +222,18 @@ class NeuralNetwork(object):
 
     @staticmethod
     def relu_prime(x):
-        # Derivative of Rectified Linear Units (ReLU)
-        return 1 * (x > 0)
+        # Derivative of Rectified Linear Units (ReLU), keeping the input dtype
+        return (x > 0).astype(x.dtype)
+
+    def prepare_input(self, x):
+        # Raw uint8 pixels (e.g. memory-mapped IDX images) are normalized here,
+        # so the full data set never has to be converted at once
+        return mnist_idx.prepare_input(x, self.dtype)
 
     @staticmethod
-    def to_one_hot(y):
+    def to_one_hot(y, dtype=np.float64):
         # Solution based on: https://stackoverflow.com/questions/29831489/numpy-1-hot-array
-        one_hot_vector = np.zeros((y.size, y.max() + 1))
+        one_hot_vector = np.zeros((y.size, int(y.max()) + 1), dtype=dtype)
         one_hot_vector[np.arange(y.size), y] = 1
         return one_hot_vector
 
@@ -60,8 +246,39 @@ class NeuralNetwork(object):
     @staticmethod
     def stable_softmax(x):
         # Based on: https://deepnotes.io/softmax-crossentropy
-        exp = np.exp(x - np.max(x))
-        return exp / np.sum(exp, axis=1, keepdims=True)
+        # Each row is shifted by its own maximum
+        return NeuralNetwork.softmax_cross_entropy(x)[3]
+
+    @staticmethod
+    def softmax_cross_entropy(logits, y=None, out=None):
+        # Fused softmax with cross-entropy on the logits of the last layer (examples x classes)
+        # Log-sum-exp with a per-row maximum: loss = log(sum(exp(z - max))) - (z[y] - max),
+        # so there is no log(0) and the softmax, loss, predictions and gradient share one pass
+        # y are integer (or one-hot) labels, out receives the averaged gradient (softmax - one_hot) / m
+        # and may be logits itself; without labels out receives the softmax and the losses are None
+        # Returns the loss per row, the mean loss, the argmax predictions and out
+        m = logits.shape[0]
+        rows = np.arange(m)
+        predictions = np.argmax(logits, axis=1)
+        row_max = logits[rows, predictions]
+
+        if y is not None:
+            if y.ndim > 1:
+                y = np.argmax(y, axis=1)
+            # Gathered before out may overwrite the logits
+            losses = row_max - logits[rows, y]
+
+        out = np.subtract(logits, row_max[:, np.newaxis], out=out)
+        np.exp(out, out=out)
+        sums = np.sum(out, axis=1)
+        out /= sums[:, np.newaxis]
+        if y is None:
+            return None, None, predictions, out
+
+        losses += np.log(sums)
+        out[rows, y] -= 1
+        out *= 1 / m
+        return losses, np.mean(losses), predictions, out
 
     # Cross-Entropy solution fetched from: Solution based on: https://deepnotes.io/softmax-crossentropy
 
@@ -102,160 +319,377 @@ class NeuralNetwork(object):
         # q is the result vector from softmax
         return q - p
 
+    # Integer label cross-entropy functions, no one-hot matrix is needed
+
+    @staticmethod
+    def sparse_cross_entropy(y, q):
+        # Returns a vector with loss per data
+        # y are the integer labels
+        # q is the result vector from softmax
+        return -np.log(q[np.arange(y.shape[0]), y])
+
+    @staticmethod
+    def sparse_cross_entropy_prime_with_softmax(y, q, out=None):
+        # Averaged gradient, the label entries are subtracted in place
+        # y are the integer labels
+        # q is the result vector from softmax
+        m = y.shape[0]
+        out = np.divide(q, m, out=out)
+        out[np.arange(m), y] -= 1 / m
+        return out
+
+    def output_delta(self, y, output):
+        # Softmax with cross-entropy gradient averaged over the batch
+        # y can be integer labels or one-hot vectors
+        if y.ndim == 1:
+            return self.sparse_cross_entropy_prime_with_softmax(y, output)
+        return self.one_hot_cross_entropy_prime_with_softmax(y, output) / y.shape[0]
+
     @staticmethod
     def cross_entropy_loss(p, q):
         # Returns a averaged value for all data
-        # p are the one-hot labels
+        # p are the integer or one-hot labels
         # q is the result vector from softmax
+        if p.ndim == 1:
+            return np.mean(NeuralNetwork.sparse_cross_entropy(p, q))
         return np.mean(NeuralNetwork.one_hot_cross_entropy(p, q))
 
     @staticmethod
     def accuracy(output, labels):
         # Gets the total element count
         total = output.shape[0]
-        # Gets the difference between the indices of the maximum values
-        difference = np.argmax(output, axis=1) - np.argmax(labels, axis=1)
-        # Counts the correct predictions (zeros)
-        correct = np.count_nonzero(difference == 0)
+        # Integer labels are compared directly, one-hot labels by the indices of their maximum values
+        if labels.ndim > 1:
+            labels = np.argmax(labels, axis=1)
+        # Counts the correct predictions
+        correct = np.count_nonzero(np.argmax(output, axis=1) == labels)
         return correct / total
 
     # Save/Load weights from: https://stackoverflow.com/questions/11218477/how-can-i-use-pickle-to-save-a-dict
 
     def save(self, filename):
-        # Saves weights in file
-        with open(filename, 'wb') as handle:
-            pickle.dump(self.model, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        # Saves weights in file, using the self-describing format of weight_format.py
+        # Files ending with .pickle keep the old format
+        if filename.endswith('.pickle'):
+            with open(filename, 'wb') as handle:
+                pickle.dump(self.model, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            return
+        weight_format.write(filename, self.model, type(self).__name__, self.dtype)
 
     def load(self, filename):
-        # Loads weights from file
-        with open(filename, 'rb') as handle:
-            self.model = pickle.load(handle)
-
-    def plot(self, path):
-        # The plot shows the learning behavior
-
+        # Loads weights from file, converting them to the storage dtype
+        # Weight files are memory-mapped (copy-on-write), old pickles are deserialized
+        self.model = {name: weight.astype(self.storage_dtype, copy=False)
+                      for name, weight in read_weights(filename)[1].items()}
+
+    @classmethod
+    def from_model(cls, model, dtype=np.float64, storage_dtype=None):
+        # Builds a network around existing weights, skipping the random initialization
+        network = cls.__new__(cls)
+        NeuralNetwork.__init__(network, dtype, storage_dtype)
+        network.model = {name: weight.astype(network.storage_dtype, copy=False) for name, weight in model.items()}
+        for l in range(1, len(model)):
+            setattr(network, 'out_activation{}'.format(l), np.zeros((1, 1), dtype=network.dtype))
+        return network
+
+    def plot(self, path, directory="output/plot"):
+        # The plot shows the learning behavior, saved as path in directory
+        # matplotlib is only imported here, inference never pays for it
+        import matplotlib.pyplot as plt
+
+        # Mean of every recorded bucket, shaded between its min and max when buckets hold several samples
+        # Validation results are drawn as markers at the end of each epoch
+        self.metrics.emit()
         fig, ax1 = plt.subplots()
-
-        color = 'tab:blue'
-        ax1.set_xlabel('Epoch')
-        ax1.set_ylabel('Loss', color=color)
-        ax1.plot(self.graph['epoch'], self.graph['loss'], color=color)
-        ax1.tick_params(axis='y', labelcolor=color)
-
         ax2 = ax1.twinx()
 
-        color = 'tab:red'
-        ax2.set_ylabel('Accuracy', color=color)
-        ax2.plot(self.graph['epoch'], self.graph['accuracy'], color=color)
-        ax2.tick_params(axis='y', labelcolor=color)
+        for axis, name, color in ((ax1, 'loss', 'tab:blue'), (ax2, 'accuracy', 'tab:red')):
+            epochs = self.metrics.x()
+            axis.plot(epochs, self.metrics.column(name), color=color)
+            if len(self.metrics) and self.metrics.counts().max() > 1:
+                axis.fill_between(epochs, self.metrics.column(name, 'min'), self.metrics.column(name, 'max'),
+                                  color=color, alpha=0.2, linewidth=0)
+            axis.plot(self.validation.x(), self.validation.column(name), 'o', color=color)
+            axis.set_ylabel(name.capitalize(), color=color)
+            axis.tick_params(axis='y', labelcolor=color)
+        ax1.set_xlabel('Epoch')
 
         fig.tight_layout()
         # plt.show()
 
-        directory = os.path.abspath("output/plot")
+        directory = os.path.abspath(directory)
         if not os.path.exists(directory):
             os.makedirs(directory)
-        plt.savefig(directory + "/" + path)
-
-    def train(self, x, y, batch_size, epoch):
-
-        # Converting labels to one-hot encoding
-        labels = self.to_one_hot(y)
-
-        eighty = int(round(x.shape[0] * 0.8))
+        plt.savefig(os.path.join(directory, path))
+        # Closing the figure, long-running workers plot many networks
+        plt.close(fig)
+
+    def train(self, x, y, batch_size, epoch, workspace=False, reshuffle_holdout=True, prefetch=2,
+              learning_rate=0.0085, optimizer=None, early_stopping=None, metrics=None, checkpointer=None,
+              resume_from=None, augment=None):
+        # workspace=True runs each mini-batch with train_step on preallocated buffers
+        # reshuffle_holdout=False keeps the same validation rows for every epoch
+        # prefetch is the number of batches gathered ahead by the background thread
+        # optimizer (see optimizers.py) replaces plain SGD with learning_rate and is kept in self.optimizer
+        # early_stopping (optimizers.EarlyStopping) ends the training when the validation loss plateaus
+        # metrics (metrics.MetricsRecorder) sets the sampling, downsampling and streaming of the training
+        # metrics and is kept in self.metrics
+        # checkpointer (checkpoint.Checkpointer) saves checkpoints in the background during the training
+        # resume_from, a checkpoint file or directory (its latest checkpoint), continues an interrupted run
+        # exactly where the checkpoint was taken, with the same optimizer type, augmentation and batch size
+        # augment (augmentation.Augmentation) transforms the training mini-batches in background processes,
+        # the validation rows are left as they are
+        if optimizer is not None:
+            self.optimizer = optimizer
+        if metrics is not None:
+            self.metrics = metrics
+
+        # Labels stay as integer class indices
+        labels = np.asarray(y)
+
+        # Randomly select training and validation set by 80% - 20%
+        # This is called Holdout method
+        # https://en.wikipedia.org/wiki/Cross-validation_(statistics)#Holdout_method
+        # https://stackoverflow.com/questions/3674409/how-to-split-partition-a-dataset-into-training-and-test-datasets-for-e-g-cros
+        holdout = Holdout(x.shape[0], 0.8, reshuffle_holdout)
+
+        start_epoch, start_batch = 0, 0
+        if resume_from is not None:
+            state = checkpoint.restore(self, checkpoint.read(resume_from), early_stopping, augment)
+            if state['batch_size'] != batch_size:
+                raise ValueError("The checkpoint was taken with batch size {}".format(state['batch_size']))
+            start_epoch, start_batch = state['epoch'], state['batch']
+            holdout.training, holdout.validation = state['training_idx'], state['validation_idx']
 
         # For each epoch
-        for i in range(epoch):
-            print("Epoch #", i)
-
-            # Randomly select training and validation set by 80% - 20%
-            # This is called Holdout method
-            # https://en.wikipedia.org/wiki/Cross-validation_(statistics)#Holdout_method
-            # https://stackoverflow.com/questions/3674409/how-to-split-partition-a-dataset-into-training-and-test-datasets-for-e-g-cros
-            indices = np.random.permutation(x.shape[0])
-            training_idx, validation_idx = indices[:eighty], indices[eighty:]
-            training, validation = x[training_idx, :], x[validation_idx, :]
-            training_labels, validation_labels = labels[training_idx, :], labels[validation_idx, :]
-
-            # Uncomment following lines for non cross-validation
-            # training, validation = x, x
-            # training_labels, validation_labels = labels, labels
-
-            # Calculating batch size
-            total = training.shape[0]
-            batches = total / batch_size
-
-            # Dividing by mini-batches
-            batch_data = np.split(training, batches, axis=0)
-            batch_labels = np.split(training_labels, batches, axis=0)
-
-            # Take each mini-batch and train
-            for idx, (mini_data, mini_labels) in enumerate(zip(batch_data, batch_labels)):
-                output, d1 = self.forward_propagation_with_dropout(mini_data)
-                loss = self.cross_entropy_loss(mini_labels, output)
-                accuracy = self.accuracy(output, mini_labels)
-                # print("Loss: ", loss)
-                # print("Accuracy: ", accuracy)
-                self.graph['loss'].append(loss)
-                self.graph['accuracy'].append(accuracy)
-                self.graph['epoch'].append(i + (idx / batches))
-                self.backward_propagation_with_dropout(mini_data, mini_labels, output, d1, 0.5)
-
-            # Validating
-            output = self.forward(validation)
-            loss = self.cross_entropy_loss(validation_labels, output)
-            accuracy = self.accuracy(output, validation_labels)
-            self.graph['loss'].append(loss)
-            self.graph['accuracy'].append(accuracy)
-            self.graph['epoch'].append(i + 1)
-
-    def test(self, x, y):
-        # Converting labels to one-hot encoding
-        labels = self.to_one_hot(y)
-
-        # Doing feed forward
-        output = self.forward(x)
-
-        # Calculating loss and accuracy
-        loss = self.cross_entropy_loss(labels, output)
-        accuracy = self.accuracy(output, labels)
-
-        return loss, accuracy
+        try:
+            for i in range(start_epoch, epoch):
+                print("Epoch #", i)
+
+                if i == start_epoch and start_batch > 0:
+                    # Resuming inside an epoch: same split, the batches already trained are skipped
+                    training_idx, validation_idx = holdout.training, holdout.validation
+                    first = start_batch
+                else:
+                    with profiling.phase('split'):
+                        training_idx, validation_idx = holdout.split()
+                    first = 0
+
+                # Shuffled mini-batches are gathered on a background thread, the last one may be smaller
+                loader = BatchLoader(x, labels, batch_size, training_idx[first * batch_size:], prefetch)
+                batches = -(-training_idx.shape[0] // batch_size)
+                if augment is not None:
+                    # Stats of this epoch only, they still hold the last epoch after the training
+                    augment.reset()
+                    loader = augment.batches(loader)
+
+                # Take each mini-batch and train
+                for idx, (mini_data, mini_labels) in enumerate(loader, first):
+                    if workspace:
+                        losses, predictions = self.train_step(mini_data, mini_labels, self.workspace(batch_size),
+                                                              0.5, learning_rate)
+                    else:
+                        with profiling.phase('forward'):
+                            mini_data = self.prepare_input(mini_data)
+                            logits, d1 = self.forward_propagation_with_dropout(mini_data, logits=True)
+                        with profiling.phase('loss'):
+                            losses, _, predictions, output_delta = self.softmax_cross_entropy(logits, mini_labels,
+                                                                                              out=logits)
+                    # Loss and accuracy are only reduced for the sampled mini-batches
+                    with profiling.phase('metrics'):
+                        if self.metrics.sample():
+                            loss = np.mean(losses)
+                            accuracy = np.count_nonzero(predictions == mini_labels) / mini_labels.shape[0]
+                            self.metrics.record(i + (idx / batches), loss, accuracy)
+                    if not workspace:
+                        with profiling.phase('backward'):
+                            self.backward_propagation_with_dropout(mini_data, mini_labels, None, d1, 0.5,
+                                                                   learning_rate, output_delta=output_delta)
+                    profiling.step()
+                    if checkpointer is not None and checkpointer.due():
+                        checkpointer.save(checkpoint.snapshot(self, i, idx + 1, batch_size, training_idx,
+                                                              validation_idx, early_stopping, augment))
+
+                # Validating
+                with profiling.phase('validation'):
+                    # Holdout rows are gathered chunk by chunk, a memmapped data set is never copied whole
+                    loss, accuracy = self.test(x, labels, rows=validation_idx)
+                self.validation.record(i + 1, loss, accuracy)
+                if augment is not None:
+                    print("Augmentation: {images_per_sec:.0f} images/sec per worker, "
+                          "{wait_seconds:.2f} s waited".format(**augment.stats()))
+                # Report of the epoch when a profiling.Profiler is active
+                profiling.end_epoch(i)
+
+                stop = early_stopping is not None and early_stopping.update(self, i, loss)
+                if checkpointer is not None and checkpointer.epoch_end:
+                    checkpointer.save(checkpoint.snapshot(self, i + 1, 0, batch_size, training_idx, validation_idx,
+                                                          early_stopping, augment))
+                if stop:
+                    print("Early stopping, best epoch #", early_stopping.best_epoch)
+                    break
+        except BaseException:
+            # Pending checkpoints are written even when the training fails, a writer error would hide the failure
+            if checkpointer is not None:
+                checkpointer.close(raise_error=False)
+            raise
+        else:
+            if checkpointer is not None:
+                checkpointer.close()
+
+    def partial_fit(self, x, y=None, batch_size=32, replay=None, replay_ratio=1.0, epochs=1, keep_prob=0.5,
+                    learning_rate=0.0085, publish_every=1):
+        # Online fine-tuning on new labeled samples, without going back to the full data set
+        # x, y is a small batch (or a single row), or x an iterable of (x, y) batches when y is None
+        # replay (online.ReplayBuffer) is kept in self.replay: every new batch is trained together with
+        # replay_ratio times as many rows drawn from the buffer, in the buffer dtype, then added to it
+        # Copy-on-write: the updates go to a private copy of the weights, which replaces self.model every
+        # publish_every batches and at the end. Inference running meanwhile (inference_weights, predict_proba,
+        # evaluate, the server) always reads one complete version. Concurrent partial_fit calls are serialized
+        # Returns the mean loss and the accuracy of the trained rows, measured before their updates
+        if replay is not None:
+            self.replay = replay
+        batches = [(x, y)] if y is not None else x
+
+        with self.__dict__.setdefault('_update_lock', threading.Lock()):
+            working = None
+            loss_sum, correct, rows = 0.0, 0, 0
+            for number, (new_x, new_y) in enumerate(batches, 1):
+                new_x, new_y = np.asarray(new_x), np.asarray(new_y).reshape(-1)
+                new_x = new_x.reshape(new_y.shape[0], -1)
+                data, labels = new_x, new_y
+                if self.replay is not None and new_x.dtype != self.replay.dtype:
+                    # Checked even when the buffer is empty: add_new would cast, e.g. truncate normalized floats to 0
+                    raise ValueError("New samples are {}, the replay buffer holds {}".format(
+                        new_x.dtype, self.replay.dtype))
+                if self.replay is not None and len(self.replay):
+                    old_x, old_y = self.replay.sample(int(np.ceil(replay_ratio * new_y.shape[0])))
+                    data, labels = np.concatenate([new_x, old_x]), np.concatenate([new_y, old_y])
+
+                if working is None:
+                    working = {name: weight.copy() for name, weight in self.model.items()}
+                for _ in range(epochs):
+                    order = np.random.permutation(labels.shape[0])
+                    for start in range(0, order.shape[0], batch_size):
+                        idx = order[start:start + batch_size]
+                        mini_labels = np.take(labels, idx)
+                        losses, predictions, gradients = self.compute_gradients(
+                            np.take(data, idx, axis=0), mini_labels, self.workspace(batch_size), keep_prob, working)
+                        loss_sum += float(np.sum(losses))
+                        correct += int(np.count_nonzero(predictions == mini_labels))
+                        rows += idx.shape[0]
+                        self.apply_gradients(gradients, learning_rate, working)
+
+                if self.replay is not None:
+                    self.replay.add_new(new_x, new_y)
+                if number % publish_every == 0:
+                    self.model, working = working, None
+            if working is not None:
+                self.model = working
+
+        return (loss_sum / rows, correct / rows) if rows else (0.0, 0.0)
+
+    def test(self, x, y, chunk_size=1024, workers=None, executor=None, rows=None):
+        # Loss and accuracy on integer labels, streamed by chunks of rows (see evaluate)
+        result = self.evaluate(x, y, chunk_size, top_k=(1,), workers=workers, executor=executor, rows=rows)
+        return result.loss(), result.accuracy()
+
+    def evaluate(self, x, y=None, chunk_size=1024, top_k=evaluation.DEFAULT_TOP_K, workers=None, executor=None,
+                 rows=None):
+        # Streaming evaluation of arrays, memmaps, or (x, y) chunks from an iterable when y is None
+        # rows evaluates only these row indices of the arrays, without copying them out first
+        # Returns an evaluation.Evaluation with loss, accuracy, top-k, confusion matrix and precision/recall
+        weights = self.inference_weights()
+        return evaluation.evaluate(lambda chunk: self.logits_with(chunk, weights), weights[-1].shape[1], x, y,
+                                   chunk_size, top_k, workers, executor, self.softmax_cross_entropy, rows)
+
+    # Stateless inference: unlike forward, nothing is written into the instance,
+    # so one loaded network can serve many threads at once
+
+    def inference_weights(self):
+        # Snapshot of the weights in the compute dtype, in layer order
+        # self.model is read once: partial_fit replaces it as a whole, never a snapshot in use
+        model = self.model
+        return [model[name].astype(self.dtype, copy=False) for name in sorted(model, key=lambda name: int(name[1:]))]
+
+    def logits_with(self, x, weights):
+        # ReLU hidden layers using the given weights, up to the logits of the last layer
+        with profiling.phase('forward'):
+            output = self.prepare_input(x)
+            for weight in weights[:-1]:
+                output = self.relu(profiling.dot(output, weight))
+            return profiling.dot(output, weights[-1])
+
+    def forward_with(self, x, weights):
+        # Softmax output using the given weights
+        logits = self.logits_with(x, weights)
+        with profiling.phase('softmax'):
+            return self.softmax_cross_entropy(logits, out=logits)[3]
+
+    def predict_proba(self, x, chunk_size=1024, workers=None, executor=None):
+        # Runs the input by chunks of rows, optionally on a thread pool
+        # NumPy releases the GIL inside BLAS so chunks run in parallel
+        weights = self.inference_weights()
+        total = x.shape[0]
+        output = np.empty((total, weights[-1].shape[1]), dtype=self.dtype)
+        chunks = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+
+        def run(chunk):
+            start, stop = chunk
+            output[start:stop] = self.forward_with(x[start:stop], weights)
+
+        if executor is not None:
+            list(executor.map(run, chunks))
+        elif workers is not None and workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(run, chunks))
+        else:
+            for chunk in chunks:
+                run(chunk)
+
+        return output
+
+    def predict(self, x, chunk_size=1024, workers=None, executor=None):
+        # Returns the predicted class of each row
+        return np.argmax(self.predict_proba(x, chunk_size, workers, executor), axis=1)
 
 
 # This class inherits from NeuralNetwork using 2 hidden layers
 
 class TwoHiddenLayer(NeuralNetwork):
-    def __init__(self, inputs, hidden1, hidden2, output):
-        super().__init__()
+    def __init__(self, inputs, hidden1, hidden2, output, dtype=np.float64, storage_dtype=None):
+        super().__init__(dtype, storage_dtype)
         # Parameters and initializations
         # Before ReLU weights are multiplied by 2 since the half of its input is 0
         # Source: http://andyljones.tumblr.com/post/110998971763/an-explanation-of-xavier-initialization
         self.model = dict()
-        self.model['W1'] = 2 * np.random.randn(inputs, hidden1) / np.sqrt(inputs)
-        self.model['W2'] = 2 * np.random.randn(hidden1, hidden2) / np.sqrt(hidden1)
-        self.model['W3'] = np.random.randn(hidden2, output) / np.sqrt(hidden2)
+        self.model['W1'] = self.init_weight(inputs, hidden1, 2)
+        self.model['W2'] = self.init_weight(hidden1, hidden2, 2)
+        self.model['W3'] = self.init_weight(hidden2, output)
 
         # Class initializations
-        self.out_activation1 = np.zeros((1, 1))
-        self.out_activation2 = np.zeros((1, 1))
+        self.out_activation1 = np.zeros((1, 1), dtype=self.dtype)
+        self.out_activation2 = np.zeros((1, 1), dtype=self.dtype)
 
     def forward(self, x):
         # Forward propagation through our network
-        out_product1 = np.dot(x, self.model['W1'])
+        x = self.prepare_input(x)
+        out_product1 = profiling.dot(x, self.weight('W1'))
         self.out_activation1 = self.relu(out_product1)
 
-        out_product2 = np.dot(self.out_activation1, self.model['W2'])
+        out_product2 = profiling.dot(self.out_activation1, self.weight('W2'))
         self.out_activation2 = self.relu(out_product2)
 
-        out_product3 = np.dot(self.out_activation2, self.model['W3'])
+        out_product3 = profiling.dot(self.out_activation2, self.weight('W3'))
         out_activation3 = self.stable_softmax(out_product3)
 
         return out_activation3
 
-    def forward_propagation_with_dropout(self, x, keep_prob=0.5):
+    def forward_propagation_with_dropout(self, x, keep_prob=0.5, logits=False):
         # Implement Forward Propagation to calculate A2 (probabilities)
-        out_product1 = np.dot(x, self.model['W1'])
+        # logits=True returns the last layer before the softmax, see softmax_cross_entropy
+        x = self.prepare_input(x)
+        out_product1 = profiling.dot(x, self.weight('W1'))
         self.out_activation1 = self.relu(out_product1)
 
         # Dropout
@@ -265,36 +699,45 @@ class TwoHiddenLayer(NeuralNetwork):
         self.out_activation1 = np.multiply(self.out_activation1, d1)
         self.out_activation1 = self.out_activation1/keep_prob
 
-        out_product2 = np.dot(self.out_activation1, self.model['W2'])
+        out_product2 = profiling.dot(self.out_activation1, self.weight('W2'))
         self.out_activation2 = self.relu(out_product2)
 
-        out_product3 = np.dot(self.out_activation2, self.model['W3'])
+        out_product3 = profiling.dot(self.out_activation2, self.weight('W3'))
+        if logits:
+            return out_product3, d1
         out_activation3 = self.stable_softmax(out_product3)
 
         return out_activation3, d1
 
-    def backward(self, x, y, output, learning_rate=0.0085):
-        # y is a one_hot_vector
-        output_delta = self.one_hot_cross_entropy_prime_with_softmax(y, output) / y.shape[0]
+    def backward(self, x, y, output, learning_rate=0.0085, output_delta=None):
+        # y are integer labels or one-hot vectors
+        # output_delta can be given when already computed, see softmax_cross_entropy
+        x = self.prepare_input(x)
+        if output_delta is None:
+            output_delta = self.output_delta(y, output)
 
-        hidden2_error = output_delta.dot(self.model['W3'].T)
+        hidden2_error = profiling.dot(output_delta, self.weight('W3').T)
         hidden2_delta = hidden2_error * self.relu_prime(self.out_activation2)
 
-        hidden1_error = hidden2_delta.dot(self.model['W2'].T)
+        hidden1_error = profiling.dot(hidden2_delta, self.weight('W2').T)
         hidden1_delta = hidden1_error * self.relu_prime(self.out_activation1)
 
-        self.model['W3'] -= (self.out_activation2.T.dot(output_delta)) * learning_rate
-        self.model['W2'] -= (self.out_activation1.T.dot(hidden2_delta)) * learning_rate
-        self.model['W1'] -= (x.T.dot(hidden1_delta)) * learning_rate
+        self.apply_gradients([profiling.dot(x.T, hidden1_delta),
+                              profiling.dot(self.out_activation1.T, hidden2_delta),
+                              profiling.dot(self.out_activation2.T, output_delta)], learning_rate)
 
-    def backward_propagation_with_dropout(self, x, y, output, d1, keep_prob, learning_rate=0.0085):
-        # y is a one_hot_vector
-        output_delta = self.one_hot_cross_entropy_prime_with_softmax(y, output) / y.shape[0]
+    def backward_propagation_with_dropout(self, x, y, output, d1, keep_prob, learning_rate=0.0085,
+                                          output_delta=None):
+        # y are integer labels or one-hot vectors
+        # output_delta can be given when already computed, see softmax_cross_entropy
+        x = self.prepare_input(x)
+        if output_delta is None:
+            output_delta = self.output_delta(y, output)
 
-        hidden2_error = output_delta.dot(self.model['W3'].T)
+        hidden2_error = profiling.dot(output_delta, self.weight('W3').T)
         hidden2_delta = hidden2_error * self.relu_prime(self.out_activation2)
         # dropout
-        hidden1_error = hidden2_delta.dot(self.model['W2'].T)
+        hidden1_error = profiling.dot(hidden2_delta, self.weight('W2').T)
         # Step 1: Apply mask D2 to shut down the same neurons as during the forward propagation
         hidden1_error = np.multiply(d1, hidden1_error)
         # Step 2: Scale the value of neurons that haven't been shut down
@@ -302,19 +745,20 @@ class TwoHiddenLayer(NeuralNetwork):
 
         hidden1_delta = hidden1_error * self.relu_prime(self.out_activation1)
         # reload w
-        self.model['W3'] -= (self.out_activation2.T.dot(output_delta)) * learning_rate
-        self.model['W2'] -= (self.out_activation1.T.dot(hidden2_delta)) * learning_rate
-        self.model['W1'] -= (x.T.dot(hidden1_delta)) * learning_rate
+        self.apply_gradients([profiling.dot(x.T, hidden1_delta),
+                              profiling.dot(self.out_activation1.T, hidden2_delta),
+                              profiling.dot(self.out_activation2.T, output_delta)], learning_rate)
 
     def feed_backward(self, y):
         # Forward propagation through our network
-        out_product1 = np.dot(y, self.model['W3'].T)
+        y = np.asarray(y, dtype=self.dtype)
+        out_product1 = profiling.dot(y, self.weight('W3').T)
 
         out_activation1 = self.relu(out_product1)
-        out_product2 = np.dot(out_activation1, self.model['W2'].T)
+        out_product2 = profiling.dot(out_activation1, self.weight('W2').T)
 
         out_activation2 = self.relu(out_product2)
-        out_product3 = np.dot(out_activation2, self.model['W1'].T)
+        out_product3 = profiling.dot(out_activation2, self.weight('W1').T)
 
         return out_product3
 
@@ -322,31 +766,34 @@ class TwoHiddenLayer(NeuralNetwork):
 # This class inherits from NeuralNetwork using 1 hidden layers
 
 class OneHiddenLayer(NeuralNetwork):
-    def __init__(self, inputs, hidden1, output):
-        super().__init__()
+    def __init__(self, inputs, hidden1, output, dtype=np.float64, storage_dtype=None):
+        super().__init__(dtype, storage_dtype)
         # Parameters and initializations
         # Before ReLU weights are multiplied by 2 since the half of its input is 0
         # Source: http://andyljones.tumblr.com/post/110998971763/an-explanation-of-xavier-initialization
         self.model = dict()
-        self.model['W1'] = np.random.randn(inputs, hidden1) / np.sqrt(inputs)
-        self.model['W2'] = np.random.randn(hidden1, output) / np.sqrt(hidden1)
+        self.model['W1'] = self.init_weight(inputs, hidden1)
+        self.model['W2'] = self.init_weight(hidden1, output)
 
         # Class initializations
-        self.out_activation1 = np.zeros((1, 1))
+        self.out_activation1 = np.zeros((1, 1), dtype=self.dtype)
 
     def forward(self, x):
         # Forward propagation through our network
-        out_product1 = np.dot(x, self.model['W1'])
+        x = self.prepare_input(x)
+        out_product1 = profiling.dot(x, self.weight('W1'))
         self.out_activation1 = self.relu(out_product1)
 
-        out_product3 = np.dot(self.out_activation1, self.model['W2'])
+        out_product3 = profiling.dot(self.out_activation1, self.weight('W2'))
         out_activation3 = self.stable_softmax(out_product3)
 
         return out_activation3
 
-    def forward_propagation_with_dropout(self, x, keep_prob=0.5):
+    def forward_propagation_with_dropout(self, x, keep_prob=0.5, logits=False):
         # Implement Forward Propagation to calculate A2 (probabilities)
-        out_product1 = np.dot(x, self.model['W1'])
+        # logits=True returns the last layer before the softmax, see softmax_cross_entropy
+        x = self.prepare_input(x)
+        out_product1 = profiling.dot(x, self.weight('W1'))
         self.out_activation1 = self.relu(out_product1)
 
         # Dropout
@@ -356,27 +803,36 @@ class OneHiddenLayer(NeuralNetwork):
         self.out_activation1 = np.multiply(self.out_activation1, d1)
         self.out_activation1 = self.out_activation1/keep_prob
 
-        out_product2 = np.dot(self.out_activation1, self.model['W2'])
+        out_product2 = profiling.dot(self.out_activation1, self.weight('W2'))
+        if logits:
+            return out_product2, d1
         out_activation2 = self.stable_softmax(out_product2)
 
         return out_activation2, d1
 
-    def backward(self, x, y, output, learning_rate=0.0085):
-        # y is a one_hot_vector
-        output_delta = self.one_hot_cross_entropy_prime_with_softmax(y, output) / y.shape[0]
+    def backward(self, x, y, output, learning_rate=0.0085, output_delta=None):
+        # y are integer labels or one-hot vectors
+        # output_delta can be given when already computed, see softmax_cross_entropy
+        x = self.prepare_input(x)
+        if output_delta is None:
+            output_delta = self.output_delta(y, output)
 
-        hidden1_error = output_delta.dot(self.model['W2'].T)
+        hidden1_error = profiling.dot(output_delta, self.weight('W2').T)
         hidden1_delta = hidden1_error * self.relu_prime(self.out_activation1)
 
-        self.model['W2'] -= (self.out_activation1.T.dot(output_delta)) * learning_rate
-        self.model['W1'] -= (x.T.dot(hidden1_delta)) * learning_rate
+        self.apply_gradients([profiling.dot(x.T, hidden1_delta),
+                              profiling.dot(self.out_activation1.T, output_delta)], learning_rate)
 
-    def backward_propagation_with_dropout(self, x, y, output, d1, keep_prob, learning_rate=0.0085):
-        # y is a one_hot_vector
-        output_delta = self.one_hot_cross_entropy_prime_with_softmax(y, output) / y.shape[0]
+    def backward_propagation_with_dropout(self, x, y, output, d1, keep_prob, learning_rate=0.0085,
+                                          output_delta=None):
+        # y are integer labels or one-hot vectors
+        # output_delta can be given when already computed, see softmax_cross_entropy
+        x = self.prepare_input(x)
+        if output_delta is None:
+            output_delta = self.output_delta(y, output)
 
         # dropout
-        hidden1_error = output_delta.dot(self.model['W2'].T)
+        hidden1_error = profiling.dot(output_delta, self.weight('W2').T)
         # Step 1: Apply mask D2 to shut down the same neurons as during the forward propagation
         hidden1_error = np.multiply(d1, hidden1_error)
         # Step 2: Scale the value of neurons that haven't been shut down
@@ -384,14 +840,46 @@ class OneHiddenLayer(NeuralNetwork):
 
         hidden1_delta = hidden1_error * self.relu_prime(self.out_activation1)
         # reload w
-        self.model['W2'] -= (self.out_activation1.T.dot(output_delta)) * learning_rate
-        self.model['W1'] -= (x.T.dot(hidden1_delta)) * learning_rate
+        self.apply_gradients([profiling.dot(x.T, hidden1_delta),
+                              profiling.dot(self.out_activation1.T, output_delta)], learning_rate)
 
     def feed_backward(self, y):
         # Forward propagation through our network
-        out_product1 = np.dot(y, self.model['W2'].T)
+        y = np.asarray(y, dtype=self.dtype)
+        out_product1 = profiling.dot(y, self.weight('W2').T)
 
         out_activation1 = self.relu(out_product1)
-        out_product2 = np.dot(out_activation1, self.model['W1'].T)
+        out_product2 = profiling.dot(out_activation1, self.weight('W1').T)
 
         return out_product2
+
+
+def read_weights(filename):
+    # Returns the header and the weights of a file, old pickles get a header built from their weights
+    if weight_format.is_weight_file(filename):
+        return weight_format.read(filename)
+    with open(filename, 'rb') as handle:
+        model = pickle.load(handle)
+    header = {'class': weight_format.network_class_name(model), 'dtype': 'float64', 'storage_dtype': 'float64'}
+    return header, model
+
+
+def network_from_weights(model, dtype=np.float64, storage_dtype=None, network_class=None):
+    # Builds the network class matching a dictionary of weights (W1, W2[, W3])
+    network_class = network_class or weight_format.network_class_name(model)
+    return NETWORK_CLASSES[network_class].from_model(model, dtype, storage_dtype)
+
+
+def load_network(filename, dtype=None, storage_dtype=None):
+    # Loads a weights file into the network class recorded in it
+    # dtype and storage_dtype default to the ones recorded in the file
+    header, model = read_weights(filename)
+    dtype = header['dtype'] if dtype is None else dtype
+    storage_dtype = header['storage_dtype'] if storage_dtype is None else storage_dtype
+    return network_from_weights(model, dtype, storage_dtype, header['class'])
+
+
+NETWORK_CLASSES = {
+    'OneHiddenLayer': OneHiddenLayer,
+    'TwoHiddenLayer': TwoHiddenLayer,
+}
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+# Replay memory of NeuralNetwork.partial_fit
+#
+#     replay = online.ReplayBuffer.from_data(train['images'], train['labels'], capacity=4096)
+#     network.partial_fit(corrected_images, corrected_labels, replay=replay)
+#     network.partial_fit(corrections)          # generator of (images, labels), same buffer
+#
+# Fine-tuning on a handful of new digits alone makes the network forget the original data. The buffer
+# keeps a bounded mix of both: a uniform reservoir sample of the original rows (algorithm R, so the data
+# set is streamed once by chunks, memmaps included) and the latest new rows in a ring, the oldest
+# replaced first. partial_fit trains every new batch together with rows drawn from the whole buffer.
+
+
+class ReplayBuffer(object):
+
+    def __init__(self, capacity=4096, shape=(784,), dtype=np.uint8, original_fraction=0.5, seed=None):
+        # capacity rows in total, original_fraction of them for the reservoir of original rows
+        self.dtype = np.dtype(dtype)
+        self.random = np.random.default_rng(seed)
+        original = int(round(capacity * original_fraction))
+        self.original_x = np.empty((original,) + tuple(shape), dtype=self.dtype)
+        self.original_y = np.empty(original, dtype=np.int64)
+        self.new_x = np.empty((capacity - original,) + tuple(shape), dtype=self.dtype)
+        self.new_y = np.empty(capacity - original, dtype=np.int64)
+        # Original rows offered so far, new rows held and the next ring slot
+        self.seen = 0
+        self.new_count = 0
+        self.new_next = 0
+
+    @classmethod
+    def from_data(cls, x, y, capacity=4096, original_fraction=0.5, seed=None, chunk_size=8192):
+        # Buffer holding a reservoir sample of the original data set, read by chunks of rows
+        buffer = cls(capacity, x.shape[1:], x.dtype, original_fraction, seed)
+        for start in range(0, x.shape[0], chunk_size):
+            buffer.add_original(x[start:start + chunk_size], y[start:start + chunk_size])
+        return buffer
+
+    def __len__(self):
+        return self.original_count() + self.new_count
+
+    def original_count(self):
+        return min(self.seen, self.original_x.shape[0])
+
+    def add_original(self, x, y):
+        # Algorithm R over a chunk: the i-th row offered (from 0) takes a random slot with probability k / (i + 1)
+        capacity = self.original_x.shape[0]
+        m = x.shape[0]
+        fill = min(max(capacity - self.seen, 0), m)
+        self.original_x[self.seen:self.seen + fill] = x[:fill]
+        self.original_y[self.seen:self.seen + fill] = y[:fill]
+        if fill < m and capacity > 0:
+            positions = np.arange(self.seen + fill, self.seen + m)
+            slots = self.random.integers(0, positions + 1)
+            kept = np.flatnonzero(slots < capacity)
+            # A slot drawn twice keeps the later row, as if the rows were offered one by one
+            slots, first = np.unique(slots[kept][::-1], return_index=True)
+            rows = kept[::-1][first] + fill
+            self.original_x[slots] = np.take(x, rows, axis=0)
+            self.original_y[slots] = np.take(y, rows)
+        self.seen += m
+
+    def add_new(self, x, y):
+        # New rows go into the ring, only the latest capacity rows of a large batch are kept
+        x = np.asarray(x)
+        if x.dtype != self.dtype:
+            raise ValueError("New rows are {}, the buffer holds {}".format(x.dtype, self.dtype))
+        capacity = self.new_x.shape[0]
+        if capacity == 0:
+            return
+        x, y = x[-capacity:], np.asarray(y)[-capacity:]
+        slots = (self.new_next + np.arange(x.shape[0])) % capacity
+        self.new_x[slots] = x
+        self.new_y[slots] = y
+        self.new_next = (self.new_next + x.shape[0]) % capacity
+        self.new_count = min(self.new_count + x.shape[0], capacity)
+
+    def sample(self, n):
+        # n rows drawn uniformly, with replacement, from everything the buffer holds
+        original = self.original_count()
+        rows = self.random.integers(0, original + self.new_count, n)
+        from_original = rows < original
+        x = np.empty((n,) + self.original_x.shape[1:], dtype=self.dtype)
+        y = np.empty(n, dtype=np.int64)
+        x[from_original] = self.original_x[rows[from_original]]
+        y[from_original] = self.original_y[rows[from_original]]
+        x[~from_original] = self.new_x[rows[~from_original] - original]
+        y[~from_original] = self.new_y[rows[~from_original] - original]
+        return x, y
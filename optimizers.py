@@ -0,0 +1,189 @@
+import numpy as np
+
+
+# Optimizers for NeuralNetwork.apply_gradients
+# The state (velocities, moments) is kept per weight name, next to network.model
+# Gradients are used as scratch buffers and overwritten by update()
+
+class Optimizer(object):
+
+    def __init__(self, learning_rate=0.0085, schedule=None):
+        self.learning_rate = learning_rate
+        self.schedule = schedule
+        self.iterations = 0
+        self.state = dict()
+
+    def rate(self):
+        # Learning rate of the current iteration
+        if self.schedule is None:
+            return self.learning_rate
+        return self.schedule.rate(self.learning_rate, self.iterations)
+
+    def slot(self, name, key, like):
+        # Returns a state array for a weight, created with zeros on first use
+        slots = self.state.setdefault(name, dict())
+        if key not in slots:
+            slots[key] = np.zeros(like.shape, dtype=like.dtype)
+        return slots[key]
+
+    def update(self, model, names, gradients):
+        # Updates model in place with the gradients given in the same order as names
+        learning_rate = self.rate()
+        self.iterations += 1
+        for name, gradient in zip(names, gradients):
+            self.update_weight(name, model[name], gradient, learning_rate)
+
+    def update_weight(self, name, weight, gradient, learning_rate):
+        pass
+
+    def state_dict(self):
+        # Iteration count and copies of the state arrays, see checkpoint.py
+        return {
+            'iterations': self.iterations,
+            'slots': {name: {key: value.copy() for key, value in slots.items()}
+                      for name, slots in self.state.items()},
+        }
+
+    def load_state_dict(self, state):
+        self.iterations = state['iterations']
+        self.state = {name: {key: np.array(value) for key, value in slots.items()}
+                      for name, slots in state['slots'].items()}
+
+
+class SGD(Optimizer):
+    # Stochastic gradient descent with optional (Nesterov) momentum
+    # Momentum from: http://cs231n.github.io/neural-networks-3/#sgd
+
+    def __init__(self, learning_rate=0.0085, momentum=0.0, nesterov=False, schedule=None):
+        super().__init__(learning_rate, schedule)
+        self.momentum = momentum
+        self.nesterov = nesterov
+
+    def update_weight(self, name, weight, gradient, learning_rate):
+        if self.momentum == 0:
+            gradient *= learning_rate
+            np.subtract(weight, gradient, out=weight, casting='same_kind')
+            return
+
+        velocity = self.slot(name, 'velocity', gradient)
+        velocity *= self.momentum
+        velocity += gradient
+        if self.nesterov:
+            # weight -= learning_rate * (gradient + momentum * velocity)
+            gradient *= learning_rate
+            np.subtract(weight, gradient, out=weight, casting='same_kind')
+            np.multiply(velocity, learning_rate * self.momentum, out=gradient)
+        else:
+            np.multiply(velocity, learning_rate, out=gradient)
+        np.subtract(weight, gradient, out=weight, casting='same_kind')
+
+
+class Adam(Optimizer):
+    # Adam: https://arxiv.org/abs/1412.6980
+
+    def __init__(self, learning_rate=0.001, beta1=0.9, beta2=0.999, epsilon=1e-8, schedule=None):
+        super().__init__(learning_rate, schedule)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.correction = 1.0
+
+    def update(self, model, names, gradients):
+        # Bias corrections are shared by every weight of the iteration
+        t = self.iterations + 1
+        self.correction = np.sqrt(1 - self.beta2 ** t) / (1 - self.beta1 ** t)
+        super().update(model, names, gradients)
+
+    def update_weight(self, name, weight, gradient, learning_rate):
+        first = self.slot(name, 'first', gradient)
+        second = self.slot(name, 'second', gradient)
+
+        # first = beta1 * first + (1 - beta1) * gradient
+        first *= self.beta1
+        gradient *= 1 - self.beta1
+        first += gradient
+        # second = beta2 * second + (1 - beta2) * gradient ** 2, reusing the scaled gradient
+        second *= self.beta2
+        np.multiply(gradient, gradient, out=gradient)
+        gradient *= (1 - self.beta2) / (1 - self.beta1) ** 2
+        second += gradient
+
+        # weight -= learning_rate * correction * first / (sqrt(second) + epsilon)
+        np.sqrt(second, out=gradient)
+        gradient += self.epsilon
+        np.divide(first, gradient, out=gradient)
+        gradient *= learning_rate * self.correction
+        np.subtract(weight, gradient, out=weight, casting='same_kind')
+
+
+# Learning rate schedules, evaluated once per mini-batch
+
+class StepDecay(object):
+    # Multiplies the learning rate by gamma every step_size iterations
+
+    def __init__(self, step_size, gamma=0.5):
+        self.step_size = step_size
+        self.gamma = gamma
+
+    def rate(self, learning_rate, iteration):
+        return learning_rate * self.gamma ** (iteration // self.step_size)
+
+
+class CosineDecay(object):
+    # Cosine annealing from learning_rate down to minimum over total iterations
+    # https://arxiv.org/abs/1608.03983
+
+    def __init__(self, total, minimum=0.0):
+        self.total = total
+        self.minimum = minimum
+
+    def rate(self, learning_rate, iteration):
+        progress = min(iteration, self.total) / self.total
+        return self.minimum + 0.5 * (learning_rate - self.minimum) * (1 + np.cos(np.pi * progress))
+
+
+class EarlyStopping(object):
+    # Stops the training when the validation loss has not improved by min_delta for patience epochs
+    # With restore_best=True the weights of the best epoch are put back when stopping
+
+    def __init__(self, patience=2, min_delta=0.0, restore_best=True):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.restore_best = restore_best
+        self.best_loss = np.inf
+        self.best_epoch = -1
+        self.best_model = None
+        self.wait = 0
+
+    def update(self, network, epoch, loss):
+        # Returns True when the training should stop
+        if loss < self.best_loss - self.min_delta:
+            self.best_loss = loss
+            self.best_epoch = epoch
+            self.wait = 0
+            if self.restore_best:
+                self.best_model = {name: weight.copy() for name, weight in network.model.items()}
+            return False
+
+        self.wait += 1
+        if self.wait < self.patience:
+            return False
+
+        if self.restore_best and self.best_model is not None:
+            for name, weight in self.best_model.items():
+                network.model[name][...] = weight
+        return True
+
+    def state_dict(self):
+        return {
+            'best_loss': float(self.best_loss),
+            'best_epoch': self.best_epoch,
+            'wait': self.wait,
+            'best_model': {name: weight.copy() for name, weight in (self.best_model or {}).items()},
+        }
+
+    def load_state_dict(self, state):
+        self.best_loss = state['best_loss']
+        self.best_epoch = state['best_epoch']
+        self.wait = state['wait']
+        self.best_model = {name: np.array(weight) for name, weight in state['best_model'].items()} or None
@@ -0,0 +1,62 @@
+import multiprocessing as mp
+import numpy as np
+
+from contextlib import contextmanager
+import os
+
+
+# Helpers shared by the process-based runners (sweep, data-parallel training)
+
+# Environment variables read by the BLAS libraries when NumPy is imported
+BLAS_ENVIRONMENT = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+@contextmanager
+def blas_threads(threads):
+    # Sets the BLAS thread count for processes started inside the block
+    # Only effective for freshly spawned processes, NumPy reads it once at import
+    previous = {name: os.environ.get(name) for name in BLAS_ENVIRONMENT}
+    for name in BLAS_ENVIRONMENT:
+        os.environ[name] = str(threads)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def share(array):
+    # Copies an array into shared memory, returns a picklable descriptor for attach()
+    array = np.ascontiguousarray(array)
+    raw = mp.RawArray('b', max(array.nbytes, 1))
+    shared = np.frombuffer(raw, dtype=array.dtype, count=array.size).reshape(array.shape)
+    shared[...] = array
+    return raw, array.shape, array.dtype.str
+
+
+def attach(descriptor):
+    # Returns a NumPy view over a shared array, no copy is made
+    raw, shape, dtype = descriptor
+    dtype = np.dtype(dtype)
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def share_dict(arrays):
+    # share() applied to every value of a dictionary
+    return {name: share(array) for name, array in arrays.items()}
+
+
+def attach_dict(descriptors):
+    # attach() applied to every value of a dictionary
+    return {name: attach(descriptor) for name, descriptor in descriptors.items()}
+
+
+def process_pool(processes, threads, initializer=None, initargs=()):
+    # Spawned pool with BLAS pinned to the given threads per worker
+    context = mp.get_context('spawn')
+    with blas_threads(threads):
+        return context.Pool(processes, initializer=initializer, initargs=initargs)
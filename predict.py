@@ -0,0 +1,110 @@
+"""
+Headless inference: predicts the digits of image files with a saved network and prints JSON
+
+    python predict.py output/weights/network_one_128.nnw Test_data/one_1.png Test_data/seven_1.png
+    python predict.py output/weights/network_two_256.pickle "Test_data/*.png" --top-k 3 --plot output/predictions
+
+Images are given as files, directories or glob patterns, they are preprocessed like utils.load_image
+(grayscale, 28x28) and scored in a single batched forward. Only NumPy and PIL are imported,
+matplotlib is loaded with the Agg backend when --plot writes the figures to files.
+"""
+
+import numpy as np
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+import neural_network as nn
+import utils
+
+
+def expand(patterns):
+    # Files of every argument, in order: directories and glob patterns are expanded, duplicates dropped
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern) or glob.has_magic(pattern):
+            matches = utils.image_files(pattern)
+            if not matches:
+                raise IOError("No image matches " + pattern)
+            files += matches
+        elif os.path.exists(pattern):
+            files.append(pattern)
+        else:
+            raise IOError("No such image: " + pattern)
+    return list(dict.fromkeys(files))
+
+
+def predictions(files, probabilities, top_k):
+    results = []
+    for file, row in zip(files, probabilities):
+        ranked = np.argsort(row)[::-1][:top_k]
+        results.append({
+            'file': file,
+            'prediction': int(ranked[0]),
+            'top': [[int(k), round(float(row[k]), 6)] for k in ranked],
+            'probabilities': [round(float(p), 6) for p in row],
+        })
+    return results
+
+
+def plot(files, images, probabilities, directory):
+    # One figure per image: the 28x28 input next to its class probabilities
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for file, image, row in zip(files, images, probabilities):
+        fig, (left, right) = plt.subplots(1, 2, figsize=(6, 3))
+        left.imshow(image.reshape(utils.IMAGE_SIZE), cmap='gray')
+        left.set_title(os.path.basename(file))
+        left.axis('off')
+        right.bar(range(row.shape[0]), row, color='blue')
+        right.set_xticks(range(row.shape[0]))
+        right.set_ylim(0, 1)
+        right.set_title("Prediction: {}".format(int(np.argmax(row))))
+        fig.tight_layout()
+        filename = os.path.join(directory, os.path.splitext(os.path.basename(file))[0] + ".png")
+        fig.savefig(filename)
+        plt.close(fig)
+        written.append(filename)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('weights', help="weights file (.nnw or .pickle)")
+    parser.add_argument('images', nargs='+', help="image files, directories or glob patterns")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--plot', metavar='DIRECTORY', help="also write one PNG figure per image")
+    parser.add_argument('--cache', metavar='DIRECTORY', help="reuse preprocessed images between runs")
+    parser.add_argument('--output', help="write the JSON into a file instead of stdout")
+    parser.add_argument('--indent', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    try:
+        files = expand(args.images)
+    except IOError as error:
+        parser.error(str(error))
+    network = nn.load_network(args.weights)
+    files, images = utils.load_images(files, cache=args.cache)
+    probabilities = network.predict_proba(images)
+
+    report = {'weights': args.weights, 'predictions': predictions(files, probabilities, args.top_k)}
+    if args.plot:
+        report['plots'] = plot(files, images, probabilities, args.plot)
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=args.indent)
+    else:
+        json.dump(report, sys.stdout, indent=args.indent)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import numpy as np
+
+import threading
+import time
+import tracemalloc
+
+
+# Opt-in profiling of the training and inference hot paths
+#
+#     with profiling.Profiler(memory=True) as profiler:
+#         network.train(x, y, 32, 2)      # prints a report at the end of every epoch
+#         network.test(x_test, y_test)
+#     profiler.print_report()
+#
+# The code is instrumented with profiling.phase(name) blocks and profiling.dot calls. While no profiler
+# is active they cost one global lookup: phase returns a shared no-op context and dot is np.dot.
+# Phases nest, they are reported by path (e.g. backward/update) with inclusive wall time and calls.
+# Every dot is timed and its FLOPs estimated (2 m k n), GFLOP/s are FLOPs over the time spent in it.
+# With memory=True, tracemalloc (which sees NumPy buffers) measures the peak bytes allocated per step.
+
+_active = None
+
+
+class _Disabled(object):
+    # No-op context returned by phase when profiling is off
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+DISABLED = _Disabled()
+
+
+class _Phase(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        stack = self.profiler.stack()
+        stack.append(stack[-1] + "/" + self.name if stack else self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        path = self.profiler.stack().pop()
+        self.profiler.add_phase(path, elapsed)
+        return False
+
+
+class Profiler(object):
+
+    def __init__(self, memory=False, verbose=True):
+        self.memory = memory
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.previous = None
+        self.reports = []
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.phases = dict()
+            self.dots = dict()
+            self.step_bytes = []
+            self.start = time.perf_counter()
+        if self.memory and tracemalloc.is_tracing():
+            self.step_start = tracemalloc.get_traced_memory()[0]
+            _reset_peak()
+
+    def __enter__(self):
+        global _active
+        self.previous = _active
+        _active = self
+        if self.memory:
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start()
+        self.reset()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self.previous
+        if self.memory and self.started_tracing:
+            tracemalloc.stop()
+        self.elapsed = time.perf_counter() - self.start
+        return False
+
+    def stack(self):
+        # Phase path of the calling thread
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def current(self):
+        stack = self.stack()
+        return stack[-1] if stack else "other"
+
+    def add_phase(self, path, elapsed):
+        with self.lock:
+            entry = self.phases.get(path)
+            if entry is None:
+                entry = self.phases[path] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def dot(self, a, b, out=None):
+        start = time.perf_counter()
+        result = np.dot(a, b, out=out)
+        elapsed = time.perf_counter() - start
+        # Matrix-matrix, matrix-vector and vector-vector products
+        m = int(np.prod(a.shape[:-1]))
+        k = a.shape[-1]
+        n = b.shape[-1] if b.ndim > 1 else 1
+        key = (self.current(), "{}x{} @ {}x{}".format(m, k, k, n), result.dtype.name)
+        with self.lock:
+            entry = self.dots.get(key)
+            if entry is None:
+                entry = self.dots[key] = [0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += 2 * m * k * n
+        return result
+
+    def step(self):
+        # Ends one training step, records the peak bytes allocated during it
+        if not self.memory:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            self.step_bytes.append(max(0, peak - self.step_start))
+        self.step_start = current
+        _reset_peak()
+
+    def report(self):
+        # Structured report of everything recorded since the last reset
+        with self.lock:
+            total = time.perf_counter() - self.start
+            phases = [{'phase': path, 'calls': calls, 'seconds': seconds,
+                       'share': seconds / total if total else 0.0}
+                      for path, (calls, seconds) in sorted(self.phases.items())]
+            dots = [{'phase': phase, 'shape': shape, 'dtype': dtype, 'calls': calls, 'seconds': seconds,
+                     'gflop': flops / 1e9, 'gflops': flops / seconds / 1e9 if seconds else 0.0}
+                    for (phase, shape, dtype), (calls, seconds, flops) in sorted(self.dots.items())]
+            report = {'seconds': total, 'phases': phases, 'dots': dots}
+            if self.memory:
+                steps = np.array(self.step_bytes, dtype=np.float64)
+                report['memory'] = {
+                    'steps': int(steps.size),
+                    'mean_bytes_per_step': float(steps.mean()) if steps.size else 0.0,
+                    'max_bytes_per_step': float(steps.max()) if steps.size else 0.0,
+                }
+        return report
+
+    def end_epoch(self, epoch):
+        # Keeps the report of the epoch in self.reports, prints it when verbose, then starts over
+        report = self.report()
+        report['epoch'] = epoch
+        self.reports.append(report)
+        if self.verbose:
+            print_report(report)
+        self.reset()
+        return report
+
+    def print_report(self):
+        print_report(self.report())
+
+
+def _reset_peak():
+    # tracemalloc.reset_peak exists from Python 3.9, earlier the peak covers the whole run
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+
+def print_report(report):
+    title = "Profile" if 'epoch' not in report else "Profile of epoch #{}".format(report['epoch'])
+    print("{} ({:.3f} s)".format(title, report['seconds']))
+    print("  {:<28}{:>8}{:>12}{:>8}".format("Phase", "Calls", "Time (s)", "Share"))
+    for phase in report['phases']:
+        print("  {:<28}{:>8}{:>12.4f}{:>7.1f}%".format(
+            phase['phase'], phase['calls'], phase['seconds'], 100 * phase['share']))
+    print("  {:<28}{:<24}{:>8}{:>12}{:>10}".format("Dot in phase", "Shape", "Calls", "Time (s)", "GFLOP/s"))
+    for dot in report['dots']:
+        print("  {:<28}{:<24}{:>8}{:>12.4f}{:>10.2f}".format(
+            dot['phase'], dot['shape'], dot['calls'], dot['seconds'], dot['gflops']))
+    if 'memory' in report:
+        memory = report['memory']
+        print("  Allocated per step: mean {:.1f} KiB, max {:.1f} KiB over {} steps".format(
+            memory['mean_bytes_per_step'] / 1024, memory['max_bytes_per_step'] / 1024, memory['steps']))
+
+
+def active():
+    return _active
+
+
+def phase(name):
+    profiler = _active
+    if profiler is None:
+        return DISABLED
+    return _Phase(profiler, name)
+
+
+def dot(a, b, out=None):
+    profiler = _active
+    if profiler is None:
+        return np.dot(a, b, out=out)
+    return profiler.dot(a, b, out)
+
+
+def step():
+    profiler = _active
+    if profiler is not None:
+        profiler.step()
+
+
+def end_epoch(epoch):
+    profiler = _active
+    if profiler is not None:
+        profiler.end_epoch(epoch)
@@ -0,0 +1,134 @@
+import numpy as np
+
+import time
+
+import mnist_idx
+
+
+# Int8 post-training quantization of OneHiddenLayer/TwoHiddenLayer weights
+# Weights use one symmetric scale per output channel (column), activations one scale per layer
+# calibrated on a sample of training data. Products of int8 values are accumulated exactly,
+# as int32 would, see QuantizedNetwork.matmul
+
+QMAX = 127
+
+# Integers up to 2^24 are exact in float32, up to 2^53 in float64
+FLOAT32_EXACT = 2 ** 24
+
+
+def quantize_weight(weight):
+    # Per output channel symmetric quantization, returns int8 weights and float32 scales
+    weight = np.asarray(weight, dtype=np.float64)
+    scale = np.max(np.abs(weight), axis=0) / QMAX
+    scale[scale == 0] = 1
+    quantized = np.clip(np.rint(weight / scale), -QMAX, QMAX).astype(np.int8)
+    return quantized, scale.astype(np.float32)
+
+
+def quantize_activation(x, scale):
+    # ReLU activations and pixels are never negative, so only [0, 127] is used
+    return np.clip(np.rint(x / scale), 0, QMAX).astype(np.int8)
+
+
+class QuantizedNetwork(object):
+    # Int8 inference engine, same forward pass as NeuralNetwork.forward_with:
+    # ReLU hidden layers and softmax output
+
+    def __init__(self, weights, weight_scales, input_scales, kernel='auto'):
+        # kernel='int32' runs integer matmuls with int32 accumulation (NumPy has no integer BLAS, slow)
+        # kernel='auto' runs the same int8 products through float BLAS, picking float32 when the
+        # sum cannot exceed 2^24 and float64 otherwise, so the result is bit-identical to int32
+        self.weights = weights
+        self.weight_scales = weight_scales
+        self.input_scales = input_scales
+        self.kernel = kernel
+        self.accumulators = []
+        for weight in weights:
+            bound = weight.shape[0] * QMAX * QMAX
+            self.accumulators.append(np.float32 if bound < FLOAT32_EXACT else np.float64)
+        # Dequantization scales in float64 so every kernel gives the same result
+        self.output_scales = [np.float64(input_scale) * scale.astype(np.float64)
+                              for input_scale, scale in zip(input_scales, weight_scales)]
+        # Casted copies of the int8 weights for the BLAS kernels
+        self.blas_weights = [weight.astype(accumulator) for weight, accumulator in zip(weights, self.accumulators)]
+
+    @classmethod
+    def calibrate(cls, network, samples, percentile=99.99, kernel='auto'):
+        # Quantizes the weights of a network and calibrates the activation scales on samples
+        weights = network.inference_weights()
+        quantized, weight_scales, input_scales = [], [], []
+
+        activation = network.prepare_input(samples)
+        for l, weight in enumerate(weights):
+            # Outliers are clipped at the given percentile of the calibration activations
+            bound = np.percentile(activation, percentile) if activation.size else 1
+            input_scales.append(np.float32(max(bound, 1e-8) / QMAX))
+            q, scale = quantize_weight(weight)
+            quantized.append(q)
+            weight_scales.append(scale)
+            if l < len(weights) - 1:
+                activation = network.relu(np.dot(activation, weight))
+
+        return cls(quantized, weight_scales, input_scales, kernel)
+
+    def matmul(self, l, x):
+        # Integer matmul of int8 inputs with the int8 weights of layer l, exact int32 accumulation
+        if self.kernel == 'int32':
+            return np.matmul(x, self.weights[l], dtype=np.int32)
+        accumulator = self.accumulators[l]
+        return np.dot(x.astype(accumulator), self.blas_weights[l])
+
+    def logits(self, x):
+        if x.dtype == np.uint8:
+            x = mnist_idx.normalize(x)
+        for l in range(len(self.weights)):
+            accumulated = self.matmul(l, quantize_activation(x, self.input_scales[l]))
+            # Dequantization with the input scale and the per-channel weight scales
+            x = accumulated * self.output_scales[l]
+            if l < len(self.weights) - 1:
+                np.maximum(x, 0, out=x)
+        return x
+
+    def predict_proba(self, x):
+        # Softmax output, see NeuralNetwork.softmax_cross_entropy
+        logits = np.asarray(self.logits(x), dtype=np.float64)
+        logits -= np.max(logits, axis=1, keepdims=True)
+        np.exp(logits, out=logits)
+        logits /= np.sum(logits, axis=1, keepdims=True)
+        return logits
+
+    def predict(self, x):
+        return np.argmax(self.logits(x), axis=1)
+
+    def nbytes(self):
+        # Size of the int8 weights and their scales
+        return sum(weight.nbytes + scale.nbytes + 4 for weight, scale in zip(self.weights, self.weight_scales))
+
+    def save(self, filename):
+        # Saves the int8 weights, per-channel scales and activation scales
+        arrays = dict()
+        for l, (weight, scale, input_scale) in enumerate(zip(self.weights, self.weight_scales, self.input_scales)):
+            name = "W{}".format(l + 1)
+            arrays[name] = weight
+            arrays[name + "_scale"] = scale
+            arrays[name + "_input_scale"] = np.float32(input_scale)
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename, kernel='auto'):
+        with np.load(filename) as arrays:
+            layers = sorted((name for name in arrays.files if '_' not in name), key=lambda name: int(name[1:]))
+            return cls([arrays[name] for name in layers],
+                       [arrays[name + "_scale"] for name in layers],
+                       [arrays[name + "_input_scale"][()] for name in layers], kernel)
+
+
+def latency(predict, x, repeats=20):
+    # Median wall time of one call in milliseconds
+    predict(x)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(x)
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+import glob
+import os
+import threading
+
+import neural_network as nn
+import weight_format
+
+
+# Registry of the trained networks in output/weights, loaded on first use
+# Loaded networks are kept in a least recently used cache bounded by the total size of their weights
+
+DEFAULT_DIRECTORY = "output/weights"
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+
+# The memory-mapped format is preferred when a network was saved in both formats
+WEIGHT_EXTENSIONS = (weight_format.EXTENSION, '.pickle')
+
+
+def model_bytes(network):
+    return sum(weight.nbytes for weight in network.model.values())
+
+
+class ModelRegistry(object):
+    # Thread-safe: get can be called from any number of threads, every network is read from disk
+    # once while it stays cached, concurrent requests for a network being loaded wait for that load
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES, dtype=None, storage_dtype=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.storage_dtype = storage_dtype
+
+        self.lock = threading.Lock()
+        self.files = dict()
+        self.cache = OrderedDict()
+        self.sizes = dict()
+        self.loading = dict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.scan()
+
+    def scan(self):
+        # Finds the weight files of the directory, called again to pick up newly trained networks
+        files = dict()
+        for extension in reversed(WEIGHT_EXTENSIONS):
+            for filename in glob.glob(os.path.join(self.directory, "*" + extension)):
+                files[os.path.splitext(os.path.basename(filename))[0]] = filename
+        with self.lock:
+            self.files = files
+        return sorted(files)
+
+    def names(self):
+        with self.lock:
+            return sorted(self.files)
+
+    def __contains__(self, name):
+        with self.lock:
+            return name in self.files
+
+    def __len__(self):
+        with self.lock:
+            return len(self.files)
+
+    def load(self, name):
+        # Reads a network from disk, bypassing the cache
+        # Unknown names trigger a new scan, the network may have been trained since the last one
+        if name not in self:
+            self.scan()
+        with self.lock:
+            if name not in self.files:
+                raise KeyError("No weights for network {} in {}".format(name, self.directory))
+            filename = self.files[name]
+        return nn.load_network(filename, self.dtype, self.storage_dtype)
+
+    def get(self, name):
+        # Returns the cached network, loading it on a miss
+        with self.lock:
+            network = self._lookup(name)
+            if network is not None:
+                self.hits += 1
+                return network
+            loading = self.loading.setdefault(name, threading.Lock())
+
+        # One load per network at a time, the cache lock is not held while reading the file
+        # A request that waited for another thread's load is a hit, misses count the reads from disk
+        with loading:
+            try:
+                with self.lock:
+                    network = self._lookup(name)
+                    if network is not None:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                if network is None:
+                    network = self.load(name)
+                    with self.lock:
+                        self._insert(name, network)
+            finally:
+                with self.lock:
+                    self.loading.pop(name, None)
+        return network
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def _lookup(self, name):
+        # Caller holds the lock
+        network = self.cache.get(name)
+        if network is not None:
+            self.cache.move_to_end(name)
+        return network
+
+    def _insert(self, name, network):
+        # Caller holds the lock
+        # A network larger than the whole cache is returned to the caller but not kept
+        size = model_bytes(network)
+        if size > self.max_bytes:
+            return
+        self.cache[name] = network
+        self.sizes[name] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        # Caller holds the lock
+        # Callers still holding the evicted network can keep using it
+        name, _ = self.cache.popitem(last=False)
+        self.bytes -= self.sizes.pop(name)
+        self.evictions += 1
+
+    def evict(self, name):
+        # Drops a network from the cache, e.g. after retraining it
+        with self.lock:
+            if name in self.cache:
+                self.cache.move_to_end(name, last=False)
+                self._evict()
+
+    def clear(self):
+        with self.lock:
+            while self.cache:
+                self._evict()
+
+    def cached(self):
+        # Cached network names, least recently used first
+        with self.lock:
+            return list(self.cache)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'models': len(self.files),
+                'cached': len(self.cache),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
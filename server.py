@@ -0,0 +1,322 @@
+"""
+Local inference server with dynamic micro-batching
+
+Requests are queued and grouped into micro-batches of at most max_batch_size images, waiting at most
+max_wait seconds for a batch to fill. Every micro-batch runs in a single forward on an executor thread.
+
+    python server.py --model network_one_128 [--port 8000] [--max-batch-size 64] [--max-wait-ms 2]
+
+HTTP endpoints:
+    POST /predict   784 raw uint8 pixels (a utils.load_image row) or JSON {"pixels": [...]}
+                    returns JSON {"prediction": k, "probabilities": [...]}, 503 when the queue is full
+    GET  /stats     request counts, batch sizes and latency percentiles
+
+Only asyncio streams from the standard library are used, no web framework.
+"""
+
+import numpy as np
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+
+from registry import ModelRegistry
+
+
+PIXELS = 784
+
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+class Overloaded(Exception):
+    # Raised when the request queue is full, the client should retry later
+    pass
+
+
+class LatencyHistogram(object):
+    # Log-spaced buckets from 10 microseconds to 100 seconds, about 5% relative error on percentiles
+
+    def __init__(self, minimum=1e-5, maximum=100.0, ratio=1.05):
+        self.bounds = minimum * ratio ** np.arange(int(np.ceil(np.log(maximum / minimum) / np.log(ratio))) + 1)
+        self.counts = np.zeros(self.bounds.size + 1, dtype=np.int64)
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        self.counts[np.searchsorted(self.bounds, seconds)] += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th percentile, in seconds
+        count = self.count()
+        if count == 0:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(self.counts), q / 100 * count))
+        return float(min(self.bounds[min(bucket, self.bounds.size - 1)], self.maximum))
+
+    def summary(self):
+        # Milliseconds, as reported by /stats
+        count = self.count()
+        return {
+            'count': count,
+            'mean': 1000 * self.total / count if count else 0.0,
+            'p50': 1000 * self.percentile(50),
+            'p90': 1000 * self.percentile(90),
+            'p99': 1000 * self.percentile(99),
+            'max': 1000 * self.maximum,
+        }
+
+
+class MicroBatcher(object):
+    # Groups concurrent submits into batches for predict(batch) -> rows of probabilities
+    # predict runs on a single executor thread, one batch at a time: requests arriving meanwhile
+    # form the next batch. The queue is bounded, submit raises Overloaded when it is full
+
+    def __init__(self, predict, max_batch_size=64, max_wait=0.002, max_queue=1024):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Reused input batch, the executor only reads it while the batching loop waits
+        self.batch = np.empty((max_batch_size, PIXELS), dtype=np.uint8)
+        self.task = None
+
+        self.rejected = 0
+        self.batches = 0
+        self.batched = 0
+        self.latency = LatencyHistogram()
+        self.queue_latency = LatencyHistogram()
+        self.inference_latency = LatencyHistogram()
+
+    def start(self):
+        # Called from the event loop, the batching task runs on it
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, pixels):
+        # Returns the probabilities of one image of 784 uint8 pixels
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((pixels, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise Overloaded()
+        return await future
+
+    async def collect(self):
+        # Waits for one request, then for more until the batch is full or max_wait has passed
+        loop = asyncio.get_running_loop()
+        requests = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(requests) < self.max_batch_size:
+            if not self.queue.empty():
+                requests.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                requests.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return requests
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = await self.collect()
+            # Clients that went away while queued are skipped
+            requests = [request for request in requests if not request[1].cancelled()]
+            if not requests:
+                continue
+            batch = self.batch[:len(requests)]
+            for i, (pixels, _, _) in enumerate(requests):
+                batch[i] = pixels
+
+            start = time.perf_counter()
+            try:
+                probabilities = await loop.run_in_executor(self.executor, self.predict, batch)
+            except Exception as error:
+                for _, future, _ in requests:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            end = time.perf_counter()
+
+            self.batches += 1
+            self.batched += len(requests)
+            self.inference_latency.record(end - start)
+            for i, (_, future, queued) in enumerate(requests):
+                self.queue_latency.record(start - queued)
+                self.latency.record(end - queued)
+                if not future.done():
+                    future.set_result(probabilities[i])
+
+    def stats(self):
+        return {
+            'requests': self.batched,
+            'rejected': self.rejected,
+            'queued': self.queue.qsize(),
+            'batches': self.batches,
+            'mean_batch_size': self.batched / self.batches if self.batches else 0.0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': 1000 * self.max_wait,
+            'latency_ms': self.latency.summary(),
+            'queue_ms': self.queue_latency.summary(),
+            'inference_ms': self.inference_latency.summary(),
+        }
+
+
+def parse_pixels(body, content_type):
+    # Raw bytes or a JSON list of pixels, 0-255 integers as produced by utils.load_image
+    if content_type.startswith('application/json'):
+        try:
+            pixels = np.asarray(json.loads(body.decode('utf-8'))['pixels'], dtype=np.float64)
+        except TypeError:
+            raise ValueError("pixels must be a list of numbers")
+        if np.any(pixels < 0) or np.any(pixels > 255):
+            raise ValueError("pixels must be in [0, 255]")
+        if np.any(pixels != np.floor(pixels)):
+            raise ValueError("pixels must be integers")
+        pixels = pixels.astype(np.uint8)
+    else:
+        pixels = np.frombuffer(body, dtype=np.uint8)
+    if pixels.size != PIXELS:
+        raise ValueError("expected {} pixels, got {}".format(PIXELS, pixels.size))
+    return pixels.reshape(-1)
+
+
+class InferenceServer(object):
+    # Minimal HTTP/1.1 server with keep-alive in front of a MicroBatcher
+
+    def __init__(self, network, host='127.0.0.1', port=8000, max_batch_size=64, max_wait=0.002,
+                 max_queue=1024):
+        self.network = network
+        self.host = host
+        self.port = port
+        # predict_proba is stateless, chunk_size keeps each micro-batch in one matmul per layer
+        self.batcher = MicroBatcher(lambda batch: network.predict_proba(batch, chunk_size=max_batch_size),
+                                    max_batch_size, max_wait, max_queue)
+        self.server = None
+
+    async def start(self):
+        self.batcher.start()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.batcher.close()
+
+    async def respond(self, request):
+        # Returns status and JSON body of one request (method, path, headers, body)
+        method, path, headers, body = request
+        if method == 'GET' and path == '/stats':
+            return 200, self.batcher.stats()
+        if method != 'POST' or path != '/predict':
+            return 404, {'error': "unknown endpoint " + path}
+        try:
+            pixels = parse_pixels(body, headers.get('content-type', ''))
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, {'error': str(error)}
+        try:
+            probabilities = await self.batcher.submit(pixels)
+        except Overloaded:
+            return 503, {'error': "queue full"}
+        return 200, {'prediction': int(np.argmax(probabilities)), 'probabilities': probabilities.tolist()}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as error:
+                    # The stream position is unknown after a malformed request, the connection is closed
+                    write_response(writer, 400, {'error': str(error)})
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                status, payload = await self.respond(request)
+                write_response(writer, status, payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    # Returns (method, path, headers, body), None once the client closed the connection
+    # Raises ValueError on a malformed request line or Content-Length
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split(' ', 2)
+    if len(parts) != 3:
+        raise ValueError("malformed request line")
+    method, path, _ = parts
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get('content-length', '0')
+    if not length.isdigit():
+        raise ValueError("invalid Content-Length: " + length)
+    body = await reader.readexactly(int(length))
+    return method, path, headers, body
+
+
+def write_response(writer, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+        status, STATUS[status], len(body)).encode('latin-1') + body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--model', default="network_one_128", help="network name in the weights directory")
+    parser.add_argument('--weights', default="output/weights")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--max-queue', type=int, default=1024)
+    args = parser.parse_args()
+
+    network = ModelRegistry(args.weights).get(args.model)
+    server = InferenceServer(network, args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000,
+                             args.max_queue)
+
+    async def serve():
+        await server.start()
+        print("Serving {} on http://{}:{}".format(args.model, args.host, args.port), flush=True)
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import numpy as np
+
+import itertools
+import os
+import shutil
+import time
+
+import checkpoint
+import neural_network as nn
+import parallel
+import weight_format
+
+
+# Parallel hyperparameter sweep over network architectures
+# Each configuration is trained on its own worker process, the data set is shared
+# between the workers through shared memory instead of a pickled copy per task
+
+ARCHITECTURES = {
+    'one': 1,
+    'two': 2,
+}
+
+# Defaults used by main.py, omitted from the output names
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_EPOCHS = 4
+
+# Seconds between the checkpoints of a running configuration
+CHECKPOINT_SECONDS = 300
+
+# Data set views attached once per worker process
+_shared = dict()
+
+
+def grid(architectures=('one', 'two'), hidden=(128, 256, 512, 1024, 2048),
+         batch_sizes=(DEFAULT_BATCH_SIZE,), epochs=(DEFAULT_EPOCHS,), seed=0):
+    # Declarative grid: one configuration per combination
+    configs = []
+    for architecture, width, batch_size, epoch in itertools.product(architectures, hidden, batch_sizes, epochs):
+        if architecture not in ARCHITECTURES:
+            raise ValueError("Unknown architecture: " + str(architecture))
+        configs.append({
+            'architecture': architecture,
+            'hidden': width,
+            'batch_size': batch_size,
+            'epochs': epoch,
+            'seed': seed,
+        })
+    return configs
+
+
+def config_name(config):
+    # Same naming as main.py: one_128, two_2048, ...
+    name = "{}_{}".format(config['architecture'], config['hidden'])
+    if config['batch_size'] != DEFAULT_BATCH_SIZE:
+        name += "_b{}".format(config['batch_size'])
+    if config['epochs'] != DEFAULT_EPOCHS:
+        name += "_e{}".format(config['epochs'])
+    return name
+
+
+def build_network(architecture, inputs, hidden, outputs, **kwargs):
+    # Creates the network class matching an architecture name
+    if ARCHITECTURES[architecture] == 1:
+        return nn.OneHiddenLayer(inputs, hidden, outputs, **kwargs)
+    return nn.TwoHiddenLayer(inputs, hidden, hidden, outputs, **kwargs)
+
+
+def _initialize(train, test):
+    _shared['train'] = parallel.attach_dict(train)
+    _shared['test'] = parallel.attach_dict(test)
+
+
+def run_config(config, train=None, test=None, output="output"):
+    # Trains, plots, saves and tests one configuration
+    train = _shared['train'] if train is None else train
+    test = _shared['test'] if test is None else test
+    name = config_name(config)
+
+    np.random.seed(config['seed'])
+    inputs = train['images'].shape[1]
+    outputs = int(train['labels'].max()) + 1
+    network = build_network(config['architecture'], inputs, config['hidden'], outputs)
+
+    # A configuration interrupted by a crash continues from its latest checkpoint
+    checkpoints = os.path.join(output, "checkpoints", "network_" + name)
+    resume_from = checkpoints if checkpoint.checkpoints(checkpoints) else None
+
+    start = time.perf_counter()
+    network.train(train['images'], train['labels'], config['batch_size'], config['epochs'],
+                  checkpointer=checkpoint.Checkpointer(checkpoints, every_seconds=CHECKPOINT_SECONDS),
+                  resume_from=resume_from)
+    train_time = time.perf_counter() - start
+    network.plot("network_" + name, os.path.join(output, "plot"))
+
+    directory = os.path.join(output, "weights")
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    network.save(os.path.join(directory, "network_" + name + weight_format.EXTENSION))
+    # The weights are saved, the checkpoints are not needed anymore
+    shutil.rmtree(checkpoints, ignore_errors=True)
+
+    loss, accuracy = network.test(test['images'], test['labels'])
+
+    result = dict(config)
+    result.update({
+        'name': name,
+        'loss': float(loss),
+        'accuracy': float(accuracy),
+        'train_time': train_time,
+        'pid': os.getpid(),
+    })
+    return result
+
+
+def run_sweep(configs, train, test, processes=None, threads=1, output="output"):
+    # Runs every configuration on a process pool, BLAS is pinned to threads per worker
+    processes = processes or os.cpu_count() or 1
+    processes = min(processes, len(configs))
+
+    if processes <= 1:
+        results = [run_config(config, train, test, output) for config in configs]
+    else:
+        pool = parallel.process_pool(processes, threads, _initialize,
+                                     (parallel.share_dict(train), parallel.share_dict(test)))
+        try:
+            # Largest networks first so the slowest tasks do not end up last
+            order = sorted(range(len(configs)),
+                           key=lambda i: -ARCHITECTURES[configs[i]['architecture']] * configs[i]['hidden'])
+            done = pool.starmap(run_config, [(configs[i], None, None, output) for i in order], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        results = [None] * len(configs)
+        for i, result in zip(order, done):
+            results[i] = result
+
+    write_summary(results, os.path.join(output, "sweep_summary.csv"))
+    return results
+
+
+def write_summary(results, filename):
+    # Summary table as CSV
+    columns = ['name', 'architecture', 'hidden', 'batch_size', 'epochs', 'loss', 'accuracy', 'train_time']
+    with open(filename, 'w') as handle:
+        handle.write(",".join(columns) + "\n")
+        for result in results:
+            handle.write(",".join(str(result[column]) for column in columns) + "\n")
+
+
+def print_summary(results):
+    print("{:<16}{:>12}{:>12}{:>14}".format("Network", "Loss", "Accuracy", "Train (s)"))
+    for result in results:
+        print("{:<16}{:>12.4f}{:>12.4f}{:>14.1f}".format(
+            result['name'], result['loss'], result['accuracy'], result['train_time']))
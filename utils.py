@@ -1,11 +1,29 @@
-import matplotlib.pyplot as plt
 from PIL import Image
 import numpy as np
-# import os  # in case of file saving
+
+import glob
+import hashlib
+import io
+import os
+
+import mnist_idx
+import parallel
+
+
+IMAGE_SIZE = (28, 28)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# Preprocessed images, one .npy file per image content hash
+DEFAULT_CACHE = "output/cache/images"
+
+# Below this many images decoding in the parent is faster than starting a pool
+PARALLEL_THRESHOLD = 64
 
 
 def visualize_image(x, title):
     # Based on: https://www.quora.com/How-can-l-visualize-cifar-10-data-RGB-using-python-matplotlib
+    # matplotlib is only imported when plotting, the image pool workers never need it
+    import matplotlib.pyplot as plt
     img = x.reshape(28, 28)
     plt.imshow(img, cmap='gray')
     plt.title("Feed backward of " + title)
@@ -24,6 +42,7 @@ def visualize_image(x, title):
 
 def plot_probability(probability):
     # Based on: https://plot.ly/matplotlib/bar-charts/
+    import matplotlib.pyplot as plt
     y = probability
     x = range(10)
     width = 1 / 1.5
@@ -31,17 +50,82 @@ def plot_probability(probability):
     plt.show()
 
 
-def load_image(file):
-    # Receive a file path in string
-    image = Image.open(file)
+def decode_image(data):
+    # Decodes image bytes into one 784 row of uint8 pixels, the format of the MNIST images
+    image = Image.open(io.BytesIO(data))
     # Converting to B&W
     image = image.convert('L')
     # Resizing
-    image = image.resize((28, 28))
-    # Get image as numpy array
-    raw_image = np.array(list(image.getdata()))
-    raw_image = raw_image.reshape(1, raw_image.shape[0])
-    # Close image
+    image = image.resize(IMAGE_SIZE)
+    # Pixels straight from the PIL buffer, normalized like the training images by the network
+    raw_image = np.asarray(image, dtype=np.uint8).reshape(-1)
     image.close()
+    return raw_image
+
+
+def load_image(file):
+    # Receive a file path in string, returns a 1x784 row of uint8 pixels
+    with open(file, 'rb') as handle:
+        return decode_image(handle.read()).reshape(1, -1)
+
+
+def image_files(pattern):
+    # A directory, a glob pattern or a list of file names
+    if isinstance(pattern, (list, tuple)):
+        return list(pattern)
+    if os.path.isdir(pattern):
+        return sorted(name for extension in IMAGE_EXTENSIONS
+                      for name in glob.glob(os.path.join(pattern, "*" + extension)))
+    return sorted(glob.glob(pattern))
+
+
+def cache_file(cache, data):
+    # Preprocessed pixels are keyed by the hash of the file content and the target size
+    key = hashlib.sha1(data)
+    key.update("{}x{}".format(*IMAGE_SIZE).encode())
+    return os.path.join(cache, key.hexdigest() + ".npy")
+
+
+def load_images(pattern, processes=None, cache=DEFAULT_CACHE, dtype=None):
+    # Loads every image into one n x 784 batch, ready for a single forward
+    # Images are decoded on a process pool, already decoded images are read back from the cache
+    # Returns the file names and uint8 pixels, or pixels scaled into [0, 1] in dtype like mnist_idx.normalize
+    files = image_files(pattern)
+    images = np.empty((len(files), IMAGE_SIZE[0] * IMAGE_SIZE[1]), dtype=np.uint8)
+
+    missing = []
+    for i, file in enumerate(files):
+        with open(file, 'rb') as handle:
+            data = handle.read()
+        cached = cache_file(cache, data) if cache else None
+        if cached and os.path.exists(cached):
+            images[i] = np.load(cached)
+        else:
+            missing.append((i, data, cached))
+
+    processes = processes or os.cpu_count() or 1
+    datas = [data for _, data, _ in missing]
+    if processes > 1 and len(missing) >= PARALLEL_THRESHOLD:
+        # Decoding does not use BLAS, one thread per worker
+        pool = parallel.process_pool(min(processes, len(missing)), 1)
+        try:
+            decoded = pool.map(decode_image, datas, chunksize=max(1, len(datas) // (4 * processes)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        decoded = [decode_image(data) for data in datas]
+
+    if cache and missing:
+        os.makedirs(cache, exist_ok=True)
+    for (i, _, cached), pixels in zip(missing, decoded):
+        images[i] = pixels
+        if cached:
+            # Renamed once complete, concurrent loaders never read a partial file
+            with open(cached + ".tmp", 'wb') as handle:
+                np.save(handle, pixels)
+            os.replace(cached + ".tmp", cached)
 
-    return raw_image
\ No newline at end of file
+    if dtype is not None:
+        images = mnist_idx.normalize(images, dtype)
+    return files, images
@@ -0,0 +1,124 @@
+"""
+Self-describing weight file format
+
+Layout:
+    magic 'NNWF', uint32 format version, uint32 header length (little-endian)
+    JSON header: network class, compute/storage dtypes and one entry per weight
+    raw C-ordered arrays, each one starting at a multiple of ALIGNMENT bytes
+
+Weights are memory-mapped copy-on-write on load, nothing is read or copied until used.
+
+Converting the old pickle files:
+    python weight_format.py output/weights/*.pickle
+"""
+
+import numpy as np
+import pickle
+
+import json
+import os
+import struct
+import sys
+
+
+MAGIC = b'NNWF'
+VERSION = 1
+ALIGNMENT = 64
+EXTENSION = '.nnw'
+
+PREAMBLE = struct.Struct('<4sII')
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def network_class_name(model):
+    # Class used by the old pickles, which only store the weights
+    return 'TwoHiddenLayer' if 'W3' in model else 'OneHiddenLayer'
+
+
+def is_weight_file(filename):
+    # True when the file starts with the format magic
+    with open(filename, 'rb') as handle:
+        return handle.read(len(MAGIC)) == MAGIC
+
+
+def write(filename, model, network_class=None, dtype=None):
+    # Writes the weights with a header describing the network
+    names = sorted(model, key=lambda name: int(name[1:]))
+    arrays = [np.ascontiguousarray(model[name]) for name in names]
+
+    header = {
+        'version': VERSION,
+        'class': network_class or network_class_name(model),
+        'dtype': np.dtype(dtype or arrays[0].dtype).name,
+        'storage_dtype': arrays[0].dtype.name,
+        'weights': [],
+    }
+    # Offsets depend on the header length, which depends on the offsets: repeat until stable
+    entries = [{'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': 0}
+               for name, array in zip(names, arrays)]
+    header['weights'] = entries
+    start = None
+    while True:
+        encoded = json.dumps(header, sort_keys=True).encode('utf-8')
+        data_start = _align(PREAMBLE.size + len(encoded))
+        if data_start == start:
+            break
+        start = offset = data_start
+        for entry, array in zip(entries, arrays):
+            entry['offset'] = offset
+            offset = _align(offset + array.nbytes)
+
+    # Written next to the target and renamed, readers never see a partial file
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as handle:
+        handle.write(PREAMBLE.pack(MAGIC, VERSION, len(encoded)))
+        handle.write(encoded)
+        for entry, array in zip(entries, arrays):
+            handle.seek(entry['offset'])
+            handle.write(array.tobytes())
+    os.replace(temporary, filename)
+
+
+def read_header(filename):
+    with open(filename, 'rb') as handle:
+        magic, version, length = PREAMBLE.unpack(handle.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError("Not a weight file: " + filename)
+        if version > VERSION:
+            raise ValueError("Unsupported weight file version {} in {}".format(version, filename))
+        return json.loads(handle.read(length).decode('utf-8'))
+
+
+def read(filename, mmap=True):
+    # Returns the header and the weights dictionary
+    # With mmap the arrays are copy-on-write views of the file: writable, never written back
+    header = read_header(filename)
+    model = dict()
+    for entry in header['weights']:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        if mmap:
+            model[entry['name']] = np.memmap(filename, dtype=dtype, mode='c', offset=entry['offset'], shape=shape)
+        else:
+            count = int(np.prod(shape))
+            with open(filename, 'rb') as handle:
+                handle.seek(entry['offset'])
+                model[entry['name']] = np.fromfile(handle, dtype=dtype, count=count).reshape(shape)
+    return header, model
+
+
+def convert(filename, output=None):
+    # Converts an old pickle weights file, returns the new file name
+    with open(filename, 'rb') as handle:
+        model = pickle.load(handle)
+    output = output or os.path.splitext(filename)[0] + EXTENSION
+    write(output, model)
+    return output
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(path, "->", convert(path))